@@ -1,11 +1,11 @@
 from flask import Flask
+import click
 from config import Config
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
-from logging.handlers import RotatingFileHandler
-import logging
-import os
+from app.logging_setup import configure_logging
+from app.metrics import init_metrics
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -14,21 +14,13 @@ migrate = Migrate(app, db)
 login = LoginManager(app)
 login.login_view = 'login'
 
+configure_logging(app) # Levels from the config, outside of debug mode a queued JSON lines log file
 if not app.debug:
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/travel_planner.log', 
-                                       maxBytes=10240, backupCount=10) # Chose rotating file handler to limit size of log file
-    file_handler.setFormatter(logging.Formatter(
-         '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')) # Format of log messages
-    file_handler.setLevel(logging.DEBUG)
-    app.logger.addHandler(file_handler)
-
-    app.logger.setLevel(logging.DEBUG)
     app.logger.info('Starting up Travel Planner!')
 
 from app.plotlydash.dashboard import init_dash_app
 app = init_dash_app(app)
+metrics_registry = init_metrics(app) # Request, Dash callback and SQL histograms served on /metrics
 from app import routes, models, errors
 
 @app.cli.command('update_exchange_rates')
@@ -38,6 +30,77 @@ def update_exchange_rates_command():
     update_exchange_rates()
     print("Exchange rates updated.")
     
+@app.cli.command('rebuild_cost_summary')
+@click.option('--check', is_flag=True, help='Only report drift between the summary and the components, without rebuilding.')
+def rebuild_cost_summary_command(check):
+    """Command line command for rebuilding the trip cost summary from the components table."""
+    drift = models.TripCostSummary.find_drift()
+    for row in drift:
+        print(f"Drift in trip {row['trip_id']}, category {row['category_id']}, participant {row['participant_id']}, "
+              f"{row['currency']}, active {row['is_active']}: expected {row['expected']}, stored {row['stored']}")
+    if check:
+        print(f"Found {len(drift)} drifted summary rows.")
+        if drift:
+            raise SystemExit(1)
+        return
+    count = models.TripCostSummary.rebuild()
+    db.session.commit()
+    print(f"Trip cost summary rebuilt with {count} rows.")
+    
+@app.cli.command('import_components')
+@click.argument('trip_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='File format, by default taken from the file extension.')
+@click.option('--batch-size', type=int, help='Rows per INSERT statement, IMPORT_BATCH_SIZE by default.')
+def import_components_command(trip_id, path, fmt, batch_size):
+    """Command line command for importing components into a trip from a CSV or JSON lines file."""
+    from app.bulk_import.components import detect_format, import_components
+    if db.session.get(models.Trip, trip_id) is None:
+        raise click.ClickException(f"Trip {trip_id} not found.")
+    with open(path, 'rb') as stream:
+        result = import_components(trip_id, stream, detect_format(path, fmt), batch_size=batch_size)
+    for error in result["errors"]:
+        print(f"Line {error['line']}: {' '.join(error['errors'])}")
+    print(f"Imported {result['imported']} components, rejected {result['error_count']} rows.")
+
+@app.cli.command('report_worker')
+@click.option('--processes', type=int, help='Reports built at the same time, REPORT_WORKERS by default.')
+@click.option('--poll-interval', type=float, help='Seconds between queue polls while idle, REPORT_POLL_INTERVAL by default.')
+@click.option('--once', is_flag=True, help='Exit once the queue is empty instead of waiting for new jobs.')
+def report_worker_command(processes, poll_interval, once):
+    """Command line command for running a pool of processes building the queued trip reports."""
+    from app.reports.worker import run_worker
+    finished = run_worker(processes or app.config['REPORT_WORKERS'],
+                          poll_interval or app.config['REPORT_POLL_INTERVAL'], once=once)
+    print(f"Report worker finished {finished} jobs.")
+
+@app.cli.command('load_test')
+@click.option('--users', type=int, default=8, show_default=True, help='Concurrent virtual users, each with its own account and trip.')
+@click.option('--duration', type=float, default=60, show_default=True, help='Seconds of load after the users are set up.')
+@click.option('--workers', type=int, default=4, show_default=True, help='Gunicorn worker processes of the started server.')
+@click.option('--components', type=int, default=200, show_default=True, help='Components imported into every trip before the load.')
+@click.option('--database-url', help='Throwaway SQLite or MySQL database of the started server, a fresh SQLite file by default.')
+@click.option('--server-url', help='Load an already running, seeded server instead of starting one.')
+@click.option('--think-time', type=float, default=0.0, show_default=True, help='Mean seconds between the actions of a user.')
+@click.option('--timeout', type=float, default=30.0, show_default=True, help='Seconds before a request counts as failed.')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed of the users\' random actions.')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), help='Also write the report as JSON to this file.')
+def load_test_command(users, duration, workers, components, database_url, server_url, think_time, timeout, seed, output):
+    """Command line command for load testing the app under gunicorn with virtual users logging in, opening their trip,
+    changing dashboard filters and adding or toggling components. Reports throughput, latency percentiles and error rates per endpoint."""
+    import json
+    from app.loadtest.harness import run_load_test, format_report
+    try:
+        report = run_load_test(users, duration, workers=workers, components=components, database_url=database_url,
+                               server_url=server_url, think_time=think_time, timeout=timeout, seed=seed)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    print(format_report(report))
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"Report written to {output}.")
+
 @app.cli.command('seed')
 def seed():
     """Command line command for populating the database with initial data."""
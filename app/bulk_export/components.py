@@ -0,0 +1,170 @@
+import csv
+import io
+import json
+import re
+import zipfile
+import sqlalchemy as sa
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from app import app, db
+from app.models import Component, ComponentCategory, ComponentType, Participant, rate_cache
+
+FORMATS = { # Export format: mimetype of the response
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+COLUMNS = ("component_name", "category", "type", "participant", "base_cost", "currency", "converted_cost",
+           "converted_currency", "is_active", "start_date", "end_date", "description", "link") # Import fields come first
+CENT = Decimal("0.01")
+XML_ILLEGAL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]") # Control characters not allowed in XML 1.0
+
+XLSX_PARTS = { # Static parts of a single sheet workbook, the sheet itself is streamed
+    "[Content_Types].xml":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    "_rels/.rels":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    "xl/workbook.xml":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Components" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    "xl/_rels/workbook.xml.rels":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>',
+}
+
+
+def iter_chunks(trip_id: int, currency: str, chunk_size: int):
+    """Stream the components of a trip in chunks of chunk_size rows, read with yield_per as plain rows
+    (no ORM objects) joined with their category, type and participant names. Costs are converted to
+    currency with one preloaded rate snapshot, so there is no rate lookup per row.
+
+    Yields:
+        list[tuple]: Rows with the values of COLUMNS"""
+    rates = rate_cache.snapshot(currency).rates
+    conversions = {} # Rate to currency per component currency, only a handful per trip
+    query = (sa.select(Component.component_name, ComponentCategory.category_name, ComponentType.type_name,
+                       Participant.participant_name, Component.base_cost, Component.currency, Component.is_active,
+                       Component.start_date, Component.end_date, Component.description, Component.link)
+             .join(ComponentCategory, Component.category_id == ComponentCategory.id)
+             .join(ComponentType, Component.type_id == ComponentType.id)
+             .outerjoin(Participant, Component.participant_id == Participant.id)
+             .where(Component.trip_id == trip_id)
+             .order_by(Component.id)
+             .execution_options(yield_per=chunk_size))
+    for partition in db.session.execute(query).partitions():
+        chunk = []
+        for name, category, type_name, participant, base_cost, component_currency, is_active, start, end, description, link in partition:
+            if component_currency not in conversions:
+                known = component_currency in rates and currency in rates
+                conversions[component_currency] = rates[currency] / rates[component_currency] if known else None
+            rate = conversions[component_currency]
+            chunk.append((name, category, type_name, participant, base_cost, component_currency,
+                          None if rate is None else (base_cost * rate).quantize(CENT), currency, is_active,
+                          start.date() if start else None, end.date() if end else None, description, link))
+        yield chunk
+
+
+def write_csv(chunks):
+    """Encode the chunks as CSV with a header row, one string per chunk. Missing values are empty and
+    is_active is written as true or false, like the import expects."""
+    active = COLUMNS.index("is_active")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for chunk in chunks:
+        writer.writerows(row[:active] + ("true" if row[active] else "false",) + row[active + 1:] for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_jsonl(chunks):
+    """Encode the chunks as JSON lines, one object per component and one string per chunk."""
+    def default(value):
+        return float(value) if isinstance(value, Decimal) else value.isoformat()
+
+    for chunk in chunks:
+        yield "".join(json.dumps(dict(zip(COLUMNS, row)), default=default) + "\n" for row in chunk)
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable file collecting the bytes written since the last drain, used as the output
+    of a streamed ZipFile."""
+    def __init__(self):
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def xlsx_cell(value) -> str:
+    """Inline cell XML of a value: numbers, booleans or text."""
+    if value is None:
+        return "<c/>"
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f"<c><v>{value}</v></c>"
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(XML_ILLEGAL.sub("", str(value)))}</t></is></c>'
+
+
+def write_xlsx(chunks):
+    """Encode the chunks as a single sheet XLSX workbook. The zip is written to a non-seekable sink, so
+    every entry is streamed with a data descriptor and each chunk's compressed bytes can be sent right away."""
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        with workbook.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(("<row>" + "".join(map(xlsx_cell, COLUMNS)) + "</row>").encode())
+            for chunk in chunks:
+                sheet.write("".join("<row>" + "".join(map(xlsx_cell, row)) + "</row>" for row in chunk).encode())
+                yield sink.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "xlsx": write_xlsx}
+
+
+def export_components(trip_id: int, fmt: str, currency: str, chunk_size: int | None = None):
+    """Export the components of a trip as a stream. Nothing is read before the first chunk is requested,
+    and at most chunk_size rows are held in memory at a time. The CSV and JSON lines exports can be
+    imported back with import_components.
+
+    Args:
+        trip_id (int): Trip to export
+        fmt (str): csv, jsonl or xlsx
+        currency (str): Currency the costs are converted to
+        chunk_size (int): Rows read and encoded at a time, EXPORT_CHUNK_SIZE by default
+
+    Returns:
+        Iterator[str | bytes]: Chunks of the encoded file"""
+    if fmt not in WRITERS:
+        raise ValueError(f"Unsupported export format: {fmt}, use one of {', '.join(FORMATS)}.")
+    app.logger.info("Exporting components of trip id: %s as %s.", trip_id, fmt)
+    return WRITERS[fmt](iter_chunks(trip_id, currency, chunk_size or app.config["EXPORT_CHUNK_SIZE"]))
@@ -0,0 +1,191 @@
+import csv
+import io
+import json
+import sqlalchemy as sa
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from app import app, db
+from app.models import Trip, Component, Participant, TripCostSummary, reference_catalog
+from app.plotlydash.cache import evict_trip
+
+FORMATS = ("csv", "jsonl")
+MAX_COST = Decimal("99999999.99") # Largest value of the DECIMAL(10, 2) base_cost column
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+FALSE_VALUES = {"0", "false", "no", "n", "f"}
+
+
+def detect_format(filename: str | None, declared: str | None = None) -> str:
+    """Format of an import file, the declared one or the one of its extension (.csv, .jsonl, .json, .ndjson)."""
+    fmt = (declared or (filename or "").rsplit(".", 1)[-1]).lower()
+    fmt = "jsonl" if fmt in ("json", "ndjson") else fmt
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported import format: {fmt or 'unknown'}, use one of {', '.join(FORMATS)}.")
+    return fmt
+
+
+def iter_rows(stream, fmt: str):
+    """Stream the rows of a binary CSV (with a header row) or JSON lines file one at a time.
+    
+    Yields:
+        tuple: line number and the row as a dict, or the error message of a line that couldn't be parsed"""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, f"Invalid JSON: {e}"
+            continue
+        yield line_number, row if isinstance(row, dict) else "Each line must be a JSON object."
+
+
+def load_lookups(trip_id: int) -> dict:
+    """Build the lookups of the categories, types, currencies and trip participants rows are validated against.
+    The static ones come from the reference catalog, the participants with one query.
+    Names are matched case-insensitively, categories, types and participants can also be given by id."""
+    reference = reference_catalog.snapshot()
+    participants = db.session.execute(
+        sa.select(Participant.id, Participant.participant_name).where(Participant.trip_id == trip_id)).all()
+    return {
+        "categories": {name.lower(): id for id, name in reference.categories.items()} | {str(id): id for id in reference.categories},
+        "types": {(category_id, name.lower()): id for id, (category_id, name) in reference.types.items()}
+                 | {(category_id, str(id)): id for id, (category_id, _) in reference.types.items()},
+        "currencies": set(reference.currencies),
+        "participants": {name.lower(): id for id, name in participants} | {str(id): id for id, _ in participants},
+    }
+
+
+def parse_row(row: dict, trip_id: int, lookups: dict) -> tuple[dict | None, list[str]]:
+    """Validate an import row with the same rules as ComponentForm, against the in-memory lookups.
+    
+    Row fields: component_name, category, type, base_cost, currency (default PLN), participant, description, link, 
+    start_date, end_date (ISO dates) and is_active (default true), all but the first four optional.
+        
+    Returns:
+        tuple: Component column values ready for insert (None if invalid) and the list of errors"""
+    def text(field):
+        value = row.get(field)
+        return "" if value is None else str(value).strip()
+    
+    errors = []
+    name = text("component_name")
+    if not name or len(name) > 64:
+        errors.append("component_name is required and can have at most 64 characters.")
+    category_id = lookups["categories"].get(text("category").lower())
+    if category_id is None:
+        errors.append(f"Unknown category: {text('category')!r}.")
+    type_id = lookups["types"].get((category_id, text("type").lower()))
+    if category_id is not None and type_id is None:
+        errors.append(f"Unknown type {text('type')!r} in category {text('category')!r}.")
+    try:
+        base_cost = Decimal(text("base_cost")).quantize(Decimal("0.01"))
+        if not 0 <= base_cost <= MAX_COST:
+            raise InvalidOperation
+    except InvalidOperation:
+        base_cost = None
+        errors.append(f"base_cost must be a number between 0 and {MAX_COST}, got {text('base_cost')!r}.")
+    currency = text("currency").upper() or "PLN"
+    if currency not in lookups["currencies"]:
+        errors.append(f"Unknown currency: {currency!r}.")
+    participant_id = None
+    if text("participant"):
+        participant_id = lookups["participants"].get(text("participant").lower())
+        if participant_id is None:
+            errors.append(f"Unknown participant: {text('participant')!r}.")
+    description, link = text("description"), text("link")
+    if len(description) > 140:
+        errors.append("description can have at most 140 characters.")
+    if len(link) > 2083:
+        errors.append("link can have at most 2083 characters.")
+    dates = {}
+    for field in ("start_date", "end_date"):
+        try:
+            dates[field] = datetime.combine(date.fromisoformat(text(field)[:10]), datetime.min.time()) if text(field) else None
+        except ValueError:
+            errors.append(f"{field} must be an ISO date (YYYY-MM-DD), got {text(field)!r}.")
+    if dates.get("start_date") and dates.get("end_date") and dates["end_date"] < dates["start_date"]:
+        errors.append("end_date can't be before start_date.")
+    is_active = row.get("is_active")
+    if not isinstance(is_active, bool):
+        is_active = text("is_active").lower()
+        if is_active and is_active not in TRUE_VALUES | FALSE_VALUES:
+            errors.append(f"is_active must be true or false, got {text('is_active')!r}.")
+        is_active = is_active not in FALSE_VALUES
+    
+    if errors:
+        return None, errors
+    return {"trip_id": trip_id, "category_id": category_id, "type_id": type_id, "participant_id": participant_id,
+            "component_name": name, "base_cost": base_cost, "currency": currency, "description": description or None,
+            "link": link or None, "start_date": dates["start_date"], "end_date": dates["end_date"], 
+            "is_active": is_active}, []
+
+
+def import_components(trip_id: int, stream, fmt: str, batch_size: int | None = None, max_errors: int | None = None) -> dict:
+    """Import components into a trip from a binary stream of CSV or JSON lines rows (see parse_row for the fields). 
+    Rows are parsed and validated one at a time and valid ones inserted in batches of batch_size, all in one 
+    transaction together with the trip cost summary, so memory stays bounded by the batch size. Invalid rows are 
+    skipped and reported. Commits the session, or rolls it back and re-raises on a database error.
+    
+    Args:
+        trip_id (int): Trip the components are added to
+        stream: Binary file-like object with the rows
+        fmt (str): csv or jsonl
+        batch_size (int): Rows per INSERT statement, IMPORT_BATCH_SIZE by default
+        max_errors (int): Number of row errors kept for the result, IMPORT_MAX_ERRORS by default. All are counted.
+        
+    Returns:
+        dict: Result with keys:
+        - imported: number of inserted components | int
+        - error_count: number of rejected rows | int
+        - errors: line number and errors of the first max_errors rejected rows | list[dict]"""
+    batch_size = batch_size or app.config["IMPORT_BATCH_SIZE"]
+    max_errors = app.config["IMPORT_MAX_ERRORS"] if max_errors is None else max_errors
+    app.logger.info("Importing components into trip id: %s from %s.", trip_id, fmt)
+    lookups = load_lookups(trip_id)
+    result = {"imported": 0, "error_count": 0, "errors": []}
+    totals = {} # Summary key to [cost, count, paid_count] of the imported components
+    batch = []
+    
+    def flush():
+        db.session.execute(sa.insert(Component.__table__), batch) # Core executemany, the ORM bulk insert splits rows by their None values
+        result["imported"] += len(batch)
+        batch.clear()
+    
+    try:
+        for line_number, row in iter_rows(stream, fmt):
+            values, errors = parse_row(row, trip_id, lookups) if isinstance(row, dict) else (None, [row])
+            if errors:
+                result["error_count"] += 1
+                if len(result["errors"]) < max_errors:
+                    result["errors"].append({"line": line_number, "errors": errors})
+                continue
+            batch.append(values)
+            key = (values["category_id"], values["participant_id"], values["currency"], values["is_active"])
+            total = totals.setdefault(key, [Decimal(0), 0, 0])
+            total[0] += values["base_cost"]
+            total[1] += 1
+            total[2] += 1 if values["base_cost"] > 0 else 0
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        
+        for (category_id, participant_id, currency, is_active), (cost, count, paid_count) in totals.items():
+            TripCostSummary.add({"trip_id": trip_id, "category_id": category_id, "participant_id": participant_id,
+                                 "currency": currency, "is_active": is_active}, cost, count, paid_count)
+        if result["imported"]:
+            Trip.bump_data_version(trip_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error("Error importing components into trip id: %s: %s", trip_id, e)
+        raise
+    evict_trip(trip_id)
+    app.logger.info("Imported %s components into trip id: %s, rejected %s rows.", result['imported'], trip_id, result['error_count'])
+    return result
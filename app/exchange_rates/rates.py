@@ -1,23 +1,213 @@
 import requests
+import threading
+import time
+import sqlalchemy as sa
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sqlalchemy.dialects import mysql, sqlite
 from app import app, db
-from app.models import ExchangeRates
+from app.models import ExchangeRates, ExchangeRateHistory, rate_cache, reference_catalog
 from datetime import datetime, timezone, timedelta
 
-BASE_URL = "https://api.fxratesapi.com/latest"
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calling a failing API for reset_after seconds once threshold consecutive calls have failed.
+    After that time a single trial call is let through, closing the breaker again if it succeeds."""
+    def __init__(self, threshold: int, reset_after: float):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_after
+
+    def before_call(self) -> None:
+        """Raise a CircuitOpenError if calls are currently blocked."""
+        with self._lock:
+            if self.is_open:
+                raise CircuitOpenError(f"Circuit open after {self.failures} consecutive failures.")
+            if self.opened_at is not None:
+                self.opened_at = time.monotonic() # Half-open, block others until the trial call is done
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class RateFetcher:
+    """Client for the exchange rates API. Reuses pooled connections from a single session, applies connect and 
+    read timeouts to every call, retries failed calls with exponential backoff and stops calling a provider 
+    through its own circuit breaker when it keeps failing.
+
+    With several providers (the primary one and its fallbacks, all answering like the primary API), every fetch
+    asks all of them concurrently on a thread pool and returns the first successful response, so a slow or
+    failing provider doesn't hold up the refresh.
+    
+    Args:
+        base_urls (list[str]): URLs of the latest rates endpoints of the providers, in order of preference
+        connect_timeout (float): Seconds to wait for a connection
+        read_timeout (float): Seconds to wait for the response between bytes
+        retries (int): Number of retries of a failed call
+        backoff_factor (float): Backoff factor between retries, in seconds
+        pool_size (int): Number of pooled connections, also the number of providers called concurrently
+        breaker_threshold (int): Consecutive failures of a provider before its circuit breaker opens
+        breaker_reset (float): Seconds before an open circuit breaker lets a trial call through"""
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_urls: list[str], connect_timeout: float, read_timeout: float, retries: int, 
+                 backoff_factor: float, pool_size: int, breaker_threshold: int, breaker_reset: float):
+        self.providers = [(url, CircuitBreaker(breaker_threshold, breaker_reset)) for url in base_urls]
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=self.RETRY_STATUSES,
+                      allowed_methods=frozenset(["GET"]), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def from_config(cls, config) -> 'RateFetcher':
+        """Create a fetcher with the RATES_* settings of the given config."""
+        return cls(
+            base_urls=[config["RATES_API_URL"], *config["RATES_FALLBACK_URLS"]],
+            connect_timeout=config["RATES_CONNECT_TIMEOUT"],
+            read_timeout=config["RATES_READ_TIMEOUT"],
+            retries=config["RATES_MAX_RETRIES"],
+            backoff_factor=config["RATES_BACKOFF_FACTOR"],
+            pool_size=config["RATES_POOL_SIZE"],
+            breaker_threshold=config["RATES_BREAKER_THRESHOLD"],
+            breaker_reset=config["RATES_BREAKER_RESET"])
+
+    def fetch(self, currency: str = "PLN") -> dict:
+        """Fetch the latest exchange rates for the base currency, from the first provider to answer successfully.
+
+        Raises:
+            requests.exceptions.RequestException, ValueError: Error of the first provider if all of them failed"""
+        if len(self.providers) == 1:
+            return self.fetch_from(*self.providers[0], currency)
+        executor = ThreadPoolExecutor(max_workers=min(self.pool_size, len(self.providers)) or 1)
+        futures = {executor.submit(self.fetch_from, url, breaker, currency): i for i, (url, breaker) in enumerate(self.providers)}
+        errors = {}
+        try:
+            for future in as_completed(futures):
+                try:
+                    return future.result()
+                except (requests.exceptions.RequestException, ValueError) as e: # Already logged in fetch_from
+                    errors[futures[future]] = e
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True) # Slower providers finish in the background
+        raise errors[min(errors)]
+
+    def fetch_from(self, url: str, breaker: CircuitBreaker, currency: str) -> dict:
+        """Fetch the latest exchange rates for the base currency from one provider."""
+        app.logger.info("Fetching exchange rates for base currency %s from %s", currency, url)
+        try:
+            breaker.before_call()
+            response = self.session.get(url, params={"base": currency}, timeout=self.timeout)
+            response.raise_for_status()  # Raises an HTTPError if the response code is 4xx/5xx
+            data = response.json()
+        except CircuitOpenError as e:
+            app.logger.error("Not fetching exchange rates for %s from %s: %s", currency, url, e)
+            raise
+        except (requests.exceptions.RequestException, ValueError) as e:
+            breaker.record_failure()
+            app.logger.error("Error fetching exchange rates for %s from %s: %s", currency, url, e)
+            raise
+        breaker.record_success()
+        app.logger.info("Successfully fetched exchange rates for %s from %s", currency, url)
+        return data
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_fetcher = None
+
+def get_fetcher() -> RateFetcher:
+    """Return the process-wide RateFetcher, created from the app config on first use."""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = RateFetcher.from_config(app.config)
+    return _fetcher
+
 
 def fetch_rates(currency="PLN"):
     """Fetch the latest exchange rates from the API"""
-    app.logger.info(f"Fetching exchange rates for base currency {currency}")
-    params = {"base": currency}
-    try:
-        response = requests.get(BASE_URL, params=params)
-        response.raise_for_status()  # Raises an HTTPError if the response code is 4xx/5xx
-        data = response.json()
-        app.logger.info(f"Successfully fetched exchange rates for {currency}")
-        return data
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error fetching exchange rates for {currency}: {e}")
-        raise
+    return get_fetcher().fetch(currency)
+
+
+def upsert_rates(rates: dict, updated_at: datetime) -> int:
+    """Insert or update all the given PLN rates in a single statement, stamping every row with updated_at.
+    Uses INSERT ... ON DUPLICATE KEY UPDATE on MySQL and INSERT ... ON CONFLICT on SQLite, 
+    other databases fall back to merging the rows one by one. Doesn't commit the session.
+    
+    Args:
+        rates (dict): Currency code to rate mapping
+        updated_at (datetime): Timestamp stored in last_updated for the whole batch
+        
+    Returns:
+        int: Number of rates written"""
+    rows = [{"currency_to": currency, "rate": rate, "last_updated": updated_at} for currency, rate in rates.items()]
+    if not rows:
+        return 0
+    
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(ExchangeRates).values(rows)
+        stmt = stmt.on_duplicate_key_update(rate=stmt.inserted.rate, last_updated=stmt.inserted.last_updated)
+        db.session.execute(stmt)
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(ExchangeRates).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ExchangeRates.currency_to],
+            set_={"rate": stmt.excluded.rate, "last_updated": stmt.excluded.last_updated})
+        db.session.execute(stmt)
+    else:
+        app.logger.warning("No bulk upsert for the %s dialect, merging rates one by one.", dialect)
+        for row in rows:
+            db.session.merge(ExchangeRates(**row))
+    return len(rows)
+
+
+def append_rate_history(rates: dict, rate_date) -> int:
+    """Append the given PLN rates to the rate history for rate_date in a single statement. History is append-only,
+    so rates already stored for that date are kept. Doesn't commit the session.
+    
+    Args:
+        rates (dict): Currency code to rate mapping
+        rate_date (date): Date the rates are in force from
+        
+    Returns:
+        int: Number of rates passed to the database"""
+    rows = [{"currency_to": currency, "rate_date": rate_date, "rate": rate} for currency, rate in rates.items()]
+    if not rows:
+        return 0
+    
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "mysql":
+        db.session.execute(mysql.insert(ExchangeRateHistory).values(rows).prefix_with("IGNORE"))
+    elif dialect == "sqlite":
+        db.session.execute(sqlite.insert(ExchangeRateHistory).values(rows).on_conflict_do_nothing())
+    else:
+        stored = set(db.session.scalars(
+            sa.select(ExchangeRateHistory.currency_to).where(ExchangeRateHistory.rate_date == rate_date)))
+        db.session.add_all(ExchangeRateHistory(**row) for row in rows if row["currency_to"] not in stored)
+    return len(rows)
 
 
 def update_exchange_rates():
@@ -40,22 +230,15 @@ def update_exchange_rates():
         data = fetch_rates() 
         rates = data["rates"]
 
-        app.logger.info(f"Updating exchange rates for {len(rates)} currencies.")
-        for currency, rate in rates.items():
-            exchange_rate = db.session.query(ExchangeRates).filter_by(currency_to=currency).first()
-            if exchange_rate:
-                exchange_rate.rate = rate
-                app.logger.info(f"Updated rate for {currency}.")
-            else:
-                new_rate = ExchangeRates(currency_to=currency, rate=rate, last_updated=datetime.now(timezone.utc))
-                db.session.add(new_rate)
-                app.logger.info(f"Added new rate for {currency}.")
-        
+        now = datetime.now(timezone.utc)
+        count = upsert_rates(rates, now)
+        append_rate_history(rates, now.date())
         db.session.commit()
-        app.logger.info("Exchange rates successfully updated in the database.")
+        rate_cache.invalidate()
+        reference_catalog.invalidate() # New currencies become choices
+        app.logger.info("Exchange rates for %s currencies successfully updated in the database.", count)
         return 0
     except Exception as e:
-        app.logger.error(f"Error updating exchange rates: {e}")
+        db.session.rollback()
+        app.logger.error("Error updating exchange rates: %s", e)
         raise
-    
-    
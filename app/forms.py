@@ -4,7 +4,7 @@ from wtforms.validators import ValidationError, DataRequired, Email, EqualTo, Le
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 from app import app, db
-from app.models import User, Trip, ExchangeRates, ComponentCategory, ComponentType
+from app.models import User, Trip, reference_catalog
 
 
 class LoginForm(FlaskForm):
@@ -26,23 +26,23 @@ class RegistrationForm(FlaskForm):
 
     def validate_username(self, username): # wtflask automatically checks any validate_<field_name> with validation and will raise ValidationErrors
         '''Raise a ValidationError if username taken'''
-        app.logger.info(f"Validating username: {username.data}")
+        app.logger.info("Validating username: %s", username.data)
         exists = db.session.scalar(
             sa.select(sa.exists().where(User.username == username.data)))
         if exists:
-            app.logger.warning(f"Username {username.data} is already taken.")
+            app.logger.warning("Username %s is already taken.", username.data)
             raise ValidationError('Please use a different username.')
-        app.logger.info(f"Username {username.data} is available.")
+        app.logger.info("Username %s is available.", username.data)
         
     def validate_email(self, email):
         '''Raise a ValidationError if email taken'''
-        app.logger.info(f"Validating email: {email.data}")
+        app.logger.info("Validating email: %s", email.data)
         exists = db.session.scalar(
             sa.select(sa.exists().where(User.email == email.data)))
         if exists:
-            app.logger.warning(f"Email {email.data} is already taken.")
+            app.logger.warning("Email %s is already taken.", email.data)
             raise ValidationError('Please use a different email address.')
-        app.logger.info(f"Email {email.data} is available.")
+        app.logger.info("Email %s is available.", email.data)
         
 
 class EditProfileForm(FlaskForm):
@@ -58,24 +58,22 @@ class EditProfileForm(FlaskForm):
 
     def validate_username(self, username):
         '''Raise a ValidationError if username taken and different from current user's username'''
-        app.logger.info(f"Validating new username: {username.data} (current: {self.original_username})")
+        app.logger.info("Validating new username: %s (current: %s)", username.data, self.original_username)
         if self.original_username != username.data:
             user = db.session.scalar(sa.select(
                 sa.exists().where(User.username == username.data)))
             if user is not None:
-                app.logger.warning(f"Username {username.data} is already taken.")
+                app.logger.warning("Username %s is already taken.", username.data)
                 raise ValidationError('Please use a different username.')
-            app.logger.info(f"Username {username.data} is available for update.")
+            app.logger.info("Username %s is available for update.", username.data)
             
     def validate_currency(self, currency):
         '''Raise a ValidationError if currency not in ExchangeRates table.'''
-        app.logger.info(f"Validating currency: {currency.data}")
-        exists = db.session.scalar(sa.select(
-            sa.exists().where(ExchangeRates.currency_to == currency.data)))
-        if not exists:
-            app.logger.warning(f"Currency {currency.data} not found in ExchangeRates table.")
+        app.logger.info("Validating currency: %s", currency.data)
+        if not reference_catalog.has_currency(currency.data):
+            app.logger.warning("Currency %s not found in ExchangeRates table.", currency.data)
             raise ValidationError('Please choose an existing currency.')
-        app.logger.info(f"Currency {currency.data} is valid.")
+        app.logger.info("Currency %s is valid.", currency.data)
         
 
 class TripForm(FlaskForm):
@@ -89,14 +87,14 @@ class TripForm(FlaskForm):
 
     def validate_trip_name(self, trip_name):
         '''Raise a ValidationError if trip name already selected by the same user.'''
-        app.logger.info(f"Validating trip name: {trip_name.data} for user {self.user_id}")
+        app.logger.info("Validating trip name: %s for user %s", trip_name.data, self.user_id)
         trip = so.aliased(Trip)
         exists = db.session.scalar(sa.select(
             sa.exists().where(sa.and_(trip.trip_name == trip_name.data, self.user_id == trip.user_id))))
         if exists:
-            app.logger.warning(f"Trip name {trip_name.data} already exists for user {self.user_id}.")
+            app.logger.warning("Trip name %s already exists for user %s.", trip_name.data, self.user_id)
             raise ValidationError('Please choose a different trip name.')
-        app.logger.info(f"Trip name {trip_name.data} is available for user {self.user_id}.")
+        app.logger.info("Trip name %s is available for user %s.", trip_name.data, self.user_id)
         
 class ComponentForm(FlaskForm):
     """Form for adding or editing a trip component."""
@@ -114,33 +112,27 @@ class ComponentForm(FlaskForm):
 
     def validate_category_id(self, category_id):
         '''Raise a ValidationError if category not in ComponentCategory table.'''
-        app.logger.info(f"Validating category ID: {category_id.data}")
-        exists = db.session.scalar(sa.select(
-            sa.exists().where(ComponentCategory.id == category_id.data)))
-        if not exists:
-            app.logger.warning(f"Category ID {category_id.data} not found in ComponentCategory table.")
+        app.logger.info("Validating category ID: %s", category_id.data)
+        if not reference_catalog.has_category(category_id.data):
+            app.logger.warning("Category ID %s not found in ComponentCategory table.", category_id.data)
             raise ValidationError('Please choose an existing category.')
-        app.logger.info(f"Category ID {category_id.data} is valid.")
+        app.logger.info("Category ID %s is valid.", category_id.data)
         
     def validate_type_id(self, type_id):
         '''Raise a ValidationError if type not in ComponentType table.'''
-        app.logger.info(f"Validating type ID: {type_id.data}")
-        exists = db.session.scalar(sa.select(
-            sa.exists().where(ComponentType.id == type_id.data)))
-        if not exists:
-            app.logger.warning(f"Type ID {type_id.data} not found in ComponentType table.")
+        app.logger.info("Validating type ID: %s", type_id.data)
+        if not reference_catalog.has_type(type_id.data):
+            app.logger.warning("Type ID %s not found in ComponentType table.", type_id.data)
             raise ValidationError('Please choose an existing type.')
-        app.logger.info(f"Type ID {type_id.data} is valid.")
+        app.logger.info("Type ID %s is valid.", type_id.data)
         
     def validate_currency(self, currency):
         '''Raise a ValidationError if currency not in ExchangeRates table.'''
-        app.logger.info(f"Validating currency: {currency.data}")
-        exists = db.session.scalar(sa.select(
-            sa.exists().where(ExchangeRates.currency_to == currency.data)))
-        if not exists:
-            app.logger.warning(f"Currency {currency.data} not found in ExchangeRates table.")
+        app.logger.info("Validating currency: %s", currency.data)
+        if not reference_catalog.has_currency(currency.data):
+            app.logger.warning("Currency %s not found in ExchangeRates table.", currency.data)
             raise ValidationError('Please choose an existing currency.')
-        app.logger.info(f"Currency {currency.data} is valid.")
+        app.logger.info("Currency %s is valid.", currency.data)
 
 
     def validate(self, **kwargs):
@@ -150,10 +142,10 @@ class ComponentForm(FlaskForm):
         if rv:
             # Ensure end date >= start date
             if self.start_date.data and self.end_date.data and (self.start_date.data > self.end_date.data):
-                app.logger.warning(f"End date {self.end_date.data} is before start date {self.start_date.data}.")
+                app.logger.warning("End date %s is before start date %s.", self.end_date.data, self.start_date.data)
                 self.end_date.errors.append('Finish date must be set after the starting date.')
                 return False
-            app.logger.info(f"Date range for component is valid: {self.start_date.data} to {self.end_date.data}")
+            app.logger.info("Date range for component is valid: %s to %s", self.start_date.data, self.end_date.data)
             return True
         return False
 
@@ -0,0 +1,381 @@
+import json
+import os
+import random
+import re
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import requests
+from config import Config, basedir
+
+# Weights of the actions of a virtual user once logged in
+ACTIONS = {"open_trip": 3, "change_filters": 4, "add_component": 1, "toggle_component": 2}
+RATES = {"PLN": 1.0, "EUR": 0.2342, "USD": 0.2545, "GBP": 0.1953} # Answered by the rates API stub of fresh databases
+PARTICIPANTS = ("Anna", "Bartek", "Celina")
+DASHBOARD_CALLBACK = "..trip-title.children...budget-bar-graph.figure...budget-pie-graph.figure.."
+COLUMNS_CALLBACK = "data-store-columns.data" # Replaces DASHBOARD_CALLBACK with DASH_CLIENTSIDE_FILTERING
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class StubRatesHandler(BaseHTTPRequestHandler):
+    """Stub of the exchange rates API, so a fresh database gets its currencies without calling the real one."""
+    def do_GET(self):
+        body = json.dumps({"rates": RATES}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadStats:
+    """Latencies and errors of the requests of one virtual user, by endpoint. Every user has its own, so
+    recording doesn't take a lock; they are merged when the run is over.
+
+    Fields:
+    - latencies: endpoint to the latencies of its successful requests in seconds | dict[str, list[float]]
+    - errors: endpoint to the number of failed requests (error status, unexpected answer or no answer) | dict[str, int]
+    - last_errors: endpoint to the description of its last error | dict[str, str]"""
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.last_errors = {}
+
+    def record(self, endpoint: str, latency: float, error: str | None = None) -> None:
+        if error is None:
+            self.latencies.setdefault(endpoint, []).append(latency)
+        else:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            self.last_errors[endpoint] = error
+
+    def merge(self, other: 'LoadStats') -> None:
+        for endpoint, latencies in other.latencies.items():
+            self.latencies.setdefault(endpoint, []).extend(latencies)
+        for endpoint, count in other.errors.items():
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + count
+        self.last_errors.update(other.last_errors)
+
+    def summary(self, duration: float) -> dict:
+        """Throughput, latency percentiles and error rate of every endpoint and of all of them together.
+
+        Args:
+            duration (float): Seconds the load ran for
+
+        Returns:
+            dict: Endpoint (and "total") to its requests, errors, error_rate, rps, p50_ms, p95_ms, p99_ms and max_ms"""
+        def endpoint_summary(latencies: list[float], errors: int) -> dict:
+            requests_count = len(latencies) + errors
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if latencies else (None, None, None)
+            return {"requests": requests_count, "errors": errors, "error_rate": round(errors / requests_count, 4) if requests_count else 0.0,
+                    "rps": round(requests_count / duration, 2),
+                    "p50_ms": p50 and round(p50, 1), "p95_ms": p95 and round(p95, 1), "p99_ms": p99 and round(p99, 1),
+                    "max_ms": round(max(latencies) * 1000, 1) if latencies else None}
+        endpoints = sorted(set(self.latencies) | set(self.errors))
+        summary = {endpoint: endpoint_summary(self.latencies.get(endpoint, []), self.errors.get(endpoint, 0)) for endpoint in endpoints}
+        summary["total"] = endpoint_summary([latency for latencies in self.latencies.values() for latency in latencies],
+                                            sum(self.errors.values()))
+        return summary
+
+
+class VirtualUser:
+    """A user driving the app like the browser does: the trip page with its dashboard iframe, dashboard
+    filter changes, new components through the component form and activation toggles.
+
+    Every user registers its own account and trip (with participants and imported components) before the
+    load starts, so users don't contend on the same rows."""
+    def __init__(self, base_url: str, username: str, stats: LoadStats, rng: random.Random, timeout: float, clientside: bool):
+        self.base_url = base_url
+        self.username = username
+        self.password = secrets.token_urlsafe(12)
+        self.stats = stats
+        self.rng = rng
+        self.timeout = timeout
+        self.clientside = clientside
+        self.session = requests.Session()
+        self.trip_id = None
+        self.data_key = None
+        self.participant_ids = []
+        self.component_ids = []
+
+    def request(self, endpoint: str, method: str, path: str, expect=None, **kwargs) -> requests.Response | None:
+        """Send a request and record its latency under endpoint. Statuses of 400 and up, connection errors and
+        answers failing the expect check are recorded as errors.
+
+        Returns:
+            requests.Response: The response, None if it failed"""
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, allow_redirects=False, **kwargs)
+        except requests.RequestException as e:
+            self.stats.record(endpoint, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+            return None
+        latency = time.perf_counter() - start
+        error = f"HTTP {response.status_code}" if response.status_code >= 400 else None
+        if error is None and expect is not None and not expect(response):
+            error = f"Unexpected answer with HTTP {response.status_code}"
+        self.stats.record(endpoint, latency, error)
+        return None if error else response
+
+    def csrf_token(self, endpoint: str, path: str) -> str | None:
+        """GET a page with a form and return its CSRF token."""
+        response = self.request(endpoint, "GET", path)
+        match = CSRF_TOKEN.search(response.text) if response is not None else None
+        return match.group(1) if match else None
+
+    def callback(self, output: str, outputs, inputs: list[tuple[str, str, object]]):
+        """Call a Dash callback like the dashboard does, recorded under its callback id.
+
+        Returns:
+            dict: The outputs of the callback, None if it failed"""
+        payload = {"output": output, "outputs": outputs,
+                   "inputs": [{"id": id_, "property": prop, "value": value} for id_, prop, value in inputs],
+                   "changedPropIds": [f"{inputs[0][0]}.{inputs[0][1]}"]}
+        response = self.request(f"dash {output}", "POST", "/dash/_dash-update-component", json=payload)
+        if response is None or response.status_code == 204: # Failed or no update
+            return None
+        return response.json()["response"]
+
+    def setup(self, components: int) -> bool:
+        """Register the user and create its trip with participants and components, through the same routes
+        as the UI. Recorded under setup endpoints, which aren't part of the load.
+
+        Returns:
+            bool: Whether the user is ready for the load"""
+        token = self.csrf_token("setup GET /register", "/register")
+        self.request("setup POST /register", "POST", "/register", expect=lambda r: r.status_code == 302,
+                     data={"csrf_token": token, "username": self.username, "email": f"{self.username}@example.com",
+                           "password": self.password, "password2": self.password})
+        if not self.login("setup POST /login"):
+            return False
+        token = self.csrf_token("setup GET /user", f"/user/{self.username}")
+        self.request("setup POST /user", "POST", f"/user/{self.username}", data={"csrf_token": token, "trip_name": "Load test trip"})
+        response = self.request("setup GET /user", "GET", f"/user/{self.username}")
+        match = re.search(r"/trip/(\d+)", response.text) if response is not None else None
+        if match is None:
+            return False
+        self.trip_id = int(match.group(1))
+        for name in PARTICIPANTS:
+            token = self.csrf_token("setup GET /trip", f"/trip/{self.trip_id}")
+            self.request("setup POST /trip", "POST", f"/trip/{self.trip_id}", data={"csrf_token": token, "participant_name": name})
+        rows = ["component_name,category,type,base_cost,currency,participant,start_date,is_active"]
+        for i in range(components):
+            rows.append(f"Component {i},Food,Restaurant,{self.rng.randint(0, 50000) / 100},{self.rng.choice(list(RATES))},"
+                        f"{self.rng.choice(PARTICIPANTS + ('',))},2025-0{self.rng.randint(1, 9)}-1{self.rng.randint(0, 9)},"
+                        f"{'true' if self.rng.random() > 0.05 else 'false'}")
+        self.request("setup POST /import_components", "POST", f"/import_components/{self.trip_id}",
+                     files={"file": ("components.csv", "\n".join(rows).encode())})
+        self.session = requests.Session() # The load starts logged out
+        return True
+
+    def login(self, endpoint: str = "POST /login") -> bool:
+        """Log in through the login form. A failed login is redirected back to the login page."""
+        token = self.csrf_token("GET /login", "/login")
+        response = self.request(endpoint, "POST", "/login", data={"csrf_token": token, "username": self.username, "password": self.password},
+                                expect=lambda r: r.headers.get("Location", "").endswith(f"/user/{self.username}"))
+        return response is not None
+
+    def open_trip(self) -> None:
+        """The trip page, then its dashboard iframe loading the trip data and drawing the graphs."""
+        response = self.request("GET /trip/<id>", "GET", f"/trip/{self.trip_id}")
+        if response is not None:
+            self.component_ids = [int(id_) for id_ in re.findall(r'id="component-(\d+)"', response.text)]
+            self.participant_ids = [int(id_) for id_ in re.findall(r'id="participant-(\d+)"', response.text)]
+        self.request("GET /dash/<id>", "GET", f"/dash/{self.trip_id}")
+        self.request("GET /dash/_dash-layout", "GET", "/dash/_dash-layout")
+        self.request("GET /dash/_dash-dependencies", "GET", "/dash/_dash-dependencies")
+        outputs = self.callback("data-store-trip.data", {"id": "data-store-trip", "property": "data"}, [("url", "pathname", f"/dash/{self.trip_id}")])
+        self.data_key = outputs["data-store-trip"]["data"] if outputs else self.data_key
+        self.callback("data-store-participants.data", {"id": "data-store-participants", "property": "data"}, [("data-store-trip", "data", self.data_key)])
+        self.refresh_dashboard(None, None, True)
+
+    def refresh_dashboard(self, categories: list[str] | None, participants: list[int] | None, include_free: bool) -> None:
+        """Redraw the dashboard graphs for the filters, or reload the trip columns if the browser filters them."""
+        if self.clientside:
+            self.callback(COLUMNS_CALLBACK, {"id": "data-store-columns", "property": "data"}, [("data-store-trip", "data", self.data_key)])
+            return
+        self.callback(DASHBOARD_CALLBACK,
+                      [{"id": "trip-title", "property": "children"}, {"id": "budget-bar-graph", "property": "figure"}, {"id": "budget-pie-graph", "property": "figure"}],
+                      [("data-store-trip", "data", self.data_key), ("dropdown-categories", "value", categories or list(Config.INIT_CATEGORIES)),
+                       ("dropdown-participants", "value", participants or self.participant_ids + [-1]), ("radio-include-free", "value", include_free)])
+
+    def change_filters(self) -> None:
+        """A random filter change on the dashboard. Filters are applied in the browser in clientside mode,
+        without any request."""
+        if self.clientside:
+            return
+        categories = self.rng.sample(Config.INIT_CATEGORIES, self.rng.randint(1, len(Config.INIT_CATEGORIES)))
+        participants = self.rng.sample(self.participant_ids + [-1], self.rng.randint(1, len(self.participant_ids) + 1))
+        self.refresh_dashboard(categories, participants, self.rng.random() < 0.5)
+
+    def add_component(self) -> None:
+        """Submit the component form, then refresh the dashboard with the new data key like the trip page does."""
+        token = self.csrf_token("GET /create_component/<id>", f"/create_component/{self.trip_id}")
+        response = self.request("POST /create_component/<id>", "POST", f"/create_component/{self.trip_id}",
+                                expect=lambda r: "applyTripDeltaInParent" in r.text,
+                                data={"csrf_token": token, "component_name": f"Load {self.rng.randint(0, 10 ** 6)}",
+                                      "category_id": 1, "type_id": 1, "base_cost": f"{self.rng.randint(0, 50000) / 100}",
+                                      "currency": self.rng.choice(list(RATES)), "participant_name": self.rng.choice(self.participant_ids or [0]),
+                                      "description": "", "link": "", "start_date": "2025-05-01", "end_date": "2025-05-03"})
+        if response is not None:
+            delta = json.loads(re.search(r"applyTripDeltaInParent\((.*)\);", response.text).group(1))
+            self.component_ids.append(delta["component_id"])
+            self.data_key = delta["data_key"]
+            self.refresh_dashboard(None, None, True)
+
+    def toggle_component(self) -> None:
+        """Toggle the activation of a random component, then refresh the dashboard."""
+        if not self.component_ids:
+            return
+        response = self.request("POST /activate_component/<id>", "POST", f"/activate_component/{self.rng.choice(self.component_ids)}",
+                                expect=lambda r: r.json().get("success"))
+        if response is not None:
+            self.data_key = response.json()["delta"]["data_key"]
+            self.refresh_dashboard(None, None, True)
+
+    def run(self, until: float, think_time: float) -> None:
+        """Log in, then run weighted random actions until the monotonic time until."""
+        if not self.login():
+            return
+        self.open_trip()
+        actions, weights = zip(*ACTIONS.items())
+        while time.monotonic() < until:
+            getattr(self, self.rng.choices(actions, weights)[0])()
+            if think_time:
+                time.sleep(self.rng.expovariate(1 / think_time))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(env: dict) -> None:
+    """Migrate, seed and load the exchange rates of the database of env, like entrypoint.sh does, with the rates
+    answered by a local stub of the API."""
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), StubRatesHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    try:
+        env = {**env, "RATES_API_URL": f"http://127.0.0.1:{stub.server_port}/latest"}
+        for command in (["db", "upgrade"], ["seed"], ["update_exchange_rates"]):
+            subprocess.run([sys.executable, "-m", "flask", *command], cwd=basedir, env=env, check=True, capture_output=True)
+    finally:
+        stub.shutdown()
+
+
+def start_server(env: dict, workers: int, port: int, ready_timeout: float = 60) -> subprocess.Popen:
+    """Start the app under gunicorn like entrypoint.sh does, and wait until it answers.
+
+    Raises:
+        RuntimeError: If gunicorn isn't installed, exits or doesn't answer within ready_timeout seconds"""
+    if shutil.which("gunicorn") is None:
+        raise RuntimeError("gunicorn is not installed, install it or point the load test at a running server with --server-url.")
+    server = subprocess.Popen(["gunicorn", "-b", f"127.0.0.1:{port}", "-w", str(workers), "travel-planner:app"],
+                              cwd=basedir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + ready_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {server.returncode}: {server.stderr.read().decode()[-2000:]}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn didn't answer within {ready_timeout} seconds.")
+
+
+def run_load_test(users: int, duration: float, workers: int = 4, components: int = 200, database_url: str | None = None,
+                  server_url: str | None = None, think_time: float = 0.0, timeout: float = 30.0, seed: int = 0) -> dict:
+    """Drive the app with concurrent virtual users and measure every endpoint.
+
+    Unless server_url is given, the app is started under gunicorn with workers processes on database_url
+    (a fresh SQLite file by default), migrated and seeded first. With server_url, the running server's
+    database must already be seeded and have exchange rates.
+
+    Args:
+        users (int): Concurrent virtual users, each with its own account and trip
+        duration (float): Seconds of load, after the users are set up
+        workers (int): Gunicorn worker processes
+        components (int): Components imported into every user's trip before the load
+        database_url (str): Database of the started server, use a throwaway one as the users and trips stay in it
+        server_url (str): Base URL of an already running server to load instead of starting one
+        think_time (float): Mean seconds a user waits between actions, 0 for a closed loop without pauses
+        timeout (float): Seconds before a request is recorded as failed
+        seed (int): Seed of the users' random choices
+
+    Returns:
+        dict: The run's parameters, measured duration and the LoadStats.summary of the load"""
+    work_dir = tempfile.mkdtemp(prefix="travel_planner_load_")
+    server = None
+    try:
+        if server_url is None:
+            env = {**os.environ, "FLASK_APP": "travel-planner.py", "FLASK_DEBUG": "0",
+                   "DATABASE_URL": database_url or "sqlite:///" + os.path.join(work_dir, "load.db"),
+                   "LOG_FILE": os.path.join(work_dir, "logs", "travel_planner.log"), "METRICS_DIR": os.path.join(work_dir, "metrics")}
+            prepare_database(env)
+            port = free_port()
+            server = start_server(env, workers, port)
+            server_url = f"http://127.0.0.1:{port}"
+        server_url = server_url.rstrip("/")
+        dependencies = requests.get(f"{server_url}/dash/_dash-dependencies", timeout=timeout).text
+        clientside = COLUMNS_CALLBACK in dependencies and DASHBOARD_CALLBACK not in dependencies
+        run_id = secrets.token_hex(2)
+        virtual_users = [VirtualUser(server_url, f"lt{run_id}{i}"[:12], LoadStats(), random.Random(seed + i), timeout, clientside)
+                         for i in range(users)]
+        setup_stats = LoadStats()
+        ready = []
+        for user in virtual_users: # One at a time, the setup isn't part of the load
+            if user.setup(components):
+                ready.append(user)
+            setup_stats.merge(user.stats)
+            user.stats = LoadStats()
+        if not ready:
+            raise RuntimeError(f"No virtual user could be set up: {setup_stats.last_errors}")
+        start = time.monotonic()
+        threads = [threading.Thread(target=user.run, args=(start + duration, think_time), daemon=True) for user in ready]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        stats = LoadStats()
+        for user in ready:
+            stats.merge(user.stats)
+        return {"server_url": server_url, "workers": workers if server else None, "users": len(ready), "components": components,
+                "think_time": think_time, "clientside_filtering": clientside, "duration": round(elapsed, 2),
+                "endpoints": stats.summary(elapsed), "last_errors": stats.last_errors, "setup_errors": setup_stats.last_errors}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def format_report(report: dict) -> str:
+    """Table of the endpoints of a run_load_test report, slowest p95 first."""
+    endpoints = report["endpoints"]
+    width = max(len(name) for name in endpoints)
+    lines = [f"{report['users']} users for {report['duration']}s against {report['server_url']}"
+             + (f" ({report['workers']} gunicorn workers)" if report["workers"] else ""),
+             f"{'endpoint':<{width}} {'requests':>9} {'errors':>7} {'err %':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"]
+    order = sorted((name for name in endpoints if name != "total"), key=lambda name: -(endpoints[name]["p95_ms"] or 0))
+    for name in order + ["total"]:
+        row = endpoints[name]
+        latency = " ".join(f"{row[key]:>8.1f}" if row[key] is not None else f"{'-':>8}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        lines.append(f"{name:<{width}} {row['requests']:>9} {row['errors']:>7} {row['error_rate'] * 100:>6.2f} {row['rps']:>8.2f} {latency}")
+    for name, error in report["last_errors"].items():
+        lines.append(f"Last error of {name}: {error}")
+    for name, error in report["setup_errors"].items():
+        lines.append(f"Setup error of {name}: {error}")
+    return "\n".join(lines)
@@ -0,0 +1,150 @@
+import atexit
+import json
+import logging
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, with the fields a log collector can index."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed # Records of the same call site dropped by the RateLimitFilter before this one
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most limit records per call site (logger, file and line) every window seconds, so a message
+    logged in a hot path can't flood the log. Only records up to max_level are limited, warnings and errors always
+    pass. The first record let through after a window has the number of dropped ones in its suppressed attribute."""
+    def __init__(self, limit: int, window: float, max_level: int = logging.INFO):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.max_level = max_level
+        self._lock = threading.Lock()
+        self._counters = {} # Call site to [window start, records let through, records dropped]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0 or record.levelno > self.max_level:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                if counter and counter[2]:
+                    record.suppressed = counter[2]
+                self._counters[key] = [now, 1, 0]
+                return True
+            if counter[1] < self.limit:
+                counter[1] += 1
+                return True
+            counter[2] += 1
+            return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler leaving the formatting to the listener thread. Only the message is merged with its arguments
+    (so later changes of mutable arguments don't show up), the traceback and JSON encoding happen off the
+    request thread."""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+
+class LogPipeline:
+    """Queue between the app's loggers and the file handler, drained by a QueueListener thread.
+
+    Fields:
+    - handler: handler attached to the loggers, only enqueues records | DeferredQueueHandler
+    - file_handler: rotating JSON lines file written by the listener thread | RotatingFileHandler
+    - listener: thread writing the queued records to file_handler | QueueListener"""
+    def __init__(self, path: str, max_bytes: int, backup_count: int, rate_limit: int, rate_window: float):
+        self.file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.file_handler.setFormatter(JsonFormatter())
+        self.handler = DeferredQueueHandler(queue.SimpleQueue())
+        self.handler.addFilter(RateLimitFilter(rate_limit, rate_window))
+        self.listener = None
+        self.start()
+
+    def start(self) -> None:
+        """Start draining the handler's queue in a new listener thread."""
+        self.listener = QueueListener(self.handler.queue, self.file_handler, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self) -> None:
+        """Write the queued records and stop the listener thread."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart_in_child(self) -> None:
+        """Threads don't survive a fork, so a forked process (report worker pool, preloading servers) gets a new
+        queue and listener. Records queued but not yet written at the fork are left to the parent.
+        Pool processes exit without running atexit, their multiprocessing finalizer stops the listener instead."""
+        self.listener = None
+        self.handler.queue = queue.SimpleQueue()
+        self.start()
+        multiprocessing.util.Finalize(self, self.stop, exitpriority=0)
+
+
+def parse_log_levels(spec: str) -> tuple[dict, list[str]]:
+    """Parse a comma separated list of logger=LEVEL entries, e.g. "sqlalchemy.engine=INFO, werkzeug=warning".
+
+    Returns:
+        tuple: Logger name to level name mapping, and the entries skipped for lacking a name or a known level"""
+    levels, skipped = {}, []
+    for item in spec.split(','):
+        name, _, level = (part.strip() for part in item.partition('='))
+        if not name and not level:
+            continue # Empty entry, e.g. after a trailing comma
+        level = level.upper()
+        if name and isinstance(logging.getLevelName(level), int):
+            levels[name] = level
+        else:
+            skipped.append(item.strip())
+    return levels, skipped
+
+
+def configure_logging(app) -> LogPipeline | None:
+    """Set the log levels from the config (LOG_LEVEL for the app logger, LOG_LEVELS for any other logger by name).
+    Outside of debug mode, also send the app logs through a LogPipeline to the rotating JSON lines LOG_FILE.
+
+    Returns:
+        LogPipeline: The started pipeline, None in debug mode where Flask logs to the console"""
+    app.logger.setLevel(app.config["LOG_LEVEL"])
+    levels, skipped = parse_log_levels(app.config["LOG_LEVELS"])
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+    if skipped:
+        app.logger.warning("Skipped malformed LOG_LEVELS entries: %s", ", ".join(skipped))
+    if app.debug:
+        return None
+    log_dir = os.path.dirname(app.config["LOG_FILE"])
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+    pipeline = LogPipeline(app.config["LOG_FILE"], app.config["LOG_MAX_BYTES"], app.config["LOG_BACKUP_COUNT"],
+                           app.config["LOG_RATE_LIMIT"], app.config["LOG_RATE_WINDOW"])
+    app.logger.addHandler(pipeline.handler)
+    atexit.register(pipeline.stop)
+    os.register_at_fork(after_in_child=pipeline.restart_in_child)
+    return pipeline
@@ -0,0 +1,223 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import dash
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+DASH_UPDATE_PATH = "/_dash-update-component" # Suffix of the route serving every Dash callback
+
+# Metric name to (help text, bucket upper bounds), every metric is a histogram labelled by endpoint and callback
+HISTOGRAMS = {
+    "travel_planner_request_duration_seconds": ("Wall time of the request, until the last byte for streamed responses.", LATENCY_BUCKETS),
+    "travel_planner_request_sql_queries": ("SQL statements executed by the request.", QUERY_BUCKETS),
+    "travel_planner_request_sql_duration_seconds": ("Time spent executing the SQL statements of the request.", LATENCY_BUCKETS),
+    "travel_planner_response_size_bytes": ("Size of the response body.", SIZE_BUCKETS),
+}
+LABELS = ("endpoint", "callback")
+
+
+class RequestMetrics:
+    """Measurements of the request being served, kept in the WSGI environ so SQL executed while a response is
+    streamed still counts.
+
+    Fields:
+    - labels: endpoint and Dash callback id of the request | tuple[str, str]
+    - started_at: perf_counter time of the start of the request | float
+    - queries: SQL statements executed so far | int
+    - sql_time: seconds spent executing them | float
+    - size: response bytes sent so far | int"""
+    __slots__ = ('labels', 'started_at', 'queries', 'sql_time', 'size')
+    ENVIRON_KEY = "travel_planner.metrics"
+
+    def __init__(self, labels: tuple[str, str]):
+        self.labels = labels
+        self.started_at = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.size = 0
+
+
+class MetricsRegistry:
+    """Process-wide histograms of the HISTOGRAMS metrics, one series per label values.
+
+    Gunicorn runs several worker processes, each with its own registry, so a thread of every registry writes
+    its series to a file of the shared directory every flush_interval seconds when they changed. A scrape,
+    served by any worker, merges the files of all workers. Files of exited workers are kept, so their counts don't go backwards;
+    the directory should be emptied before the server starts."""
+    def __init__(self, directory: str, flush_interval: float):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._series = {} # (metric name, label values) to [bucket counts..., count of +Inf] + [sum]
+        self._dirty = False
+        self._flusher = None
+
+    def observe(self, name: str, labels: tuple[str, str], value: float) -> None:
+        """Add a value to the series of the given labels of a metric."""
+        buckets = HISTOGRAMS[name][1]
+        with self._lock:
+            series = self._series.get((name, labels))
+            if series is None:
+                series = self._series[(name, labels)] = [0] * (len(buckets) + 2)
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            series[index] += 1
+            series[-1] += value
+            self._dirty = True
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True)
+                self._flusher.start()
+
+    def observe_request(self, metrics: RequestMetrics) -> None:
+        """Record a finished request in all the metrics."""
+        self.observe("travel_planner_request_duration_seconds", metrics.labels, time.perf_counter() - metrics.started_at)
+        self.observe("travel_planner_request_sql_queries", metrics.labels, metrics.queries)
+        self.observe("travel_planner_request_sql_duration_seconds", metrics.labels, metrics.sql_time)
+        self.observe("travel_planner_response_size_bytes", metrics.labels, metrics.size)
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    def path(self, pid: int | None = None) -> str:
+        """Path of the series file of a process, this one by default."""
+        return os.path.join(self.directory, f"metrics_{pid or os.getpid()}.json")
+
+    def flush(self) -> None:
+        """Write the series of this process to its file, replacing it atomically."""
+        with self._lock:
+            self._dirty = False
+            if not self._series:
+                return
+            series = [[name, list(labels), values] for (name, labels), values in self._series.items()]
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path()
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(series, file)
+        os.replace(path + ".tmp", path)
+
+    def collect(self) -> dict:
+        """Merge the series files of all processes, after flushing this one's.
+
+        Returns:
+            dict: (metric name, label values) to the summed bucket counts and sum"""
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(self.directory, "metrics_*.json")):
+            try:
+                with open(path, encoding="utf-8") as file:
+                    series = json.load(file)
+            except (OSError, ValueError): # Removed or replaced while being read
+                continue
+            for name, labels, values in series:
+                if name not in HISTOGRAMS:
+                    continue
+                key = (name, tuple(labels))
+                if key in merged:
+                    merged[key] = [a + b for a, b in zip(merged[key], values)]
+                else:
+                    merged[key] = values
+        return merged
+
+    def render(self) -> str:
+        """Render the merged series of all processes in the Prometheus text exposition format."""
+        merged = self.collect()
+        lines = []
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), values in sorted(merged.items()):
+                if series_name != name:
+                    continue
+                label_text = ",".join(f'{key}="{escape_label(value)}"' for key, value in zip(LABELS, labels))
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), values):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f'{name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{label_text}}} {values[-1]!r}")
+                lines.append(f"{name}_count{{{label_text}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Drop the series of this process, e.g. in a forked child which must not report its parent's."""
+        self._lock = threading.Lock()
+        self._series = {}
+        self._dirty = False
+        self._flusher = None # Threads don't survive a fork
+
+
+def escape_label(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def callback_label() -> str:
+    """Id of the Dash callback served by the current request, empty for any other request. Ids not registered
+    in the Dash app are reported as "unknown", so clients can't create new series."""
+    if not request.path.endswith(DASH_UPDATE_PATH):
+        return ""
+    payload = request.get_json(silent=True) # Cached, Dash reads the same parsed body
+    output = payload.get("output") if isinstance(payload, dict) else None
+    return output if output in dash.get_app().callback_map else "unknown"
+
+
+def count_bytes(body, metrics: RequestMetrics, registry: MetricsRegistry):
+    """Pass a streamed response body through, counting its size, and record the request once it's sent."""
+    try:
+        for chunk in body:
+            metrics.size += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+        registry.observe_request(metrics)
+
+
+def init_metrics(app) -> MetricsRegistry:
+    """Measure every request of the app (Dash callbacks included) and every SQL statement run while serving one.
+
+    Returns:
+        MetricsRegistry: The registry the /metrics route renders"""
+    registry = MetricsRegistry(app.config["METRICS_DIR"], app.config["METRICS_FLUSH_INTERVAL"])
+
+    @app.before_request
+    def start_request_metrics():
+        request.environ[RequestMetrics.ENVIRON_KEY] = RequestMetrics((request.endpoint or "unmatched", callback_label()))
+
+    @app.after_request
+    def record_request_metrics(response):
+        metrics = request.environ.get(RequestMetrics.ENVIRON_KEY)
+        if metrics is None:
+            return response
+        size = response.content_length
+        if size is None and response.is_streamed:
+            response.response = count_bytes(response.response, metrics, registry)
+            return response
+        metrics.size = size if size is not None else response.calculate_content_length() or 0
+        registry.observe_request(metrics)
+        return response
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started_at = time.perf_counter()
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        metrics = request.environ.get(RequestMetrics.ENVIRON_KEY) if has_request_context() else None
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.sql_time += time.perf_counter() - context._metrics_started_at
+
+    atexit.register(registry.flush)
+    os.register_at_fork(after_in_child=registry.reset)
+    return registry
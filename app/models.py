@@ -1,13 +1,17 @@
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from datetime import datetime, timezone
+from sqlalchemy.dialects import mysql, sqlite
+from datetime import datetime, timezone, date, timedelta
 from typing import Optional
 from config import Config
 from werkzeug.security import check_password_hash, generate_password_hash
 from flask_login import UserMixin # Adds safe implementations of 4 elements (is_authenticated, get_id(), etc...)
 from app import app, db, login
 from hashlib import md5
+import threading
+import time
 import numpy as np
+import pandas as pd
 
 
 class User(UserMixin, db.Model):
@@ -50,6 +54,42 @@ class User(UserMixin, db.Model):
         digest = md5(self.email.lower().encode('utf-8')).hexdigest()
         return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
     
+    def get_trips_page(self, after: Optional[tuple[datetime, int]] = None, limit: int = 20) -> list['Trip']:
+        """Get up to limit trips of the user in (created_at, id) order, starting after the (created_at, id) keyset cursor
+        of the previous page. The index on (user_id, created_at) is walked from the cursor, so the cost of a page
+        doesn't grow with the number of pages before it."""
+        query = self.trips.select().order_by(Trip.created_at, Trip.id).limit(limit)
+        if after:
+            created_at, trip_id = after
+            query = query.where(sa.or_(Trip.created_at > created_at,
+                                       sa.and_(Trip.created_at == created_at, Trip.id > trip_id)))
+        return db.session.scalars(query).all()
+
+    def get_trip_totals(self, currency: Optional[str] = None, trip_ids: Optional[list[int]] = None) -> dict:
+        """Get the cost of the active components of every trip of the user (or only of trip_ids) in currency 
+        (the preferred currency by default), read from the TripCostSummary rows with one aggregate query.
+        
+        Returns:
+            dict: trip_id to total cost mapping, rounded to 2 decimal places
+            
+        Raises:
+            ValueError: If currency or a currency of the components has no exchange rate"""
+        currency = currency or self.preferred_currency
+        rate_from = so.aliased(ExchangeRates)
+        rate_to = sa.select(ExchangeRates.rate).where(ExchangeRates.currency_to == currency).scalar_subquery()
+        query = (
+            sa.select(TripCostSummary.trip_id, sa.func.sum(TripCostSummary.total_cost * rate_to / rate_from.rate),
+                      missing_rate(rate_from, rate_to, TripCostSummary.currency, currency))
+            .join(Trip, Trip.id == TripCostSummary.trip_id)
+            .outerjoin(rate_from, rate_from.currency_to == TripCostSummary.currency)
+            .where(Trip.user_id == self.id, TripCostSummary.is_active == True)
+            .group_by(TripCostSummary.trip_id))
+        if trip_ids is not None:
+            query = query.where(TripCostSummary.trip_id.in_(trip_ids))
+        rows = db.session.execute(query).all()
+        check_missing_rates(missing for _, _, missing in rows)
+        return {trip_id: round(float(cost or 0.0), 2) for trip_id, cost, _ in rows}
+
     def __repr__(self):
         return f'<User {self.username}>'    
     
@@ -67,32 +107,121 @@ class Trip(db.Model):
     - user_id: foreign key to User model | int
     - trip_name: name of the trip | str
     - created_at: datetime of trip creation | datetime
+    - data_version: counter increased on every change of the trip's components, used as a cache key | int
 
     Foreign key relationships:
     - user: many-to-one relationship with User model
     - components: one-to-many relationship with Component model"""
+    __table_args__ = (
+        sa.Index('ix_trip_user_id_created_at', 'user_id', 'created_at'), # Trips of a user in (created_at, id) order, also serves the user_id foreign key
+        sa.Index('ix_trip_user_id_trip_name', 'user_id', 'trip_name'), # Trip name check of TripForm
+    )
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
-    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id, name='fk_trip_user_id'), index=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id, name='fk_trip_user_id'))
     trip_name: so.Mapped[str] = so.mapped_column(sa.String(64))
     created_at: so.Mapped[datetime] = so.mapped_column(
         sa.DateTime, index=True, default=lambda: datetime.now(timezone.utc))
+    data_version: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
     
     user: so.Mapped[User] = so.relationship(back_populates='trips')
     components: so.WriteOnlyMapped['Component'] = so.relationship(back_populates='trip', passive_deletes=True)
     participants: so.WriteOnlyMapped['Participant'] = so.relationship(back_populates='trip', passive_deletes=True)
 
-    def get_total_cost(self) -> float: # Not currently used
+    def get_total_cost(self) -> float:
         """Get the total cost of all components in the trip converted to the user's preferred currency. Rounded to 2 decimal places."""
-        components = db.session.scalars(self.components.select())
-        cost = np.sum(
-            component.base_cost * get_exchange_rate(component.currency, self.user.preferred_currency)
-            for component in components
-        )
-
-        if not cost:
-            cost = 0.0
-        return round(cost, 2)
+        return self.get_cost_summary()["total"]
+    
+    def get_cost_summary(self, currency: Optional[str] = None, stored: bool = False) -> dict:
+        """Get the trip costs converted to currency (the user's preferred currency by default) with a single aggregate 
+        query, joining the components to their exchange rates. No component rows are loaded. With stored=True the
+        incrementally maintained TripCostSummary rows are aggregated instead of the components.
+        
+        Returns:
+            dict: Summary with keys:
+            - currency: currency of the costs | str
+            - total, active_total: cost of all and of active components | float
+            - count: number of components | int
+            - by_category, by_participant, by_active: subtotals keyed by category_id, participant_id 
+              (None for shared components) and is_active | dict
+            - groups: subtotals per (category_id, participant_id, is_active) with their cost, count and paid_count 
+              (components with cost > 0), used to recompute totals for filtered views | list[dict]
+              
+        Raises:
+            ValueError: If currency or a currency of the components has no exchange rate"""
+        currency = currency or self.user.preferred_currency
+        rate_from = so.aliased(ExchangeRates)
+        rate_to = sa.select(ExchangeRates.rate).where(ExchangeRates.currency_to == currency).scalar_subquery()
+        if stored:
+            source = TripCostSummary
+            participant_id = sa.func.nullif(TripCostSummary.participant_id, TripCostSummary.SHARED_PARTICIPANT).label('participant_id')
+            columns = (sa.func.sum(TripCostSummary.total_cost * rate_to / rate_from.rate).label('cost'),
+                       sa.func.sum(TripCostSummary.component_count).label('count'),
+                       sa.func.sum(TripCostSummary.paid_count).label('paid_count'))
+        else:
+            source = Component
+            participant_id = Component.participant_id
+            columns = (sa.func.sum(Component.base_cost * rate_to / rate_from.rate).label('cost'),
+                       sa.func.count().label('count'),
+                       sa.func.count(sa.case((Component.base_cost > 0, 1))).label('paid_count'))
+        query = (
+            sa.select(source.category_id, participant_id, source.is_active, *columns,
+                      missing_rate(rate_from, rate_to, source.currency, currency))
+            .outerjoin(rate_from, rate_from.currency_to == source.currency)
+            .where(source.trip_id == self.id)
+            .group_by(source.category_id, participant_id, source.is_active))
+        rows = db.session.execute(query).all()
+        check_missing_rates(missing for _, _, _, _, count, _, missing in rows if count) # Emptied summary rows are skipped below too
+        
+        summary = {"currency": currency, "total": 0.0, "active_total": 0.0, "count": 0, 
+                   "by_category": {}, "by_participant": {}, "by_active": {}, "groups": []}
+        for category_id, participant_id, is_active, cost, count, paid_count, _ in rows:
+            cost, count, paid_count = float(cost or 0.0), int(count), int(paid_count)
+            if not count:
+                continue # Emptied summary rows
+            summary["groups"].append({"category_id": category_id, "participant_id": participant_id, "is_active": is_active,
+                                      "cost": round(cost, 2), "count": count, "paid_count": paid_count})
+            summary["total"] += cost
+            summary["active_total"] += cost if is_active else 0.0
+            summary["count"] += count
+            for key, value in (("by_category", category_id), ("by_participant", participant_id), ("by_active", is_active)):
+                summary[key][value] = summary[key].get(value, 0.0) + cost
+        
+        summary["total"] = round(summary["total"], 2)
+        summary["active_total"] = round(summary["active_total"], 2)
+        for key in ("by_category", "by_participant", "by_active"):
+            summary[key] = {value: round(cost, 2) for value, cost in summary[key].items()}
+        return summary
     
+    def get_historical_cost(self) -> float:
+        """Get the total cost of all components in the trip converted to the user's preferred currency at the rates
+        in force on each component's start date. Rounded to 2 decimal places."""
+        rows = db.session.execute(
+            sa.select(Component.base_cost, Component.currency, Component.start_date)
+            .where(Component.trip_id == self.id)).all()
+        if not rows:
+            return 0.0
+        amounts, currencies, dates = zip(*rows)
+        cost = convert_many_as_of(amounts, currencies, dates, self.user.preferred_currency).sum()
+        return round(float(cost), 2)
+    
+    @staticmethod
+    def bump_data_version(trip_id: int) -> None:
+        """Mark the trip's components as changed, so cached copies of its data are no longer used. Doesn't commit."""
+        db.session.execute(
+            sa.update(Trip).where(Trip.id == trip_id).values(data_version=Trip.data_version + 1)
+            .execution_options(synchronize_session=False))
+    
+    def get_components_with_details(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> list['Component']:
+        """Get the components in the trip in id order with their category and type loaded in the same query.
+        Pages are read with the after_id keyset cursor (id of the last component of the previous page) and limit."""
+        query = (self.components.select()
+                 .options(so.joinedload(Component.category), so.joinedload(Component.type))
+                 .order_by(Component.id)
+                 .limit(limit))
+        if after_id is not None:
+            query = query.where(Component.id > after_id)
+        return db.session.scalars(query).all()
+
     def get_active_components(self) -> list['Component']:
         """Get all active components in the trip."""
         return db.session.scalars(self.components.select().where(Component.is_active == True)).all()
@@ -183,8 +312,11 @@ class Component(db.Model):
     - trip: many-to-one relationship with Trip model
     - category: many-to-one relationship with ComponentCategory model
     - type: many-to-one relationship with ComponentType model"""
+    __table_args__ = (
+        sa.Index('ix_component_trip_id_is_active', 'trip_id', 'is_active'), # Active components of a trip
+    )
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
-    trip_id: so.Mapped[int] = so.mapped_column(
+    trip_id: so.Mapped[int] = so.mapped_column( # Own index too, it keeps the components of a trip in id order for the pages
         sa.ForeignKey('trip.id', name='fk_component_trip_id', ondelete='CASCADE'), index=True)
     category_id: so.Mapped[int] = so.mapped_column(
         sa.ForeignKey('component_category.id', name='fk_component_category_id'), index=True)
@@ -210,6 +342,144 @@ class Component(db.Model):
         return f'{self.component_name}, {self.base_cost} {self.currency}'
     
 
+class TripCostSummary(db.Model):
+    """Trip cost summary model, a denormalized copy of the component costs of each trip summed per category, 
+    participant, currency and activity. Kept up to date in the same transaction as the component changes in routes,
+    so trip totals can be read without scanning components. Costs are stored in their original currency and 
+    converted when read, so rate updates don't invalidate them.
+
+    Fields:
+    - id: primary key | int
+    - trip_id: foreign key to Trip model | int
+    - category_id: category of the summed components | int
+    - participant_id: participant of the summed components, SHARED_PARTICIPANT for shared components, so the
+      unique key also covers their rows | int
+    - currency: currency of the summed costs as a 3-letter ICO code | str
+    - is_active: whether the summed components are active | bool
+    - total_cost: sum of the base costs | float
+    - component_count: number of summed components | int
+    - paid_count: number of summed components with a cost above 0 | int"""
+    KEY = ('trip_id', 'category_id', 'participant_id', 'currency', 'is_active')
+    SHARED_PARTICIPANT = 0 # participant_id of the rows of shared components, ids start at 1
+
+    __table_args__ = (
+        sa.UniqueConstraint(*KEY, name='uq_trip_cost_summary_key'), # One row per key, concurrent adds upsert into it
+    )
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    trip_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('trip.id', name='fk_trip_cost_summary_trip_id', ondelete='CASCADE'), index=True)
+    category_id: so.Mapped[int] = so.mapped_column(sa.Integer)
+    participant_id: so.Mapped[int] = so.mapped_column(sa.Integer, default=SHARED_PARTICIPANT)
+    currency: so.Mapped[str] = so.mapped_column(sa.String(3))
+    is_active: so.Mapped[bool] = so.mapped_column(sa.Boolean)
+    total_cost: so.Mapped[float] = so.mapped_column(sa.DECIMAL(14, 2), default=0)
+    component_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+    paid_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+
+    @classmethod
+    def add(cls, key: dict, cost, count: int, paid_count: int) -> None:
+        """Add cost and counts (negative to subtract) to the summary row of key, creating it if needed, in a single
+        upsert on the unique key, so concurrent requests never create two rows of the same key. Uses
+        INSERT ... ON DUPLICATE KEY UPDATE on MySQL and INSERT ... ON CONFLICT on SQLite, other databases fall back
+        to an UPDATE followed by an INSERT when no row matched. A participant_id of None is stored as
+        SHARED_PARTICIPANT. Doesn't commit."""
+        row = {**key, 'participant_id': key['participant_id'] or cls.SHARED_PARTICIPANT,
+               'total_cost': cost, 'component_count': count, 'paid_count': paid_count}
+        dialect = db.session.get_bind().dialect.name
+        if dialect == "mysql":
+            stmt = mysql.insert(cls).values(row)
+            stmt = stmt.on_duplicate_key_update(
+                total_cost=cls.total_cost + stmt.inserted.total_cost,
+                component_count=cls.component_count + stmt.inserted.component_count,
+                paid_count=cls.paid_count + stmt.inserted.paid_count)
+            db.session.execute(stmt)
+        elif dialect == "sqlite":
+            stmt = sqlite.insert(cls).values(row)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(cls.KEY),
+                set_={"total_cost": cls.total_cost + stmt.excluded.total_cost,
+                      "component_count": cls.component_count + stmt.excluded.component_count,
+                      "paid_count": cls.paid_count + stmt.excluded.paid_count})
+            db.session.execute(stmt)
+        else:
+            updated = db.session.execute(
+                sa.update(cls).where(*(getattr(cls, column) == row[column] for column in cls.KEY)).values(
+                    total_cost=cls.total_cost + cost,
+                    component_count=cls.component_count + count,
+                    paid_count=cls.paid_count + paid_count)
+                .execution_options(synchronize_session=False))
+            if updated.rowcount == 0:
+                db.session.add(cls(**row))
+
+    @classmethod
+    def add_component(cls, component: 'Component', sign: int = 1) -> None:
+        """Add (sign=1) or remove (sign=-1) the component from its summary row using its current field values. Doesn't commit."""
+        db.session.flush() # Apply relationship and column defaults of new components
+        key = {column: getattr(component, column) for column in cls.KEY}
+        base_cost = component.base_cost or 0
+        cls.add(key, sign * base_cost, sign, sign if base_cost > 0 else 0)
+
+    @classmethod
+    def remove_participant(cls, trip_id: int, participant_id: int) -> None:
+        """Move the costs of a deleted participant to the shared components rows of the trip. Doesn't commit."""
+        rows = db.session.scalars(
+            sa.select(cls).where(cls.trip_id == trip_id, cls.participant_id == participant_id)).all()
+        for row in rows:
+            key = {column: getattr(row, column) for column in cls.KEY}
+            key['participant_id'] = cls.SHARED_PARTICIPANT
+            cost, count, paid_count = row.total_cost, row.component_count, row.paid_count
+            db.session.delete(row)
+            cls.add(key, cost, count, paid_count)
+
+    @classmethod
+    def aggregate_components(cls) -> sa.Select:
+        """Query computing the summary rows of all trips from the components table."""
+        participant_id = sa.func.coalesce(Component.participant_id, cls.SHARED_PARTICIPANT).label('participant_id')
+        return (
+            sa.select(Component.trip_id, Component.category_id, participant_id, Component.currency, Component.is_active,
+                      sa.func.sum(Component.base_cost).label('total_cost'),
+                      sa.func.count().label('component_count'),
+                      sa.func.count(sa.case((Component.base_cost > 0, 1))).label('paid_count'))
+            .group_by(Component.trip_id, Component.category_id, participant_id, Component.currency, Component.is_active))
+
+    @classmethod
+    def rebuild(cls) -> int:
+        """Recompute all summary rows from the components table with a single INSERT ... SELECT. Doesn't commit.
+        
+        Returns:
+            int: Number of summary rows written"""
+        db.session.execute(sa.delete(cls))
+        query = cls.aggregate_components()
+        db.session.execute(sa.insert(cls).from_select([*cls.KEY, 'total_cost', 'component_count', 'paid_count'], query))
+        return db.session.scalar(sa.select(sa.func.count()).select_from(cls))
+
+    @classmethod
+    def find_drift(cls) -> list[dict]:
+        """Compare the stored summary rows with the components table.
+        
+        Returns:
+            list[dict]: Keys whose stored totals differ from the computed ones, with both values"""
+        def totals(rows):
+            result = {}
+            for row in rows:
+                key = tuple(getattr(row, column) for column in cls.KEY)
+                stored = result.get(key, (0, 0, 0))
+                result[key] = (stored[0] + row.total_cost, stored[1] + row.component_count, stored[2] + row.paid_count)
+            return result
+        
+        expected = totals(db.session.execute(cls.aggregate_components()))
+        stored = totals(db.session.execute(sa.select(cls)).scalars())
+        drift = []
+        for key in expected.keys() | stored.keys():
+            expected_values, stored_values = expected.get(key, (0, 0, 0)), stored.get(key, (0, 0, 0))
+            if expected_values != stored_values:
+                drift.append({**dict(zip(cls.KEY, key)), 'expected': expected_values, 'stored': stored_values})
+        return drift
+
+    def __repr__(self):
+        return f'<TripCostSummary trip_id {self.trip_id}, category_id {self.category_id}, participant_id {self.participant_id}, {self.total_cost} {self.currency}>'
+    
+
 class ExchangeRates(db.Model):
     """Exchange rates model for storing currency conversion rates. It stores rates from PLN to other currencies, 
     from which other rates can be calculated (to limit the memory taken up in the database).
@@ -227,6 +497,106 @@ class ExchangeRates(db.Model):
 
     def __repr__(self):
         return f'<ExchangeRate PLN to {self.currency_to} at rate {self.rate}>'
+    
+
+class ExchangeRateHistory(db.Model):
+    """Exchange rate history model, an append-only daily snapshot of the ExchangeRates table used to 
+    convert costs at the rate in force on a given date. The primary key doubles as the index for as-of lookups.
+
+    Fields:
+    - currency_to: currency to convert to as a 3-letter ICO code | primary key | str
+    - rate_date: date the rate was in force from | primary key | date
+    - rate: conversion rate from PLN | float"""
+    currency_to: so.Mapped[str] = so.mapped_column(sa.String(3), primary_key=True)
+    rate_date: so.Mapped[date] = so.mapped_column(sa.Date, primary_key=True)
+    rate: so.Mapped[float] = so.mapped_column(sa.DECIMAL(18, 9))
+
+    def __repr__(self):
+        return f'<ExchangeRateHistory PLN to {self.currency_to} on {self.rate_date} at rate {self.rate}>'
+
+
+class ReportJob(db.Model):
+    """Report job model, a database backed queue of trip reports built by the report_worker command.
+    A job goes from queued to running when a worker claims it, then to done (artifact written) or failed.
+
+    Fields:
+    - id: primary key | int
+    - user_id: foreign key to User model, the user who requested the report | int
+    - trip_id: foreign key to Trip model | int
+    - report_format: format of the report, one of REPORT_FORMATS in app.reports.report | str
+    - status: queued, running, done or failed | str
+    - worker: host and pid of the worker process which claimed the job | str | optional
+    - artifact: file name of the built report in Config.REPORTS_DIR | str | optional
+    - error: error message of a failed job | str | optional
+    - created_at, started_at, finished_at: datetimes of the job steps | datetime | optional"""
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    user_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('user.id', name='fk_report_job_user_id', ondelete='CASCADE'), index=True)
+    trip_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('trip.id', name='fk_report_job_trip_id', ondelete='CASCADE'), index=True)
+    report_format: so.Mapped[str] = so.mapped_column(sa.String(8))
+    status: so.Mapped[str] = so.mapped_column(sa.String(16), default='queued', index=True)
+    worker: so.Mapped[Optional[str]] = so.mapped_column(sa.String(64))
+    artifact: so.Mapped[Optional[str]] = so.mapped_column(sa.String(255))
+    error: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    created_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at: so.Mapped[Optional[datetime]] = so.mapped_column(sa.DateTime)
+    finished_at: so.Mapped[Optional[datetime]] = so.mapped_column(sa.DateTime)
+
+    @classmethod
+    def claim_next(cls, worker: str) -> Optional['ReportJob']:
+        """Claim the oldest queued job for worker and commit. The claim is a conditional UPDATE, so when several
+        workers race for the same job only one of them gets it, on any database.
+
+        Returns:
+            ReportJob: The claimed job, None if the queue is empty"""
+        while True:
+            job_id = db.session.scalar(sa.select(cls.id).where(cls.status == 'queued').order_by(cls.id).limit(1))
+            if job_id is None:
+                return None
+            claimed = db.session.execute(
+                sa.update(cls).where(cls.id == job_id, cls.status == 'queued')
+                .values(status='running', worker=worker, started_at=datetime.now(timezone.utc))
+                .execution_options(synchronize_session=False)).rowcount
+            db.session.commit()
+            if claimed:
+                return db.session.get(cls, job_id, populate_existing=True)
+
+    @classmethod
+    def requeue_stale(cls, timeout: float) -> int:
+        """Put jobs running for longer than timeout seconds back in the queue, their worker is assumed dead. Commits.
+
+        Returns:
+            int: Number of requeued jobs"""
+        started_before = datetime.now(timezone.utc) - timedelta(seconds=timeout)
+        requeued = db.session.execute(
+            sa.update(cls).where(cls.status == 'running', cls.started_at < started_before)
+            .values(status='queued', worker=None, started_at=None)
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        return requeued
+
+    @classmethod
+    def finish(cls, job_id: int, worker: str, status: str, artifact: Optional[str], error: Optional[str]) -> bool:
+        """Record the result of a job run and commit. Like the claim it's a conditional UPDATE, applied only while
+        the job is still running under worker, so the run of a requeued job can't overwrite another run's result.
+
+        Returns:
+            bool: Whether the result was recorded"""
+        finished = db.session.execute(
+            sa.update(cls).where(cls.id == job_id, cls.status == 'running', cls.worker == worker)
+            .values(status=status, artifact=artifact, error=error, finished_at=datetime.now(timezone.utc))
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        return bool(finished)
+
+    def to_dict(self) -> dict:
+        """Status of the job as returned to the client."""
+        return {"id": self.id, "trip_id": self.trip_id, "format": self.report_format, "status": self.status,
+                "error": self.error}
+
+    def __repr__(self):
+        return f'<ReportJob {self.id} {self.report_format} of trip {self.trip_id}: {self.status}>'
 
 # Helpers
 def populate_initial_data():
@@ -247,11 +617,184 @@ def populate_initial_data():
                     db.session.add(ComponentType(category_id=category.id, type_name=type_name))
 
     db.session.commit()
+    reference_catalog.invalidate()
+
+
+class RateSnapshot:
+    """Immutable in-memory copy of the PLN based ExchangeRates table.
+
+    Fields:
+    - version: snapshot version, increased on every reload | int
+    - rates: currency code to PLN rate mapping | dict[str, Decimal]
+    - index: currency code to position in vector mapping | dict[str, int]
+    - vector: PLN rates as floats, indexed by the positions in index | np.ndarray
+    - loaded_at: monotonic time of the load | float"""
+    __slots__ = ('version', 'rates', 'index', 'vector', 'loaded_at')
+
+    def __init__(self, version: int, rates: dict, loaded_at: float):
+        self.version = version
+        self.rates = rates
+        self.index = {currency: i for i, currency in enumerate(rates)}
+        self.vector = np.fromiter((float(rate) for rate in rates.values()), dtype=np.float64, count=len(rates))
+        self.loaded_at = loaded_at
+
+    def __repr__(self):
+        return f'<RateSnapshot v{self.version}, {len(self.rates)} currencies>'
+
+
+class ExchangeRateCache:
+    """Process-wide cache of the ExchangeRates table, so rate lookups don't hit the database.
+    
+    The whole table is loaded once and kept as a versioned snapshot. It is reloaded when invalidated,
+    when it is older than Config.RATE_CACHE_TTL seconds (rates updated by another process) or when a 
+    currency is missing from it, at most once per miss_reload_interval seconds so lookups of unknown codes
+    don't query the table every time. The version only changes when a reload finds different rates."""
+    def __init__(self, ttl: float, miss_reload_interval: float):
+        self.ttl = ttl
+        self.miss_reload_interval = miss_reload_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = 0
+
+    def snapshot(self, *currencies: str) -> RateSnapshot:
+        """Return the current snapshot, loading it from the database if needed. If any of the given
+        currencies is missing from it, the snapshot is reloaded once, unless it was loaded less than
+        miss_reload_interval seconds ago."""
+        snapshot = self._snapshot
+        age = time.monotonic() - snapshot.loaded_at if snapshot is not None else None
+        if snapshot is None or age > self.ttl:
+            snapshot = self.reload()
+        elif age >= self.miss_reload_interval and not all(currency in snapshot.rates for currency in currencies):
+            snapshot = self.reload()
+        return snapshot
+
+    def reload(self) -> RateSnapshot:
+        """Load the whole ExchangeRates table into a new snapshot, keeping the version if the rates didn't change."""
+        with self._lock:
+            rates = {currency: rate for currency, rate in 
+                     db.session.execute(sa.select(ExchangeRates.currency_to, ExchangeRates.rate))}
+            if self._snapshot is None or rates != self._snapshot.rates:
+                self._version += 1
+            self._snapshot = RateSnapshot(self._version, rates, time.monotonic())
+            app.logger.info("Loaded exchange rate snapshot v%s with %s currencies.", self._version, len(rates))
+            return self._snapshot
+
+    def invalidate(self) -> None:
+        """Drop the current snapshot, the next lookup will reload it."""
+        with self._lock:
+            self._snapshot = None
+
+
+rate_cache = ExchangeRateCache(ttl=Config.RATE_CACHE_TTL, miss_reload_interval=Config.CACHE_MISS_RELOAD_INTERVAL)
+
+
+class ReferenceData:
+    """Immutable in-memory copy of the static reference tables: categories, types and currencies.
+
+    Fields:
+    - version: catalog version, increased on every reload | int
+    - categories: category id to name mapping, ordered by id | dict[int, str]
+    - types: type id to (category id, type name) mapping, ordered by id | dict[int, tuple[int, str]]
+    - types_by_category: category id to the (id, name) choices of its types | dict[int, list[tuple[int, str]]]
+    - currencies: currency codes of the ExchangeRates table, ordered | tuple[str]
+    - loaded_at: monotonic time of the load | float"""
+    __slots__ = ('version', 'categories', 'types', 'types_by_category', 'currencies', 'loaded_at')
+
+    def __init__(self, version: int, categories: dict, types: dict, currencies: tuple, loaded_at: float):
+        self.version = version
+        self.categories = categories
+        self.types = types
+        self.types_by_category = {}
+        for type_id, (category_id, type_name) in types.items():
+            self.types_by_category.setdefault(category_id, []).append((type_id, type_name))
+        self.currencies = currencies
+        self.loaded_at = loaded_at
+
+    def category_choices(self) -> list[tuple[int, str]]:
+        return list(self.categories.items())
+
+    def type_choices(self, category_id: Optional[int] = None) -> list[tuple[int, str]]:
+        """Choices of the types of category_id, of all types if it's not given."""
+        if category_id:
+            return list(self.types_by_category.get(category_id, []))
+        return [(type_id, type_name) for type_id, (_, type_name) in self.types.items()]
+
+    def currency_choices(self) -> list[tuple[str, str]]:
+        return [(currency, currency) for currency in self.currencies]
+
+    def __repr__(self):
+        return f'<ReferenceData v{self.version}, {len(self.categories)} categories, {len(self.types)} types, {len(self.currencies)} currencies>'
+
+
+class ReferenceCatalog:
+    """Process-wide cache of the reference tables used to populate and validate forms, so they don't hit the database.
+
+    Like the ExchangeRateCache, the tables are loaded once into a versioned snapshot, reloaded when invalidated
+    (by flask seed and update_exchange_rates), when older than Config.REFERENCE_CACHE_TTL seconds (changed by
+    another process) or when a looked up key is missing from it, at most once per miss_reload_interval seconds
+    so invalid ids posted to the forms don't query the tables every time."""
+    def __init__(self, ttl: float, miss_reload_interval: float):
+        self.ttl = ttl
+        self.miss_reload_interval = miss_reload_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = 0
+
+    def snapshot(self) -> ReferenceData:
+        """Return the current snapshot, loading it from the database if needed."""
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.loaded_at > self.ttl:
+            snapshot = self.reload()
+        return snapshot
+
+    def reload(self) -> ReferenceData:
+        """Load the reference tables into a new snapshot, with one query per table."""
+        with self._lock:
+            categories = dict(db.session.execute(
+                sa.select(ComponentCategory.id, ComponentCategory.category_name).order_by(ComponentCategory.id)).all())
+            types = {type_id: (category_id, type_name) for type_id, category_id, type_name in db.session.execute(
+                sa.select(ComponentType.id, ComponentType.category_id, ComponentType.type_name).order_by(ComponentType.id))}
+            currencies = tuple(db.session.scalars(sa.select(ExchangeRates.currency_to).order_by(ExchangeRates.currency_to)))
+            self._version += 1
+            self._snapshot = ReferenceData(self._version, categories, types, currencies, time.monotonic())
+            app.logger.info("Loaded reference catalog v%s with %s categories, %s types and %s currencies.",
+                            self._version, len(categories), len(types), len(currencies))
+            return self._snapshot
+
+    def invalidate(self) -> None:
+        """Drop the current snapshot, the next lookup will reload it."""
+        with self._lock:
+            self._snapshot = None
+
+    def _contains(self, field: str, key) -> bool:
+        """Whether key is in the given field of the snapshot, reloading it once if it isn't and the snapshot
+        is at least miss_reload_interval seconds old."""
+        if key is None:
+            return False
+        snapshot = self.snapshot()
+        if key in getattr(snapshot, field):
+            return True
+        if time.monotonic() - snapshot.loaded_at < self.miss_reload_interval:
+            return False
+        return key in getattr(self.reload(), field)
+
+    def has_category(self, category_id: int) -> bool:
+        return self._contains('categories', category_id)
+
+    def has_type(self, type_id: int) -> bool:
+        return self._contains('types', type_id)
+
+    def has_currency(self, currency: str) -> bool:
+        return self._contains('currencies', currency)
+
+
+reference_catalog = ReferenceCatalog(ttl=Config.REFERENCE_CACHE_TTL, miss_reload_interval=Config.CACHE_MISS_RELOAD_INTERVAL)
 
 
 def get_exchange_rate(currency_from, currency_to):
     """Calculate the exchange rate from currency_from to currency_to using the PLN exchange rates from the database. 
-    Done this way to avoid making multiple API calls and being rate limited.
+    Done this way to avoid making multiple API calls and being rate limited. Rates are read from the in-process
+    rate_cache snapshot, so no query is made per lookup.
     
     Args:
         currency_from (str): Currency code to convert from
@@ -259,18 +802,128 @@ def get_exchange_rate(currency_from, currency_to):
         
     Returns:
         float: Exchange rate from currency_from to currency_to"""
-    app.logger.info(f"Calculating exchange rate from {currency_from} to {currency_to}")
-    # Get the rate in PLN for each currency
-    rates = db.session.query(ExchangeRates.currency_to, ExchangeRates.rate).filter(
-        ExchangeRates.currency_to.in_([currency_from, currency_to])
-    ).all()
-    
-    rates_dict = {currency: rate for currency, rate in rates}
+    rates_dict = rate_cache.snapshot(currency_from, currency_to).rates
 
     if currency_from not in rates_dict or currency_to not in rates_dict:
-        app.logger.warning(f"Currency rates for {currency_from} or {currency_to} not found in the database.")
+        app.logger.warning("Currency rates for %s or %s not found in the database.", currency_from, currency_to)
         raise ValueError("One or both of the currency codes are not available in the database.")
 
-    exchange_rate = rates_dict[currency_to] / rates_dict[currency_from]
-    app.logger.info(f"Exchange rate from {currency_from} to {currency_to}: {exchange_rate}")
-    return exchange_rate
\ No newline at end of file
+    return rates_dict[currency_to] / rates_dict[currency_from]
+
+
+def cross_rates(currencies, currency_to) -> np.ndarray:
+    """Calculate the exchange rate from every currency in currencies to currency_to in one vectorized operation.
+    
+    Args:
+        currencies (Iterable[str]): Currency codes to convert from
+        currency_to (str): Currency code to convert to
+        
+    Returns:
+        np.ndarray: Exchange rates aligned with currencies"""
+    currencies = np.asarray(currencies, dtype=object)
+    if currencies.size == 0:
+        return np.empty(0, dtype=np.float64)
+    codes, inverse = np.unique(currencies, return_inverse=True) # Only a handful of distinct currencies per trip
+    snapshot = rate_cache.snapshot(currency_to, *codes)
+    
+    missing = [code for code in (currency_to, *codes) if code not in snapshot.index]
+    if missing:
+        app.logger.warning("Currency rates for %s not found in the database.", ', '.join(missing))
+        raise ValueError("One or more of the currency codes are not available in the database.")
+    
+    positions = np.fromiter((snapshot.index[code] for code in codes), dtype=np.intp, count=len(codes))
+    rates = snapshot.vector[snapshot.index[currency_to]] / snapshot.vector[positions]
+    return rates[inverse]
+
+
+def missing_rate(rate_from, rate_to, currency_from, currency_to: str):
+    """Aggregate for the queries converting costs in SQL with an outer join to the rates: a currency of the group
+    without an exchange rate, NULL if all of them have one.
+    
+    Args:
+        rate_from: Outer joined ExchangeRates alias of the converted currencies
+        rate_to: Scalar subquery of the rate of currency_to
+        currency_from: Column of the converted currencies
+        currency_to (str): Currency code to convert to"""
+    return sa.func.max(sa.case((rate_to.is_(None), currency_to), (rate_from.rate.is_(None), currency_from)))
+
+
+def check_missing_rates(missing) -> None:
+    """Raise a ValueError, like cross_rates, if any currency code is given (None values are skipped).
+    Used with missing_rate, so costs without a rate aren't silently left out of totals."""
+    missing = sorted({currency for currency in missing if currency})
+    if missing:
+        app.logger.warning("Currency rates for %s not found in the database.", ', '.join(missing))
+        raise ValueError("One or more of the currency codes are not available in the database.")
+
+
+def convert_many(amounts, currencies, currency_to) -> np.ndarray:
+    """Convert a column of amounts, each in its own currency, to currency_to in one vectorized operation.
+    
+    Args:
+        amounts (Iterable[float | Decimal]): Amounts to convert
+        currencies (Iterable[str]): Currency code of each amount
+        currency_to (str): Currency code to convert to
+        
+    Returns:
+        np.ndarray: Converted amounts as float64"""
+    return np.asarray(amounts, dtype=np.float64) * cross_rates(currencies, currency_to)
+
+
+def convert_many_as_of(amounts, currencies, dates, currency_to) -> np.ndarray:
+    """Convert a column of amounts to currency_to at the rates in force on the given dates.
+
+    The needed slice of ExchangeRateHistory is read in a single query and matched to the rows with one 
+    as-of merge per side of the conversion. Rows without a date, or dated before the first snapshot of 
+    their currency, are converted at the current rate.
+    
+    Args:
+        amounts (Iterable[float | Decimal]): Amounts to convert
+        currencies (Iterable[str]): Currency code of each amount
+        dates (Iterable[datetime | date | None]): Date of each amount
+        currency_to (str): Currency code to convert to
+        
+    Returns:
+        np.ndarray: Converted amounts as float64"""
+    amounts = np.asarray(amounts, dtype=np.float64)
+    rates = cross_rates(currencies, currency_to)
+    rows = pd.DataFrame({
+        "position": np.arange(len(amounts)), 
+        "currency": np.asarray(currencies, dtype=object),
+        "date": pd.to_datetime(pd.Series(dates, dtype=object)).astype("datetime64[ns]").to_numpy(),
+    }).dropna(subset=["date"])
+    if rows.empty:
+        return amounts * rates
+    
+    history = _load_rate_history(
+        set(rows["currency"]) | {currency_to}, rows["date"].min().date(), rows["date"].max().date())
+    if history.empty:
+        return amounts * rates
+
+    rows = rows.sort_values("date")
+    rate_from = pd.merge_asof(rows, history, left_on="date", right_on="rate_date", 
+                              left_by="currency", right_by="currency_to")["rate"].to_numpy()
+    rate_to = pd.merge_asof(rows.assign(currency=currency_to), history, left_on="date", right_on="rate_date",
+                            left_by="currency", right_by="currency_to")["rate"].to_numpy()
+    historical = rate_to / rate_from
+    found = ~np.isnan(historical)
+    rates[rows["position"].to_numpy()[found]] = historical[found]
+    return amounts * rates
+
+
+def _load_rate_history(currencies: set, first: date, last: date) -> pd.DataFrame:
+    """Load the rate history of the given currencies needed to convert amounts dated between first and last,
+    including the latest snapshot before first, sorted by rate_date."""
+    floor = (sa.select(ExchangeRateHistory.currency_to, sa.func.max(ExchangeRateHistory.rate_date).label("rate_date"))
+             .where(ExchangeRateHistory.currency_to.in_(currencies), ExchangeRateHistory.rate_date <= first)
+             .group_by(ExchangeRateHistory.currency_to)
+             .subquery())
+    query = (sa.select(ExchangeRateHistory.currency_to, ExchangeRateHistory.rate_date, ExchangeRateHistory.rate)
+             .outerjoin(floor, floor.c.currency_to == ExchangeRateHistory.currency_to)
+             .where(ExchangeRateHistory.currency_to.in_(currencies), 
+                    ExchangeRateHistory.rate_date <= last,
+                    sa.or_(floor.c.rate_date.is_(None), ExchangeRateHistory.rate_date >= floor.c.rate_date)))
+    history = pd.DataFrame(db.session.execute(query).all(), columns=["currency_to", "rate_date", "rate"])
+    history["rate_date"] = pd.to_datetime(history["rate_date"]).astype("datetime64[ns]")
+    history["rate"] = history["rate"].astype(np.float64)
+    return history.sort_values("rate_date")
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+import threading
+from config import Config
+
+
+class LRUCache:
+    """Bounded, thread-safe, least recently used cache for the dashboard. Keys are tuples starting with the trip id,
+    so all the entries of a trip can be evicted when its components change.
+    
+    The cache lives in the worker process, every gunicorn worker keeps its own copy. Keys contain the trip's
+    data_version, so entries built by one worker are never served after another worker changed the trip."""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def evict_trip(self, trip_id: int) -> None:
+        """Remove all entries of the trip."""
+        with self._lock:
+            for key in [key for key in self._data if key[0] == trip_id]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
+
+
+trip_data_cache = LRUCache(Config.TRIP_DATA_CACHE_SIZE)
+figure_cache = LRUCache(Config.FIGURE_CACHE_SIZE) # Serialized dashboard outputs per trip version and filter state
+
+
+def evict_trip(trip_id: int) -> None:
+    """Drop all the cached dashboard data of the trip in this worker."""
+    trip_data_cache.evict_trip(trip_id)
+    figure_cache.evict_trip(trip_id)
@@ -0,0 +1,192 @@
+import base64
+import numpy as np
+import pandas as pd
+
+SHARED_PARTICIPANT = -1 # Participant id of shared components, same as the "Shared components" dropdown value
+MISSING_DATE = np.iinfo(np.int32).min # Epoch day of missing dates in the payload
+PAYLOAD_FORMAT = 1 # Version of the payload layout, bump when changing it together with decodePayload in dashboard_filters.js
+REQUIRED_COLUMNS = ["base_cost", "component_name", "exchange_rate", "category_name"]
+
+
+def encode(values) -> tuple[np.ndarray, np.ndarray]:
+    """Dictionary-encode a column of strings.
+
+    Returns:
+        codes: Position of each value in the dictionary | np.ndarray[int32]
+        dictionary: Distinct values of the column | np.ndarray[object]"""
+    codes, dictionary = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=False)
+    return codes.astype(np.int32), np.asarray(dictionary, dtype=object)
+
+
+def code_dtype(dictionary_size: int) -> str:
+    """Smallest signed integer type holding codes into a dictionary of the given size."""
+    return "i1" if dictionary_size <= 2**7 else "i2" if dictionary_size <= 2**15 else "i4"
+
+
+def pack_array(values: np.ndarray, dtype: str) -> dict:
+    """Pack a numeric array into base64 of its little-endian bytes, readable as a JS typed array."""
+    return {"dtype": dtype, "data": base64.b64encode(np.ascontiguousarray(values, dtype=f"<{dtype}").tobytes()).decode("ascii")}
+
+
+def unpack_array(packed: dict) -> np.ndarray:
+    """Inverse of pack_array."""
+    return np.frombuffer(base64.b64decode(packed["data"]), dtype=f"<{packed['dtype']}")
+
+
+def dates_to_days(dates: np.ndarray) -> np.ndarray:
+    """Days since the epoch of each date, MISSING_DATE for NaT. Time of day is dropped, the forms only set dates."""
+    days = dates.astype("datetime64[D]").astype(np.int64)
+    return np.where(np.isnat(dates), MISSING_DATE, days).astype(np.int32)
+
+
+def days_to_dates(days: np.ndarray) -> np.ndarray:
+    """Inverse of dates_to_days."""
+    dates = days.astype("datetime64[D]").astype("datetime64[ns]")
+    dates[days == MISSING_DATE] = np.datetime64("NaT")
+    return dates
+
+
+class TripDataset:
+    """Columnar copy of the trip data used by the dashboard. Costs and rates are float64 arrays, category, type and
+    currency names are dictionary-encoded and shared components get the SHARED_PARTICIPANT id, so filtering is a
+    single boolean mask over typed arrays.
+
+    Fields:
+    - size: number of components | int
+    - base_cost, exchange_rate: cost in the original currency and rate to the preferred currency | np.ndarray[float64]
+    - participant_id: participant of each component | np.ndarray[int64]
+    - category_codes, type_codes, currency_codes: codes into categories, types and currencies | np.ndarray[int32]
+    - categories, types, currencies: dictionaries of the encoded columns | np.ndarray[object]
+    - start_date, end_date: dates of each component | np.ndarray[datetime64[ns]]
+    - component_name, description, link: free text columns | np.ndarray[object]"""
+    TEXT_COLUMNS = ("component_name", "description", "link")
+    ENCODED_COLUMNS = { # Payload column: (codes attribute, dictionary attribute)
+        "category_name": ("category_codes", "categories"),
+        "type_name": ("type_codes", "types"),
+        "original_currency": ("currency_codes", "currencies"),
+    }
+
+    def __init__(self, base_cost, exchange_rate, participant_id, category_codes, categories, type_codes, types,
+                 currency_codes, currencies, start_date, end_date, component_name, description, link):
+        self.size = len(base_cost)
+        self.base_cost = base_cost
+        self.exchange_rate = exchange_rate
+        self.participant_id = participant_id
+        self.category_codes = category_codes
+        self.categories = categories
+        self.type_codes = type_codes
+        self.types = types
+        self.currency_codes = currency_codes
+        self.currencies = currencies
+        self.start_date = start_date
+        self.end_date = end_date
+        self.component_name = component_name
+        self.description = description
+        self.link = link
+
+    @classmethod
+    def from_dict(cls, trip_data: dict) -> 'TripDataset':
+        """Build the dataset from the dictionary of lists created by data_to_dict."""
+        if not all(col in trip_data for col in REQUIRED_COLUMNS):
+            raise ValueError(f"Missing one or more required columns: {REQUIRED_COLUMNS}")
+        size = len(trip_data["base_cost"])
+
+        def column(name, default=None):
+            return trip_data.get(name, [default] * size)
+
+        participant_id = pd.Series(column("participant_id"), dtype="float64").fillna(SHARED_PARTICIPANT)
+        category_codes, categories = encode(trip_data["category_name"])
+        type_codes, types = encode(column("type_name", "Unknown Subcategory"))
+        currency_codes, currencies = encode(column("original_currency", "PLN"))
+        return cls(
+            base_cost=np.asarray(trip_data["base_cost"], dtype=np.float64),
+            exchange_rate=np.asarray(trip_data["exchange_rate"], dtype=np.float64),
+            participant_id=participant_id.to_numpy(dtype=np.int64),
+            category_codes=category_codes, categories=categories,
+            type_codes=type_codes, types=types,
+            currency_codes=currency_codes, currencies=currencies,
+            start_date=pd.to_datetime(pd.Series(column("start_date"), dtype=object)).to_numpy(dtype="datetime64[ns]"),
+            end_date=pd.to_datetime(pd.Series(column("end_date"), dtype=object)).to_numpy(dtype="datetime64[ns]"),
+            **{name: np.asarray(column(name), dtype=object) for name in cls.TEXT_COLUMNS})
+
+    def to_payload(self) -> dict:
+        """Encode the dataset into a compact JSON-safe payload for the browser. Category, type, currency and participant
+        values are sent once per trip with the smallest integer codes per row, exchange rates once per currency, 
+        dates as int32 epoch days and costs as a float64 array, all packed as base64. Only the free text columns 
+        stay as lists. Decoded by from_payload and by decodePayload in dashboard_filters.js."""
+        participants, participant_codes = np.unique(self.participant_id, return_inverse=True)
+        codes = {name: getattr(self, codes) for name, (codes, _) in self.ENCODED_COLUMNS.items()}
+        codes["participant_id"] = participant_codes
+        dictionaries = {name: getattr(self, dictionary).tolist() for name, (_, dictionary) in self.ENCODED_COLUMNS.items()}
+        dictionaries["participant_id"] = participants.tolist()
+        # The rates are looked up by currency (cross_rates), so one rate per dictionary entry describes them all
+        currency_rates = np.zeros(len(self.currencies))
+        currency_rates[self.currency_codes] = self.exchange_rate
+        return {
+            "format": PAYLOAD_FORMAT,
+            "size": self.size,
+            "dictionaries": dictionaries,
+            "codes": {name: pack_array(values, code_dtype(len(dictionaries[name]))) for name, values in codes.items()},
+            "currency_rates": currency_rates.tolist(),
+            "arrays": {
+                "base_cost": pack_array(self.base_cost, "f8"),
+                "start_date": pack_array(dates_to_days(self.start_date), "i4"),
+                "end_date": pack_array(dates_to_days(self.end_date), "i4"),
+            },
+            "text": {name: getattr(self, name).tolist() for name in self.TEXT_COLUMNS},
+        }
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> 'TripDataset':
+        """Decode a payload created by to_payload. The dashboard decodes it in the browser (decodePayload in
+        dashboard_filters.js), this is the Python reference implementation of that decoder, used to test the format."""
+        if payload.get("format") != PAYLOAD_FORMAT:
+            raise ValueError(f"Unsupported trip data payload format: {payload.get('format')}")
+        codes = {name: unpack_array(packed).astype(np.int32) for name, packed in payload["codes"].items()}
+        arrays = {name: unpack_array(packed) for name, packed in payload["arrays"].items()}
+        columns = {codes_attr: codes[name] for name, (codes_attr, _) in cls.ENCODED_COLUMNS.items()}
+        columns.update({dictionary: np.asarray(payload["dictionaries"][name], dtype=object)
+                        for name, (_, dictionary) in cls.ENCODED_COLUMNS.items()})
+        participants = np.asarray(payload["dictionaries"]["participant_id"], dtype=np.int64)
+        return cls(
+            base_cost=arrays["base_cost"].astype(np.float64),
+            exchange_rate=np.asarray(payload["currency_rates"], dtype=np.float64)[columns["currency_codes"]],
+            participant_id=participants[codes["participant_id"]],
+            start_date=days_to_dates(arrays["start_date"]),
+            end_date=days_to_dates(arrays["end_date"]),
+            **columns,
+            **{name: np.asarray(payload["text"][name], dtype=object) for name in cls.TEXT_COLUMNS})
+
+    def mask(self, chosen_categories: list[str], chosen_participants: list[int], include_free: bool) -> np.ndarray:
+        """Boolean mask of the components passing all the filters. Empty category or participant choices don't filter."""
+        mask = np.ones(self.size, dtype=bool)
+        if chosen_participants:
+            mask &= np.isin(self.participant_id, np.asarray(chosen_participants, dtype=np.int64))
+        if not include_free:
+            mask &= self.base_cost > 0
+        if chosen_categories:
+            mask &= np.isin(self.category_codes, np.flatnonzero(np.isin(self.categories, chosen_categories)))
+        return mask
+
+    def to_frame(self, mask: np.ndarray = None) -> pd.DataFrame:
+        """Decode the selected rows (all rows if mask is None) into the DataFrame used to build the graphs."""
+        rows = slice(None) if mask is None else mask
+        return pd.DataFrame({
+            "component_name": self.component_name[rows],
+            "category_name": self.categories[self.category_codes[rows]],
+            "type_name": self.types[self.type_codes[rows]],
+            "base_cost": self.base_cost[rows],
+            "participant_id": self.participant_id[rows],
+            "link": self.link[rows],
+            "description": self.description[rows],
+            "start_date": self.start_date[rows],
+            "end_date": self.end_date[rows],
+            "original_currency": self.currencies[self.currency_codes[rows]],
+            "exchange_rate": self.exchange_rate[rows],
+        })
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f'<TripDataset {self.size} components, {len(self.categories)} categories>'
@@ -1,27 +1,45 @@
-from dash import Dash, html, dcc, Input, Output
+from dash import Dash, html, dcc, Input, Output, ClientsideFunction
 from dash.exceptions import PreventUpdate
 import webbrowser
 import plotly.express as px
 from flask import Flask
-from app.plotlydash.data import fetch_trip_data, fetch_participants
+from app.plotlydash.data import fetch_trip_key, get_trip_data, fetch_participants
+from app.plotlydash.cache import figure_cache
+from app.plotlydash.columnar import TripDataset
+from app.models import convert_many, rate_cache
+import json
 import numpy as np
 import pandas as pd
 
+CATEGORY_COLORS = {
+    'Accommodation': '#EA4848', 
+    'Food': '#4FB477', 
+    'Transport': '#85CCFF',
+    'Entertainment': '#A975A4',
+    'Shopping': '#FF9B42',
+    'Other': '#B8B8B8'
+}
+
 def init_dash_app(server):
     # Initialize Dash app with the parent Flask app 
     # With this setup Dash piggybacks off of the Flask server as a module, opposed to running as a standalone server
     server.logger.info("Initializing Dash app.")
+    clientside = server.config["DASH_CLIENTSIDE_FILTERING"]
     dash_app = Dash(
         server=server,
         routes_pathname_prefix='/dash/',
         external_stylesheets=[
             '/static/css/graphs.css',
-        ]
+        ],
+        external_scripts=[
+            '/static/js/dashboard_filters.js',
+        ] if clientside else []
     )
     
     dash_app.layout = html.Div(id='dash-container', children=[
         dcc.Location(id="url", refresh=False),
-        dcc.Store(id="data-store-trip"),  # Store to hold fetched data
+        dcc.Store(id="data-store-trip"),  # Store to hold the key of the trip data cached on the server
+        dcc.Store(id="data-store-columns"),  # Store to hold the encoded trip columns filtered in the browser in clientside mode
         dcc.Store(id="data-store-participants"),  # Store to hold fetched participants
         html.H1(id="trip-title", children=[]),
         html.Div(id='budget-graphs-box', children=[
@@ -65,34 +83,21 @@ def init_dash_app(server):
     ])
     
     init_callbacks(dash_app)
+    if clientside:
+        init_clientside_callbacks(dash_app)
+    else:
+        init_server_callbacks(dash_app)
 
     return dash_app.server
     
     
-def filter_df(trip_data: dict, chosen_categories: list[str], chosen_participants: list[str], include_free: bool) -> pd.DataFrame:
-    """Filters the data provided based on the settings chosen by user and returns a panda dataframe"""
-    df = pd.DataFrame(trip_data)
-    required_columns = ["base_cost", "component_name", "exchange_rate", "category_name"]
-    if not all(col in df.columns for col in required_columns):
-        raise ValueError(f"Missing one or more required columns: {required_columns}")
-    
-    # Filter by chosen participants
-    temp_df = pd.DataFrame()
-    if chosen_participants:
-        if -1 in chosen_participants:
-            temp_df = df[df["participant_id"].isna()]
-        df = df[df["participant_id"].isin(chosen_participants)]
-    df = pd.concat([df, temp_df])
-    # Filter rows where base_cost > 0
-    if not include_free:
-        df = df[df["base_cost"] > 0]
-        
-    # Filter by chosen_categories
-    if chosen_categories:
-        df = df[df["category_name"].isin(chosen_categories)] 
-    
-    return df
-    
+def filter_df(trip_data: dict | TripDataset, chosen_categories: list[str], chosen_participants: list[int], include_free: bool) -> pd.DataFrame:
+    """Filters the data provided based on the settings chosen by user and returns a panda dataframe.
+    All the filters are combined into a single boolean mask over the columns of a TripDataset, 
+    a dictionary of lists is converted to one first."""
+    dataset = trip_data if isinstance(trip_data, TripDataset) else TripDataset.from_dict(trip_data)
+    return dataset.to_frame(dataset.mask(chosen_categories, chosen_participants, include_free))
+
 
 def init_callbacks(dash_app):    
     @dash_app.callback(
@@ -105,20 +110,18 @@ def init_callbacks(dash_app):
         except (ValueError, IndexError):
             return None
         
-        data = fetch_trip_data(trip_id)
-        return data
+        return fetch_trip_key(trip_id)
     
     @dash_app.callback(
     Output("data-store-participants", "data"),
-    Input("url", "pathname")
+    Input("data-store-trip", "data")
     )
-    def load_participants(pathname):
-        try:
-            trip_id = int(pathname.split("/")[-1])  # Attempt to extract trip ID
-        except (ValueError, IndexError):
+    def load_participants(key):
+        # Follows the data key, so participants are reloaded with the data when the trip page pushes a new key
+        if not key:
             return None
         
-        participants = fetch_participants(trip_id)
+        participants = fetch_participants(key["trip_id"])
         return participants
     
     @dash_app.callback(
@@ -133,152 +136,173 @@ def init_callbacks(dash_app):
         dropdown_options.append({"label": "Shared components", "value": -1})
         return dropdown_options, [option["value"] for option in dropdown_options] # Default all participants selected
  
-        
+ 
+def init_server_callbacks(dash_app):
     @dash_app.callback(
         Output("trip-title", "children"),
+        Output("budget-bar-graph", "figure"),
+        Output("budget-pie-graph", "figure"),
         Input("data-store-trip", "data"),
         Input("dropdown-categories", "value"),
         Input("dropdown-participants", "value"),
         Input("radio-include-free", "value")
     )
-    def get_title(data, chosen_categories, chosen_participants, include_free):
+    def update_dashboard(key, chosen_categories, chosen_participants, include_free):
+        # Single callback for all the outputs, so the data is filtered once per input change
+        cache_key = figure_cache_key(key, chosen_categories, chosen_participants, include_free)
+        cached = figure_cache.get(cache_key) if cache_key else None
+        if cached:
+            title, bar_json, pie_json = cached
+            return title, json.loads(bar_json), json.loads(pie_json)
+        
+        data = get_trip_data(key)
         if not data:
-            return "No data loaded yet."
+            # Placeholder figures if no data is loaded yet
+            return "No data loaded yet.", placeholder_graph("Waiting for data..."), placeholder_graph("Waiting for data...")
+        
         df = filter_df(data[0], chosen_categories, chosen_participants, include_free)
-        trip_cost = np.sum(df["base_cost"] * df["exchange_rate"])
         preferred_currency = data[1]
         trip_name = data[2]
-        length_str = f"({len(df)} components)" if len(df) != 1 else " (1 component)"
-        return f"Trip: {trip_name} - total cost: {trip_cost:.2f} {preferred_currency} - {length_str}"
-    
+        df["adjusted_cost"] = convert_many(df["base_cost"], df["original_currency"], preferred_currency)
+        
+        title = get_title(df, trip_name, preferred_currency)
+        if df.empty:
+            bar_graph, pie_graph = placeholder_graph("No valid data to display."), placeholder_graph("No valid data to display.")
+        else:
+            bar_graph, pie_graph = get_bar_graph(df, preferred_currency), get_pie_graph(df, preferred_currency)
+        figure_cache.set(cache_key, (title, bar_graph.to_json(), pie_graph.to_json()))
+        return title, bar_graph, pie_graph
+
+
+def figure_cache_key(key: dict, chosen_categories: list[str], chosen_participants: list[int], include_free: bool):
+    """Key of the dashboard outputs in figure_cache: trip id, data version, normalized filters, currency and rates version.
+    Returns None if no trip data is loaded."""
+    if not key:
+        return None
+    filters = (tuple(sorted(chosen_categories or ())), tuple(sorted(chosen_participants or ())), bool(include_free))
+    return (key["trip_id"], key["version"], filters, key["currency"], rate_cache.snapshot().version)
+
+
+def init_clientside_callbacks(dash_app):
+    # The server only sends the trip columns when the trip data changes, filtering runs in the browser 
+    # (dashboard_filters.js), so filter changes don't take up a worker
     @dash_app.callback(
-        Output("budget-bar-graph", "figure"),
+        Output("data-store-columns", "data"),
         Input("data-store-trip", "data"),
-        Input("dropdown-categories", "value"),
-        Input("dropdown-participants", "value"),
-        Input("radio-include-free", "value")
     )
-    def add_bar_graph(data, chosen_categories, chosen_participants, include_free):
+    def load_columns(key):
+        data = get_trip_data(key)
         if not data:
-            # Placeholder figure if no data is loaded yet
-            return px.line(title="Waiting for data...", height=365, width=365)    
-            
-        df = filter_df(data[0], chosen_categories, chosen_participants, include_free)
-        preferred_currency = data[1]
-
-        if df.empty:
-            return px.line(title="No valid data to display.", height=365, width=365)
-
-        df["adjusted_cost"] = df["base_cost"] * df["exchange_rate"]
+            return None
+        dataset, preferred_currency, trip_name = data
+        return {"payload": dataset.to_payload(), "currency": preferred_currency, "trip_name": trip_name, "colors": CATEGORY_COLORS}
 
-        fig = px.bar(
-            data_frame=df,
-            x="component_name",
-            y="adjusted_cost",
-            title= f"Cost breakdown by component",
-            labels={"component_name": "Component", "adjusted_cost": "Cost"},
-            color="category_name",  
-            color_discrete_map={
-                'Accommodation': '#EA4848', 
-                'Food': '#4FB477', 
-                'Transport': '#85CCFF',
-                'Entertainment': '#A975A4',
-                'Shopping': '#FF9B42',
-                'Other': '#B8B8B8'
-            },
-            hover_data={"start_date": True, "end_date": True, "link": True, "category_name": False},
-            hover_name="description",
-            custom_data=["start_date", "end_date", "link"],
-            width=365,
-            height=365
-        )
-        fig.update_layout(
-            hoverlabel=dict(
-                bgcolor="white",
-                font_size=12,
-                font_family="Fira Sans",
-            ),
-            paper_bgcolor="#f3ebdf",
-            plot_bgcolor="#f3ebdf",
-            barmode="relative",
-            xaxis_title="Component",
-            yaxis_title=f"Cost ({preferred_currency})",
-            showlegend=True,
-            legend_title="Category",       
-            margin=dict(l=30, r=0, t=40, b=30),
-            font_family="Fira Sans",     
-        )
-        fig.update_xaxes(
-            tickangle=45,
-            tickfont=dict(size=10),
-            categoryorder="total ascending",
-        )
-        fig.update_traces(
-            hovertemplate="<b>%{x}</b><br><br>" +
-                            "Cost: %{y:.2f}" + f"{preferred_currency}<br>" +
-                            "Description: %{hovertext}<br>" +
-                            "Start date: %{customdata[0]}<br>" +
-                            "End date: %{customdata[1]}<br>" +
-                            "Link: %{customdata[2]}<extra></extra>",
-            marker=dict(line=dict(width=1, color="Black")),
-                            
-        )
-        return fig
-    
-    @dash_app.callback(
+    dash_app.clientside_callback(
+        ClientsideFunction(namespace="dashboard", function_name="updateDashboard"),
+        Output("trip-title", "children"),
+        Output("budget-bar-graph", "figure"),
         Output("budget-pie-graph", "figure"),
-        Input("data-store-trip", "data"),
+        Input("data-store-columns", "data"),
         Input("dropdown-categories", "value"),
         Input("dropdown-participants", "value"),
         Input("radio-include-free", "value")
     )
-    def add_pie_graph(data, chosen_categories, chosen_participants, include_free):
-        if not data:
-            # Placeholder figure if no data is loaded yet
-            return px.line(title="Waiting for data...", height=365, width=365)    
-        df = filter_df(data[0], chosen_categories, chosen_participants, include_free)
-        preferred_currency = data[1]
 
-        if df.empty:
-            return px.line(title="No valid data to display.", height=365, width=365)
-        
-        fig = px.pie(
-            data_frame=df,
-            values="base_cost",
-            names="category_name",
-            title="Cost breakdown by category",
-            color="category_name",  
-            color_discrete_map={
-                'Accommodation': '#EA4848', 
-                'Food': '#4FB477', 
-                'Transport': '#85CCFF',
-                'Entertainment': '#A975A4',
-                'Shopping': '#FF9B42',
-                'Other': '#B8B8B8'
-            },
-            width=365,
-            height=365,
-            custom_data=["category_name", "type_name"],
-        )
-        fig.update_layout(
-            hoverlabel=dict(
-                bgcolor="white",
-                font_size=12,
-                font_family="Fira Sans",
-            ),
-            margin=dict(l=0, r=30, t=40, b=30),
-            paper_bgcolor="#f3ebdf",
-            plot_bgcolor="#f3ebdf",
-            legend_title="Component name",
-            font_family="Fira Sans",     
-        )
-        fig.update_traces(
-            textposition="inside",
-            textinfo='percent+label',
-            hovertemplate="<b>%{names}</b><br><br>" +
-                "Cost: %{value:.2f}" + f"{preferred_currency}<br>" +
-                "Category: %{customdata[0]}<br>" +
-                "Subcategory: %{customdata[1]}<extra></extra>",
-            marker=dict(line=dict(width=1, color="Black")),
-        )
-        return fig
+
+def placeholder_graph(title: str):
+    """Empty figure shown instead of the graphs."""
+    return px.line(title=title, height=365, width=365)
+
+
+def get_title(df: pd.DataFrame, trip_name: str, preferred_currency: str) -> str:
+    """Title with the total cost of the filtered components."""
+    trip_cost = df["adjusted_cost"].sum()
+    length_str = f"({len(df)} components)" if len(df) != 1 else " (1 component)"
+    return f"Trip: {trip_name} - total cost: {trip_cost:.2f} {preferred_currency} - {length_str}"
+
+
+def get_bar_graph(df: pd.DataFrame, preferred_currency: str):
+    """Bar graph of the converted cost of every filtered component."""
+    fig = px.bar(
+        data_frame=df,
+        x="component_name",
+        y="adjusted_cost",
+        title= f"Cost breakdown by component",
+        labels={"component_name": "Component", "adjusted_cost": "Cost"},
+        color="category_name",  
+        color_discrete_map=CATEGORY_COLORS,
+        hover_data={"start_date": True, "end_date": True, "link": True, "category_name": False},
+        hover_name="description",
+        custom_data=["start_date", "end_date", "link"],
+        width=365,
+        height=365
+    )
+    fig.update_layout(
+        hoverlabel=dict(
+            bgcolor="white",
+            font_size=12,
+            font_family="Fira Sans",
+        ),
+        paper_bgcolor="#f3ebdf",
+        plot_bgcolor="#f3ebdf",
+        barmode="relative",
+        xaxis_title="Component",
+        yaxis_title=f"Cost ({preferred_currency})",
+        showlegend=True,
+        legend_title="Category",       
+        margin=dict(l=30, r=0, t=40, b=30),
+        font_family="Fira Sans",     
+    )
+    fig.update_xaxes(
+        tickangle=45,
+        tickfont=dict(size=10),
+        categoryorder="total ascending",
+    )
+    fig.update_traces(
+        hovertemplate="<b>%{x}</b><br><br>" +
+                        "Cost: %{y:.2f}" + f"{preferred_currency}<br>" +
+                        "Description: %{hovertext}<br>" +
+                        "Start date: %{customdata[0]}<br>" +
+                        "End date: %{customdata[1]}<br>" +
+                        "Link: %{customdata[2]}<extra></extra>",
+        marker=dict(line=dict(width=1, color="Black")),
+                        
+    )
+    return fig
+
+
+def get_pie_graph(df: pd.DataFrame, preferred_currency: str):
+    """Pie graph of the converted cost of the filtered components by category."""
+    fig = px.pie(
+        data_frame=df,
+        values="adjusted_cost",
+        names="category_name",
+        title="Cost breakdown by category",
+        color="category_name",  
+        color_discrete_map=CATEGORY_COLORS,
+        width=365,
+        height=365,
+        custom_data=["category_name", "type_name"],
+    )
+    fig.update_layout(
+        hoverlabel=dict(
+            bgcolor="white",
+            font_size=12,
+            font_family="Fira Sans",
+        ),
+        margin=dict(l=0, r=30, t=40, b=30),
+        paper_bgcolor="#f3ebdf",
+        plot_bgcolor="#f3ebdf",
+        legend_title="Component name",
+        font_family="Fira Sans",     
+    )
+    fig.update_traces(
+        textposition="inside",
+        textinfo='percent+label',
+        hovertemplate="<b>%{names}</b><br><br>" +
+            "Cost: %{value:.2f}" + f"{preferred_currency}<br>" +
+            "Category: %{customdata[0]}<br>" +
+            "Subcategory: %{customdata[1]}<extra></extra>",
+        marker=dict(line=dict(width=1, color="Black")),
+    )
+    return fig
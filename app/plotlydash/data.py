@@ -1,6 +1,8 @@
 import pandas as pd
 from app import app, db
-from app.models import Component, Trip, get_exchange_rate
+from app.models import Component, Trip, cross_rates
+from app.plotlydash.cache import trip_data_cache
+from app.plotlydash.columnar import TripDataset
 from config import Config
 import sqlalchemy as sa
 
@@ -9,18 +11,49 @@ type_names = {i + 1: type_name for i, type_name in enumerate({type_ for types in
 
 def fetch_participants(trip_id: int):
     """Fetch participants list from the database, change it into a list of names, and return it."""
-    app.logger.info(f"Fetching participants for trip id: {trip_id}.")
+    app.logger.info("Fetching participants for trip id: %s.", trip_id)
     if not trip_id or not isinstance(trip_id, int):
         return None
     trip = db.first_or_404(sa.select(Trip).where(Trip.id == trip_id))
     participants = db.session.scalars(trip.participants.select()).all()
     participants = [(p.participant_name, p.id) for p in participants]
-    app.logger.debug(f"Participants for trip id {trip_id}: {participants}.")
+    app.logger.debug("Participants for trip id %s: %s.", trip_id, participants)
     return participants
 
+def fetch_trip_key(trip_id: int):
+    """Fetch the key identifying the current version of the trip data, the only thing kept in the browser store."""
+    app.logger.info("Fetching data key for trip id: %s.", trip_id)
+    if not trip_id or not isinstance(trip_id, int):
+        return None
+    trip = db.first_or_404(sa.select(Trip).where(Trip.id == trip_id))
+    preferred_currency = trip.user.preferred_currency if trip.user else "PLN"
+    return {"trip_id": trip.id, "version": trip.data_version, "currency": preferred_currency}
+
+
+def get_trip_data(key: dict):
+    """Return the trip data for a store key from the server-side cache, fetching it from the database on a miss.
+    The cached data holds a TripDataset instead of the dictionary of lists, so it's converted once per trip version.
+    The key comes from the browser, so on a miss it's compared with the trip's current key first: data is only
+    fetched and cached for the current version and currency, a stale or forged key gets None."""
+    if not key:
+        return None
+    cache_key = (key["trip_id"], key["version"], key["currency"])
+    data = trip_data_cache.get(cache_key)
+    if data is None:
+        current_key = fetch_trip_key(key["trip_id"])
+        if current_key is None or cache_key != (current_key["trip_id"], current_key["version"], current_key["currency"]):
+            app.logger.warning("Refused trip data for key %s, the current key is %s.", key, current_key)
+            return None
+        data = fetch_trip_data(key["trip_id"])
+        if data:
+            data = (TripDataset.from_dict(data[0]), data[1], data[2])
+        trip_data_cache.set(cache_key, data)
+    return data
+
+
 def fetch_trip_data(trip_id: int):
     """Fetch components list and trip name from the database, run it to create_dataframe and return it."""
-    app.logger.info(f"Fetching data for trip id: {trip_id}.")
+    app.logger.info("Fetching data for trip id: %s.", trip_id)
     if not trip_id or not isinstance(trip_id, int):
         return None
     trip = db.first_or_404(sa.select(Trip).where(Trip.id == trip_id))
@@ -40,7 +73,7 @@ def data_to_dict(components: list[Component], trip_name: str, preferred_currency
     """
     if not components:
         return dict()
-    app.logger.info(f"Creating dictionary from components list for trip id: {components[0].trip_id}.")
+    app.logger.info("Creating dictionary from components list for trip id: %s.", components[0].trip_id)
     
     data = { # Dictionary with default values for missing data
         "component_name": [getattr(c, 'component_name', None) for c in components],
@@ -53,7 +86,7 @@ def data_to_dict(components: list[Component], trip_name: str, preferred_currency
         "start_date": [getattr(c, 'start_date', pd.NaT) for c in components], 
         "end_date": [getattr(c, 'end_date', pd.NaT) for c in components],      
         "original_currency": [getattr(c, 'currency', "PLN") for c in components],
-        "exchange_rate": [get_exchange_rate(c.currency, preferred_currency) for c in components],
     }
+    data["exchange_rate"] = cross_rates(data["original_currency"], preferred_currency).tolist()
     
     return (data, preferred_currency, trip_name)
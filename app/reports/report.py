@@ -0,0 +1,54 @@
+import sqlalchemy as sa
+from datetime import datetime, timezone
+from flask import render_template
+from app import app, db
+from app.models import Trip, Participant, convert_many, reference_catalog
+from app.plotlydash.data import fetch_trip_key, get_trip_data
+from app.plotlydash.dashboard import get_bar_graph, get_pie_graph
+
+REPORT_FORMATS = { # Report format: (mimetype, file extension)
+    "html": ("text/html", "html"),
+}
+TOP_COMPONENTS = 50 # Most expensive components shown in the bar graph of a report
+
+
+def figure_html(fig, include_plotlyjs: bool) -> str:
+    """Render a dashboard figure as a div at report size. plotly.js is embedded with the first figure only,
+    so the report works offline without loading it more than once."""
+    fig.update_layout(width=800, height=500)
+    return fig.to_html(full_html=False, include_plotlyjs=include_plotlyjs)
+
+
+def build_report(trip: Trip, fmt: str) -> str:
+    """Build the formatted report of a trip: cost totals with subtotals by category and participant, and the
+    dashboard graphs of its active components, in the user's preferred currency. Slow for large trips, run
+    by the report workers and not inside requests.
+
+    Args:
+        trip (Trip): Trip to report on
+        fmt (str): Format of the report, one of REPORT_FORMATS
+
+    Returns:
+        str: Content of the report"""
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Unsupported report format: {fmt}, use one of {', '.join(REPORT_FORMATS)}.")
+    app.logger.info("Building %s report of trip id: %s.", fmt, trip.id)
+    currency = trip.user.preferred_currency or "PLN"
+    summary = trip.get_cost_summary(currency, stored=True)
+    categories = reference_catalog.snapshot().categories
+    participants = dict(db.session.execute(
+        sa.select(Participant.id, Participant.participant_name).where(Participant.trip_id == trip.id)).all())
+
+    graphs = []
+    data = get_trip_data(fetch_trip_key(trip.id))
+    if data and len(data[0]):
+        df = data[0].to_frame()
+        df["adjusted_cost"] = convert_many(df["base_cost"], df["original_currency"], currency)
+        by_type = df.groupby(["category_name", "type_name"], as_index=False)["adjusted_cost"].sum() # The pie sums them anyway
+        graphs = [figure_html(get_pie_graph(by_type, currency), include_plotlyjs=True),
+                  figure_html(get_bar_graph(df.nlargest(TOP_COMPONENTS, "adjusted_cost"), currency), include_plotlyjs=False)]
+    return render_template("report.html", trip=trip, summary=summary, graphs=graphs,
+                           by_category={categories.get(id, "Unknown"): cost for id, cost in summary["by_category"].items()},
+                           by_participant={participants.get(id, "Shared") if id else "Shared": cost
+                                           for id, cost in summary["by_participant"].items()},
+                           top_components=TOP_COMPONENTS, generated_at=datetime.now(timezone.utc))
@@ -0,0 +1,99 @@
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from app import app, db
+from app.models import ReportJob, Trip
+from app.reports.report import REPORT_FORMATS, build_report
+
+
+def artifact_path(job: ReportJob) -> str:
+    """Path of the built report of a done job."""
+    return os.path.join(app.config["REPORTS_DIR"], job.artifact)
+
+
+def init_process():
+    """Initializer of the pool processes. Forked processes inherit the parent's database connections, so they're
+    dropped (without closing them under the parent) and every process opens its own."""
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def run_job(job_id: int) -> str | None:
+    """Build the report of a claimed job and write it to REPORTS_DIR, then mark the job done, or failed with
+    the error. Runs in a pool process, with its own app context and session. A slow job can be requeued by
+    requeue_stale and claimed by another worker, so the result is only recorded while the job is still running
+    under the worker which claimed it for this run.
+
+    Returns:
+        str: Final status of the job, None if the job was deleted or is no longer owned by this run"""
+    with app.app_context():
+        job = db.session.get(ReportJob, job_id)
+        if job is None:
+            app.logger.warning("Report job id: %s no longer exists.", job_id)
+            return None
+        worker, trip_id = job.worker, job.trip_id
+        artifact, error = None, None
+        try:
+            trip = db.session.get(Trip, trip_id)
+            if trip is None:
+                raise ValueError(f"Trip {trip_id} not found.")
+            content = build_report(trip, job.report_format)
+            artifact = f"report_{job.id}.{REPORT_FORMATS[job.report_format][1]}"
+            os.makedirs(app.config["REPORTS_DIR"], exist_ok=True)
+            path = os.path.join(app.config["REPORTS_DIR"], artifact)
+            tmp_path = f"{path}.{os.getpid()}.tmp" # A duplicate run of a requeued job writes its own file
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                file.write(content)
+            os.replace(tmp_path, path) # Never expose a partially written report
+            status = "done"
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error("Error building report job id: %s: %s", job_id, e)
+            artifact, status, error = None, "failed", str(e)
+        if not ReportJob.finish(job_id, worker, status, artifact, error):
+            app.logger.warning("Report job id: %s was requeued, not recording the %s result of worker %s.", job_id, status, worker)
+            return None
+        app.logger.info("Report job id: %s of trip id: %s %s.", job_id, trip_id, status)
+        return status
+
+
+def run_worker(processes: int, poll_interval: float, once: bool = False) -> int:
+    """Run report jobs from the queue in a pool of processes. This process claims jobs, never more than there are
+    free pool processes, so the others stay queued for other workers. Jobs running for longer than
+    REPORT_JOB_TIMEOUT are requeued while the queue is empty. Runs until interrupted.
+
+    Args:
+        processes (int): Number of pool processes, reports built at the same time
+        poll_interval (float): Seconds between queue polls while idle
+        once (bool): Exit once the queue is empty and all claimed jobs are finished
+
+    Returns:
+        int: Number of finished jobs"""
+    worker = f"{socket.gethostname()}:{os.getpid()}"[:64]
+    running = {} # Future of each claimed job to its id
+    finished = 0
+    app.logger.info("Report worker %s started with %s processes.", worker, processes)
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_process) as pool:
+        while True:
+            while len(running) < processes:
+                job = ReportJob.claim_next(worker)
+                if job is None:
+                    break
+                app.logger.info("Report worker %s claimed job id: %s.", worker, job.id)
+                running[pool.submit(run_job, job.id)] = job.id
+            if not running:
+                if once:
+                    break
+                if ReportJob.requeue_stale(app.config["REPORT_JOB_TIMEOUT"]):
+                    continue
+                time.sleep(poll_interval)
+                continue
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id = running.pop(future)
+                finished += 1
+                if future.exception() is not None: # The process died before the job could record its failure
+                    app.logger.error("Report job id: %s crashed: %r", job_id, future.exception())
+                    ReportJob.finish(job_id, worker, "failed", None, repr(future.exception()))
+    return finished
@@ -1,23 +1,33 @@
-from flask import render_template, flash, redirect, url_for, request, session
+from flask import render_template, flash, redirect, url_for, request, session, abort, Response, stream_with_context, send_file
 import sqlalchemy as sa
+import base64
+import binascii
+import csv
+import hmac
+import json
+from datetime import datetime
 from flask_login import current_user, login_user, logout_user, login_required
-from app import app, db
+from werkzeug.utils import secure_filename
+from app import app, db, metrics_registry
 from app.forms import LoginForm, RegistrationForm, EditProfileForm, TripForm, ComponentForm, EmptyForm, ParticipantForm
-from app.models import User, Trip, Component, ComponentCategory, ComponentType, ExchangeRates, Participant
+from app.models import User, Trip, Component, Participant, TripCostSummary, ReportJob, reference_catalog
+from app.plotlydash.cache import evict_trip
+from app.plotlydash.data import fetch_trip_key
+from app.bulk_import.components import detect_format, import_components
+from app.bulk_export.components import FORMATS as EXPORT_FORMATS, export_components
+from app.reports.report import REPORT_FORMATS
+from app.reports.worker import artifact_path
 
 
-# Helper functions for dynamically populating form choices
+# Helper functions for dynamically populating form choices, static ones are read from the in-memory reference catalog
 def get_category_choices():
-    return [(c.id, c.category_name) for c in db.session.scalars(sa.select(ComponentCategory).order_by(ComponentCategory.id)).all()]
+    return reference_catalog.snapshot().category_choices()
 
 def get_type_choices(category_id=None):
-    query = sa.select(ComponentType)
-    if category_id:
-        query = query.where(ComponentType.category_id == category_id).order_by(ComponentType.id)
-    return [(t.id, t.type_name) for t in db.session.scalars(query).all()]
+    return reference_catalog.snapshot().type_choices(category_id)
 
 def get_currency_choices():
-    return [(e.currency_to, e.currency_to) for e in db.session.scalars(sa.select(ExchangeRates)).all()]
+    return reference_catalog.snapshot().currency_choices()
 
 def get_participant_choices(trip_id):
     trip = db.first_or_404(sa.select(Trip).where(Trip.id == trip_id))
@@ -28,6 +38,80 @@ def get_participant_choices(trip_id):
 def is_current_user(user_id):
     return current_user.id == user_id
 
+# Helper cache invalidation
+def trip_data_changed(trip_id):
+    """Bump the trip's data version and drop its cached dashboard data in this worker. Doesn't commit."""
+    Trip.bump_data_version(trip_id)
+    evict_trip(int(trip_id))
+
+def get_trip_delta(trip_id: int, component: Component | None = None, deleted_component_id: int | None = None,
+                   deleted_participant_id: int | None = None) -> dict:
+    """Changes of a committed trip mutation, applied in place by applyTripDelta in delete_scripts.js instead of 
+    reloading the trip page and the dashboard.
+    
+    Returns:
+        dict: Delta with keys:
+        - component_id, component_html: id and re-rendered _component.html of the created or changed component
+        - deleted_component_id, deleted_participant_id: ids of the removed rows
+        - total_html: re-rendered _trip_total.html
+        - data_key: new dashboard store key of the trip data, pushed into the dashboard to refresh it"""
+    trip = db.session.get(Trip, int(trip_id))
+    summary = trip.get_cost_summary(current_user.preferred_currency, stored=True)
+    return {
+        "component_id": component.id if component else None,
+        "component_html": render_template('_component.html', component=component) if component else None,
+        "deleted_component_id": deleted_component_id,
+        "deleted_participant_id": deleted_participant_id,
+        "total_html": render_template('_trip_total.html', summary=summary),
+        "data_key": fetch_trip_key(trip.id),
+    }
+
+# Helper pagination
+def encode_cursor(*values) -> str:
+    """Opaque keyset cursor from the sort key of the last row of a page."""
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def decode_cursor(cursor: str) -> list | None:
+    """Sort key of a cursor created by encode_cursor, None for the first page. Aborts with 400 on a malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        abort(400)
+
+def split_page(rows: list, limit: int, sort_key) -> tuple[list, str | None]:
+    """Split limit + 1 fetched rows into the page and the cursor of the next page (None on the last page)."""
+    page = rows[:limit]
+    return page, encode_cursor(*sort_key(page[-1])) if len(rows) > limit else None
+
+def get_trips_page(user: User, cursor: str | None) -> dict:
+    """Template context of a page of the user's trips."""
+    after = decode_cursor(cursor)
+    if after:
+        try:
+            after = (datetime.fromisoformat(after[0]), int(after[1]))
+        except (ValueError, TypeError, IndexError):
+            abort(400)
+    limit = app.config["TRIPS_PER_PAGE"]
+    trips, next_cursor = split_page(user.get_trips_page(after, limit + 1), limit, lambda t: (t.created_at, t.id))
+    return {"trips": trips,
+            "next_url": url_for('user_trips', username=user.username, after=next_cursor) if next_cursor else None,
+            "trip_totals": user.get_trip_totals(current_user.preferred_currency, trip_ids=[t.id for t in trips]),
+            "preferred_currency": current_user.preferred_currency}
+
+def get_components_page(trip: Trip, cursor: str | None) -> dict:
+    """Template context of a page of the trip's components."""
+    after = decode_cursor(cursor)
+    try:
+        after_id = int(after[0]) if after else None
+    except (ValueError, TypeError, IndexError):
+        abort(400)
+    limit = app.config["COMPONENTS_PER_PAGE"]
+    components, next_cursor = split_page(trip.get_components_with_details(after_id, limit + 1), limit, lambda c: (c.id,))
+    return {"components": components,
+            "next_url": url_for('trip_components', trip_id=trip.id, after=next_cursor) if next_cursor else None}
+
 # Routes
 @app.route('/', methods=['GET', 'POST'])
 def welcome():
@@ -48,11 +132,11 @@ def login():
         user = db.session.scalar(
             sa.select(User).where(User.username == form.username.data))
         if user is None or not user.check_password(form.password.data):
-            app.logger.warning(f"Failed login attempt for user {form.username.data}")
+            app.logger.warning("Failed login attempt for user %s", form.username.data)
             flash("Invalid username or password")
             return redirect(url_for("login"))
         login_user(user, remember=form.remember_me.data)
-        app.logger.info(f"User {user.username}, id: {user.id} logged in successfully.")
+        app.logger.info("User %s, id: %s logged in successfully.", user.username, user.id)
         return redirect(url_for('user', username=user.username))
     return render_template('login.html', title="Login", form=form)
 
@@ -60,7 +144,7 @@ def login():
 @app.route('/logout')
 def logout():
     """Logout route, used only for processing and a redirect."""
-    app.logger.info(f"User {current_user.username}, id {current_user.id} logged out.")
+    app.logger.info("User %s, id %s logged out.", current_user.username, current_user.id)
     logout_user()
     return redirect(url_for("welcome"))
 
@@ -76,7 +160,7 @@ def register():
         user.set_password(form.password.data)
         db.session.add(user)
         db.session.commit()
-        app.logger.info(f"New user registered: {form.username.data}, id: {user.id}")
+        app.logger.info("New user registered: %s, id: %s", form.username.data, user.id)
         flash('Congratulations, you are now a registered user!')
         return redirect(url_for('login'))
     return render_template('register.html', title='Register', form=form)
@@ -87,17 +171,24 @@ def register():
 def user(username: str):
     """User profile page view where the user can add and see their trips."""
     user = db.first_or_404(sa.select(User).where(User.username == username))
-    trips = db.session.scalars(user.trips.select())
-    app.logger.info(f"User {current_user.username}, id: {current_user.id} viewed user's {username} profile.")
+    app.logger.info("User %s, id: %s viewed user's %s profile.", current_user.username, current_user.id, username)
     form = TripForm(user_id=current_user.id)
     if form.validate_on_submit():
         trip = Trip(user_id=current_user.id, trip_name=form.trip_name.data)
         db.session.add(trip)
         db.session.commit()
-        app.logger.info(f"User {current_user.username}, id: {current_user.id} added a new trip: {form.trip_name.data}, id: {trip.id}.")
+        app.logger.info("User %s, id: %s added a new trip: %s, id: %s.", current_user.username, current_user.id, form.trip_name.data, trip.id)
         flash('Your trip has been added!')
         return redirect(url_for('user', username=username)) # Reload
-    return render_template('user.html', user=user, trips=trips, form=form)
+    return render_template('user.html', user=user, form=form, **get_trips_page(user, None))
+
+
+@app.route('/user/<username>/trips')
+@login_required
+def user_trips(username: str):
+    """AJAX route returning the next page of the user's trips after the cursor, for the "load more" button."""
+    user = db.first_or_404(sa.select(User).where(User.username == username))
+    return render_template('_trips_page.html', **get_trips_page(user, request.args.get('after')))
 
 
 @app.route('/edit_profile', methods=['GET', 'POST'])
@@ -111,7 +202,7 @@ def edit_profile():
         current_user.preferred_currency = form.currency.data
         current_user.about_me = form.about_me.data
         db.session.commit()
-        app.logger.info(f"User {current_user.username}, id: {current_user.id} updated their profile.")
+        app.logger.info("User %s, id: %s updated their profile.", current_user.username, current_user.id)
         flash("Your changes have been saved.")
         return redirect(session['url_on_return'])
     elif request.method == 'GET':
@@ -130,10 +221,8 @@ def trip(trip_id: int):
     trip = db.first_or_404(sa.select(Trip).where(Trip.id == trip_id))
     if not is_current_user(trip.user_id):
         flash("You do not have permission to view this trip.")
-        app.logger.warning(f"User {current_user.username}, id: {current_user.id} tried to access unauthorized trip {trip_id}.")
+        app.logger.warning("User %s, id: %s tried to access unauthorized trip %s.", current_user.username, current_user.id, trip_id)
         return redirect(url_for('user', username=current_user.username))
-    components = db.session.scalars(trip.components.select())
-    participants = db.session.scalars(trip.participants.select())
     form = ParticipantForm()
     if form.validate_on_submit():
         participant = Participant(
@@ -142,12 +231,26 @@ def trip(trip_id: int):
         )
         db.session.add(participant)
         db.session.commit()
-        app.logger.info(f"User {current_user.username}, id: {current_user.id} added a new participant: {form.participant_name.data}, id: {participant.id} to trip id: {trip.id}.")
+        app.logger.info("User %s, id: %s added a new participant: %s, id: %s to trip id: %s.", current_user.username, current_user.id, form.participant_name.data, participant.id, trip.id)
         flash('Your participant has been added!')
         return redirect(url_for('trip', trip_id=trip_id))
-    return render_template('trip.html', title=f"{trip.trip_name}", trip=trip, form=form,
-                           components=components, participants=participants,
-                           preferred_currency=current_user.preferred_currency)
+    # Everything the page shows is loaded here in a fixed number of queries, none are run while rendering
+    participants = db.session.scalars(trip.participants.select()).all()
+    return render_template('trip.html', title=f"{trip.trip_name}", trip=trip, form=form, participants=participants,
+                           summary=trip.get_cost_summary(current_user.preferred_currency, stored=True),
+                           preferred_currency=current_user.preferred_currency,
+                           **get_components_page(trip, None))
+
+
+@app.route('/trip/<trip_id>/components')
+@login_required
+def trip_components(trip_id: int):
+    """AJAX route returning the next page of the trip's components after the cursor, for the "load more" button."""
+    trip = db.first_or_404(sa.select(Trip).where(Trip.id == trip_id))
+    if not is_current_user(trip.user_id):
+        app.logger.warning("User %s, id: %s tried to access unauthorized trip %s.", current_user.username, current_user.id, trip_id)
+        abort(403)
+    return render_template('_components_page.html', trip=trip, **get_components_page(trip, request.args.get('after')))
 
 
 @app.route('/component/<component_id>', methods=['GET', 'POST'])
@@ -163,6 +266,7 @@ def component(component_id: int):
     form.participant_name.choices = get_participant_choices(component.trip_id)
 
     if form.validate_on_submit(): # Update the component
+        TripCostSummary.add_component(component, sign=-1)
         component.category_id = form.category_id.data
         component.type_id = form.type_id.data
         component.component_name = form.component_name.data
@@ -173,10 +277,11 @@ def component(component_id: int):
         component.link = form.link.data
         component.start_date = form.start_date.data
         component.end_date = form.end_date.data
+        TripCostSummary.add_component(component)
+        trip_data_changed(component.trip_id)
         db.session.commit()
-        app.logger.info(f"User {current_user.username} edited the component {component.component_name}, id: {component.id}.")
-        flash('Your component has been updated!')
-        return render_template('__reload.html')
+        app.logger.info("User %s edited the component %s, id: %s.", current_user.username, component.component_name, component.id)
+        return render_template('__reload.html', delta=get_trip_delta(component.trip_id, component=component))
     elif request.method == 'GET': # If it's a GET, then no data has been submitted from form so we fill with the component data
         form.category_id.data = component.category_id
         form.type_id.data = component.type_id
@@ -215,23 +320,20 @@ def create_component(trip_id: int):
                 start_date = form.start_date.data,
                 end_date = form.end_date.data,)
         db.session.add(component)
+        TripCostSummary.add_component(component)
+        trip_data_changed(trip_id)
         db.session.commit()
-        app.logger.info(f"User {current_user.username} added a new component to trip {trip.trip_name}, id: {trip_id}.")
-        flash('Your component has been added!')
-        return render_template('__reload.html')
+        app.logger.info("User %s added a new component to trip %s, id: %s.", current_user.username, trip.trip_name, trip_id)
+        return render_template('__reload.html', delta=get_trip_delta(trip_id, component=component))
     return render_template('_edit_component.html', form=form)
         
 
 
-@app.route('/type/<category_id>')
+@app.route('/type/<int:category_id>')
 @login_required
 def type(category_id: int):
     """AJAX route to get component types based on category_id."""
-    types = db.session.scalars(
-        sa.select(ComponentType)
-        .where(ComponentType.category_id == category_id)).all()
-    types_list = [(t.id, t.type_name) for t in types]
-    return {'types': types_list}
+    return {'types': get_type_choices(category_id)}
 
 
 @app.route('/delete_trip/<trip_id>', methods=['POST'])
@@ -243,12 +345,12 @@ def delete_trip(trip_id: int):
         .where(sa.and_(Trip.id == trip_id, Trip.user_id == current_user.id))
     )
     if trip is None:
-        app.logger.warning(f"User {current_user.username} tried to delete a non-existing or unauthorized trip {trip_id}")
+        app.logger.warning("User %s tried to delete a non-existing or unauthorized trip %s", current_user.username, trip_id)
         return {"success": False, "message": "Trip not found or you do not have permission to delete it."}, 404
 
     db.session.delete(trip)
     db.session.commit()
-    app.logger.info(f"User {current_user.username} deleted trip {trip_id} successfully.")
+    app.logger.info("User %s deleted trip %s successfully.", current_user.username, trip_id)
     return {"success": True, "message": "Trip deleted successfully."}, 200
 
 
@@ -262,14 +364,17 @@ def delete_component(component_id: int):
         .join(Trip)
         .where(sa.and_(Component.id == component_id, Trip.user_id == current_user.id)))
     if component is None:
-        app.logger.warning(f"User {current_user.username}, id: {current_user.id} tried to delete a non-existing or unauthorized component {component_id}")
+        app.logger.warning("User %s, id: %s tried to delete a non-existing or unauthorized component %s", current_user.username, current_user.id, component_id)
         return {"success": False, "message": "Component not found or you do not have permission to delete it."}, 404
 
     trip_id = component.trip_id
+    TripCostSummary.add_component(component, sign=-1)
+    trip_data_changed(trip_id)
     db.session.delete(component)
     db.session.commit()
-    app.logger.info(f"User {current_user.username}, id: {current_user.id} deleted component id: {component_id} from trip id: {trip_id}.")
-    return {"success": True, "trip_id": trip_id, "message": "Component deleted successfully."}, 200
+    app.logger.info("User %s, id: %s deleted component id: %s from trip id: %s.", current_user.username, current_user.id, component_id, trip_id)
+    return {"success": True, "trip_id": trip_id, "message": "Component deleted successfully.",
+            "delta": get_trip_delta(trip_id, deleted_component_id=int(component_id))}, 200
 
 
 @app.route('/delete_participant/<participant_id>', methods=['POST'])
@@ -281,7 +386,7 @@ def delete_participant(participant_id: int):
         .join(Trip)
         .where(sa.and_(Participant.id == participant_id, Trip.user_id == current_user.id)))
     if participant is None:
-        app.logger.warning(f"User {current_user.username}, id: {current_user.id} tried to delete a non-existing or unauthorized participant {participant_id}")
+        app.logger.warning("User %s, id: %s tried to delete a non-existing or unauthorized participant %s", current_user.username, current_user.id, participant_id)
         return {"success": False, "message": "Participant not found or you do not have permission to delete it."}, 404
 
     # Remove the participant from all components
@@ -292,10 +397,13 @@ def delete_participant(participant_id: int):
         )
     
     trip_id = participant.trip_id
+    TripCostSummary.remove_participant(trip_id, participant.id)
+    trip_data_changed(trip_id)
     db.session.delete(participant)
     db.session.commit()
-    app.logger.info(f"User {current_user.username}, id: {current_user.id} deleted participant id: {participant_id} from trip id: {trip_id}.")
-    return {"success": True, "trip_id": trip_id, "message": "Participant deleted successfully."}, 200
+    app.logger.info("User %s, id: %s deleted participant id: %s from trip id: %s.", current_user.username, current_user.id, participant_id, trip_id)
+    return {"success": True, "trip_id": trip_id, "message": "Participant deleted successfully.",
+            "delta": get_trip_delta(trip_id, deleted_participant_id=int(participant_id))}, 200
 
 @app.route('/activate_component/<component_id>', methods=['POST'])
 @login_required
@@ -306,24 +414,102 @@ def activate_component(component_id: int):
         .join(Trip)
         .where(sa.and_(Component.id == component_id, Trip.user_id == current_user.id)))
     if component is None:
-        app.logger.warning(f"User {current_user.username}, id: {current_user.id} tried to activate a non-existing or unauthorized component {component_id}")
+        app.logger.warning("User %s, id: %s tried to activate a non-existing or unauthorized component %s", current_user.username, current_user.id, component_id)
         return {"success": False, "message": "Component not found or you do not have permission to activate it."}, 404
 
+    TripCostSummary.add_component(component, sign=-1)
     component.is_active = not component.is_active
+    TripCostSummary.add_component(component)
+    trip_data_changed(component.trip_id)
     db.session.commit()
-    app.logger.info(f"User {current_user.username}, id: {current_user.id} activated component id: {component_id}.")
-    return {"success": True, "message": "Component activated successfully."}, 200
+    app.logger.info("User %s, id: %s activated component id: %s.", current_user.username, current_user.id, component_id)
+    return {"success": True, "message": "Component activated successfully.",
+            "delta": get_trip_delta(component.trip_id, component=component)}, 200
 
-# WIP
-@app.route('/summary/<trip_id>')
+@app.route('/import_components/<trip_id>', methods=['POST'])
+@login_required
+def import_trip_components(trip_id: int):
+    """AJAX route for importing components into a trip from an uploaded CSV or JSON lines file."""
+    trip = db.session.scalar(
+        sa.select(Trip)
+        .where(sa.and_(Trip.id == trip_id, Trip.user_id == current_user.id)))
+    if trip is None:
+        app.logger.warning("User %s, id: %s tried to import into a non-existing or unauthorized trip %s", current_user.username, current_user.id, trip_id)
+        return {"success": False, "message": "Trip not found or you do not have permission to import into it."}, 404
+    upload = request.files.get('file')
+    if upload is None:
+        return {"success": False, "message": "No file uploaded."}, 400
+    try:
+        fmt = detect_format(upload.filename, request.args.get('format'))
+        result = import_components(trip.id, upload.stream, fmt)
+    except (ValueError, csv.Error) as e: # Unsupported format or a file that can't be decoded or parsed
+        app.logger.warning("User %s, id: %s failed to import into trip id: %s: %s", current_user.username, current_user.id, trip_id, e)
+        return {"success": False, "message": f"Could not read the file: {e}"}, 400
+    app.logger.info("User %s, id: %s imported %s components into trip id: %s.", current_user.username, current_user.id, result['imported'], trip_id)
+    return {"success": True, **result, "data_key": fetch_trip_key(trip.id)}, 200
+
+@app.route('/summary/<trip_id>', methods=['GET', 'POST'])
 @login_required
 def get_trip_summary(trip_id: int):
-    """Route to get a file with the trip summary."""
+    """Route to download the trip components as a CSV (default), JSON lines or XLSX file, chosen with the format
+    query parameter. Costs are also converted to the user's preferred currency. The file is streamed while it's
+    read from the database, so large trips aren't buffered in the worker. 
+    Formatted reports (format=html) are too slow to build in a request, POSTing for one queues a ReportJob 
+    for the report workers and answers with its status, polled at report_job_status."""
     trip = db.first_or_404(sa.select(Trip).where(Trip.id == trip_id))
     if not is_current_user(trip.user_id):
         flash("You do not have permission to view this trip.")
-        app.logger.warning(f"User {current_user.username}, id: {current_user.id} tried to access unauthorized trip {trip_id} summary.")
+        app.logger.warning("User %s, id: %s tried to access unauthorized trip %s summary.", current_user.username, current_user.id, trip_id)
         return redirect(url_for('user', username=current_user.username))
-    components = db.session.scalars(trip.components.select())
-    participants = db.session.scalars(trip.participants.select())
-    return render_template('summary.html', trip=trip, components=components, participants=participants, preferred_currency=current_user.preferred_currency)
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt in REPORT_FORMATS:
+        if request.method != 'POST':
+            abort(405)
+        job = ReportJob(user_id=current_user.id, trip_id=trip.id, report_format=fmt)
+        db.session.add(job)
+        db.session.commit()
+        app.logger.info("User %s, id: %s queued %s report job id: %s of trip id: %s.", current_user.username, current_user.id, fmt, job.id, trip.id)
+        return {**job.to_dict(), "status_url": url_for('report_job_status', job_id=job.id)}, 202
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    filename = f"{secure_filename(trip.trip_name) or 'trip'}.{fmt}"
+    app.logger.info("User %s, id: %s exported trip id: %s as %s.", current_user.username, current_user.id, trip.id, fmt)
+    chunks = export_components(trip.id, fmt, current_user.preferred_currency)
+    return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt],
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+@app.route('/report_job/<int:job_id>')
+@login_required
+def report_job_status(job_id: int):
+    """AJAX route for polling the status of a report job, with the download URL once it's done."""
+    job = db.first_or_404(sa.select(ReportJob).where(ReportJob.id == job_id, ReportJob.user_id == current_user.id))
+    status = job.to_dict()
+    if job.status == 'done':
+        status["download_url"] = url_for('download_report', job_id=job.id)
+    return status, 200
+
+
+@app.route('/report_job/<int:job_id>/download')
+@login_required
+def download_report(job_id: int):
+    """Route to download the built report of a done job."""
+    job = db.first_or_404(sa.select(ReportJob).where(ReportJob.id == job_id, ReportJob.user_id == current_user.id))
+    if job.status != 'done':
+        abort(404)
+    trip = db.session.get(Trip, job.trip_id)
+    name = (secure_filename(trip.trip_name) if trip else '') or 'trip'
+    filename = f"{name}_report.{REPORT_FORMATS[job.report_format][1]}"
+    return send_file(artifact_path(job), mimetype=REPORT_FORMATS[job.report_format][0], as_attachment=True, download_name=filename)
+
+
+@app.route('/metrics')
+def metrics():
+    """Route for Prometheus scrapes: request, Dash callback and SQL histograms of all the worker processes.
+    Only served with an "Authorization: Bearer <METRICS_TOKEN>" header, and not at all while METRICS_TOKEN is unset."""
+    token = app.config["METRICS_TOKEN"]
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()):
+        abort(401)
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
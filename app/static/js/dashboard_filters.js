@@ -0,0 +1,195 @@
+// Clientside filtering for the trip dashboard, used when DASH_CLIENTSIDE_FILTERING is enabled.
+// Mirrors filter_df, get_title, get_bar_graph and get_pie_graph from app/plotlydash/dashboard.py,
+// keep them in sync when changing either side.
+
+const MISSING_DATE = -2147483648;  // MISSING_DATE in app/plotlydash/columnar.py
+const PAYLOAD_FORMAT = 1;
+const decodedPayloads = new WeakMap();
+
+const TYPED_ARRAYS = {i1: Int8Array, i2: Int16Array, i4: Int32Array, f8: Float64Array};
+
+function unpackArray(packed) {
+    // Base64 little-endian bytes packed by pack_array into a typed array
+    const binary = atob(packed.data);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return new TYPED_ARRAYS[packed.dtype](bytes.buffer);
+}
+
+const formattedDays = new Map([[MISSING_DATE, null]]);
+
+function formatDay(day) {
+    // Epoch day to an ISO date, components share few distinct dates so each one is formatted once
+    if (!formattedDays.has(day)) {
+        formattedDays.set(day, new Date(day * 86400000).toISOString().slice(0, 10));
+    }
+    return formattedDays.get(day);
+}
+
+function decodePayload(payload) {
+    // Mirrors TripDataset.from_payload. Dictionary-encoded columns stay as typed arrays of codes (read them with
+    // columnValue) and the costs are converted to the preferred currency. The result is kept per payload object, 
+    // so filter changes don't decode the data again
+    if (decodedPayloads.has(payload)) {
+        return decodedPayloads.get(payload);
+    }
+    if (payload.format !== PAYLOAD_FORMAT) {
+        throw new Error("Unsupported trip data payload format: " + payload.format);
+    }
+    const columns = Object.assign({size: payload.size, codes: {}, dictionaries: payload.dictionaries}, payload.text);
+    for (const [name, packed] of Object.entries(payload.codes)) {
+        columns.codes[name] = unpackArray(packed);
+    }
+    for (const [name, packed] of Object.entries(payload.arrays)) {
+        columns[name] = unpackArray(packed);
+    }
+    const currencyCodes = columns.codes.original_currency;
+    columns.adjusted_cost = new Float64Array(payload.size);
+    for (let i = 0; i < payload.size; i++) {
+        columns.adjusted_cost[i] = columns.base_cost[i] * payload.currency_rates[currencyCodes[i]]; // Unrounded like convert_many, rounded when displayed
+    }
+    decodedPayloads.set(payload, columns);
+    return columns;
+}
+
+function columnValue(columns, name, i) {
+    return columns.dictionaries[name][columns.codes[name][i]];
+}
+
+function allowedCodes(dictionary, chosen) {
+    // Flags of the dictionary entries among the chosen values, null if nothing is chosen (no filtering)
+    if (!chosen || !chosen.length) {
+        return null;
+    }
+    const values = new Set(chosen);
+    return Uint8Array.from(dictionary, value => values.has(value) ? 1 : 0);
+}
+
+function filterRows(columns, chosenCategories, chosenParticipants, includeFree) {
+    // Returns the indices of the rows passing the same rules as filter_df.
+    // Shared components have the participant id -1, same as the "Shared components" option
+    const categories = allowedCodes(columns.dictionaries.category_name, chosenCategories);
+    const participants = allowedCodes(columns.dictionaries.participant_id, chosenParticipants);
+    const categoryCodes = columns.codes.category_name;
+    const participantCodes = columns.codes.participant_id;
+    const rows = [];
+    for (let i = 0; i < columns.size; i++) {
+        if ((participants === null || participants[participantCodes[i]])
+                && (includeFree || columns.base_cost[i] > 0)
+                && (categories === null || categories[categoryCodes[i]])) {
+            rows.push(i);
+        }
+    }
+    return rows;
+}
+
+function placeholderGraph(title) {
+    return {data: [], layout: {title: {text: title}, width: 365, height: 365}};
+}
+
+function getTitle(columns, rows, tripName, currency) {
+    let tripCost = 0;
+    for (const i of rows) {
+        tripCost += columns.adjusted_cost[i];
+    }
+    const lengthStr = rows.length !== 1 ? "(" + rows.length + " components)" : " (1 component)";
+    return "Trip: " + tripName + " - total cost: " + tripCost.toFixed(2) + " " + currency + " - " + lengthStr;
+}
+
+function getBarGraph(columns, rows, currency, colors) {
+    // One trace per category, like px.bar with color="category_name"
+    const traces = new Map();
+    for (const i of rows) {
+        const category = columnValue(columns, "category_name", i);
+        if (!traces.has(category)) {
+            traces.set(category, {
+                type: "bar", name: category, legendgroup: category, showlegend: true,
+                x: [], y: [], hovertext: [], customdata: [],
+                marker: {color: colors[category], line: {width: 1, color: "Black"}},
+                hovertemplate: "<b>%{x}</b><br><br>" +
+                    "Cost: %{y:.2f}" + currency + "<br>" +
+                    "Description: %{hovertext}<br>" +
+                    "Start date: %{customdata[0]}<br>" +
+                    "End date: %{customdata[1]}<br>" +
+                    "Link: %{customdata[2]}<extra></extra>",
+            });
+        }
+        const trace = traces.get(category);
+        trace.x.push(columns.component_name[i]);
+        trace.y.push(columns.adjusted_cost[i]);
+        trace.hovertext.push(columns.description[i]);
+        trace.customdata.push([formatDay(columns.start_date[i]), formatDay(columns.end_date[i]), columns.link[i]]);
+    }
+    return {
+        data: Array.from(traces.values()),
+        layout: {
+            title: {text: "Cost breakdown by component"},
+            width: 365,
+            height: 365,
+            hoverlabel: {bgcolor: "white", font: {size: 12, family: "Fira Sans"}},
+            paper_bgcolor: "#f3ebdf",
+            plot_bgcolor: "#f3ebdf",
+            barmode: "relative",
+            xaxis: {title: {text: "Component"}, tickangle: 45, tickfont: {size: 10}, categoryorder: "total ascending"},
+            yaxis: {title: {text: "Cost (" + currency + ")"}},
+            showlegend: true,
+            legend: {title: {text: "Category"}},
+            margin: {l: 30, r: 0, t: 40, b: 30},
+            font: {family: "Fira Sans"},
+        },
+    };
+}
+
+function getPieGraph(columns, rows, currency, colors) {
+    // Plotly sums the values of repeated labels, like px.pie with names="category_name"
+    const trace = {
+        type: "pie", labels: [], values: [], customdata: [],
+        marker: {colors: [], line: {width: 1, color: "Black"}},
+        textposition: "inside",
+        textinfo: "percent+label",
+        hovertemplate: "<b>%{label}</b><br><br>" +
+            "Cost: %{value:.2f}" + currency + "<br>" +
+            "Category: %{customdata[0]}<br>" +
+            "Subcategory: %{customdata[1]}<extra></extra>",
+    };
+    for (const i of rows) {
+        const category = columnValue(columns, "category_name", i);
+        trace.labels.push(category);
+        trace.values.push(columns.adjusted_cost[i]);
+        trace.customdata.push([category, columnValue(columns, "type_name", i)]);
+        trace.marker.colors.push(colors[category]);
+    }
+    return {
+        data: [trace],
+        layout: {
+            title: {text: "Cost breakdown by category"},
+            width: 365,
+            height: 365,
+            hoverlabel: {bgcolor: "white", font: {size: 12, family: "Fira Sans"}},
+            margin: {l: 0, r: 30, t: 40, b: 30},
+            paper_bgcolor: "#f3ebdf",
+            plot_bgcolor: "#f3ebdf",
+            legend: {title: {text: "Component name"}},
+            font: {family: "Fira Sans"},
+        },
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        updateDashboard: function(data, chosenCategories, chosenParticipants, includeFree) {
+            if (!data) {
+                return ["No data loaded yet.", placeholderGraph("Waiting for data..."), placeholderGraph("Waiting for data...")];
+            }
+            const columns = decodePayload(data.payload);
+            const rows = filterRows(columns, chosenCategories, chosenParticipants, includeFree);
+            const title = getTitle(columns, rows, data.trip_name, data.currency);
+            if (rows.length === 0) {
+                return [title, placeholderGraph("No valid data to display."), placeholderGraph("No valid data to display.")];
+            }
+            return [title, getBarGraph(columns, rows, data.currency, data.colors), getPieGraph(columns, rows, data.currency, data.colors)];
+        },
+    },
+});
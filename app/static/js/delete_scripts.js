@@ -2,8 +2,64 @@ function reloadPageAndParent() { // for iframes
     parent.location.reload();
 };
 
+function applyTripDelta(delta) {
+    // Applies the changes returned by a trip mutation (get_trip_delta in routes.py) to the trip page in place
+    if (delta.component_html !== null) {
+        let row = document.getElementById("component-" + delta.component_id);
+        const list = document.getElementById("components-list");
+        // New components go last, unless there are pages left to load which will bring them
+        if (!row && list && !list.querySelector(".load-more")) {
+            row = document.createElement("div");
+            row.id = "component-" + delta.component_id;
+            list.appendChild(row);
+        }
+        if (row) {
+            row.innerHTML = delta.component_html;
+        }
+    }
+    if (delta.deleted_component_id !== null) {
+        removeElement("component-" + delta.deleted_component_id);
+        closeEditedComponent();
+    }
+    if (delta.deleted_participant_id !== null) {
+        removeElement("participant-" + delta.deleted_participant_id);
+    }
+    const total = document.getElementById("trip-total");
+    if (total) {
+        total.outerHTML = delta.total_html;
+    }
+    refreshDashboard(delta.data_key);
+}
+
+function applyTripDeltaInParent(delta) {
+    // For the component editor iframe - applies the delta to the trip page around it and closes the editor
+    parent.applyTripDelta(delta);
+    parent.setTimeout(parent.closeEditedComponent, 0);
+}
+
+function refreshDashboard(dataKey) {
+    // Pushes the new trip data key into the dashboard store, so only its callbacks run again instead of a reload
+    const frame = document.getElementById("dash-frame");
+    if (!frame) {
+        return;
+    }
+    const dash = frame.contentWindow.dash_clientside;
+    if (dash && dash.set_props) {
+        dash.set_props("data-store-trip", {data: dataKey});
+    } else {
+        frame.contentWindow.location.reload();
+    }
+}
+
+function removeElement(id) {
+    const element = document.getElementById(id);
+    if (element) {
+        element.remove();
+    }
+}
+
 function deleteComponentAndReload(component_id) {
-    // For iframes - deletes the component with the given component_id and reloads the parent page
+    // Deletes the component with the given component_id and applies the change to the trip page, also from the editor iframe
     if (confirm("Are you sure you want to delete this component?")) {
         fetch("/delete_component/" + component_id, {
             method: "POST",
@@ -14,8 +70,7 @@ function deleteComponentAndReload(component_id) {
         .then(response => response.json())  // Parse the response as JSON
         .then(data => {
             if (data.success) {
-                // If deletion was successful, reload the page and parent
-                reloadPageAndParent();
+                applyTripDeltaInParent(data.delta);
             } else {
                 alert(data.message || "Failed to delete the component.");
             }
@@ -37,7 +92,7 @@ function deleteParticipantAndReload(participant_id) {
         .then(response => response.json())  // Parse the response as JSON
         .then(data => {
             if (data.success) {
-                reloadPageAndParent();
+                applyTripDelta(data.delta);
             } else {
                 alert(data.message || "Failed to delete the participant.");
             }
@@ -50,7 +105,7 @@ function deleteParticipantAndReload(participant_id) {
 
 function deleteTrip(trip_id, reload=true) { 
     // function will send a POST request to the server to delete the trip with the given trip_id
-    // if reload is false, the page will redirect to homepage
+    // if reload is true the trip is removed from the list in place, otherwise the page will redirect to homepage
     if (confirm("Are you sure you want to delete this trip?")) {
         fetch("/delete_trip/" + trip_id, {
             method: "POST",
@@ -62,7 +117,7 @@ function deleteTrip(trip_id, reload=true) {
         .then(data => {
             if (data.success) {
                 if (reload) {
-                    window.location.reload();
+                    removeElement("trip-" + trip_id);
                 } else {
                     window.location.href = "/";
                 }
@@ -76,12 +131,100 @@ function deleteTrip(trip_id, reload=true) {
     }
 };
 
+function loadMore(button, url) {
+    // Replaces the "load more" button with the next page of the list and its own button, if there are more rows
+    fetch(url)
+    .then(response => {
+        if (!response.ok) {
+            throw new Error("HTTP " + response.status);
+        }
+        return response.text();
+    })
+    .then(html => {
+        button.outerHTML = html;
+    }).catch(error => {
+        console.error("Error while loading more:", error);
+        alert("An error occurred while trying to load more.");
+    });
+}
+
+function importComponents(trip_id, input) {
+    // Uploads the chosen CSV or JSON lines file to the import endpoint and reloads the page with the new components
+    if (!input.files.length) {
+        return;
+    }
+    const body = new FormData();
+    body.append("file", input.files[0]);
+    input.value = "";
+    fetch("/import_components/" + trip_id, {method: "POST", body: body})
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            alert(data.message || "Failed to import the components.");
+            return;
+        }
+        let message = "Imported " + data.imported + " components.";
+        if (data.error_count) {
+            message += "\n" + data.error_count + " rows were rejected:\n" + 
+                data.errors.slice(0, 10).map(error => "Line " + error.line + ": " + error.errors.join(" ")).join("\n");
+        }
+        alert(message);
+        if (data.imported) {
+            window.location.reload();
+        }
+    }).catch(error => {
+        console.error("Error during import:", error);
+        alert("An error occurred while trying to import the components.");
+    });
+}
+
+function requestReport(trip_id, button) {
+    // Queues a report of the trip for the report workers, polls the job status and downloads the report when it's done
+    button.disabled = true;
+    const finish = message => {
+        button.disabled = false;
+        if (message) {
+            alert(message);
+        }
+    };
+    const poll = status_url => {
+        fetch(status_url)
+        .then(response => response.json())
+        .then(job => {
+            if (job.status === "done") {
+                finish();
+                window.location.href = job.download_url;
+            } else if (job.status === "failed") {
+                finish("Failed to build the report: " + job.error);
+            } else {
+                setTimeout(() => poll(status_url), 2000);
+            }
+        }).catch(error => {
+            console.error("Error during report polling:", error);
+            finish("An error occurred while waiting for the report.");
+        });
+    };
+    fetch("/summary/" + trip_id + "?format=html", {method: "POST"})
+    .then(response => response.json())
+    .then(job => poll(job.status_url))
+    .catch(error => {
+        console.error("Error during report request:", error);
+        finish("An error occurred while trying to request the report.");
+    });
+}
+
 function setNewEditedComponent(trip_id) {
     const edit_component = document.getElementById('edit-component');
     if (edit_component) {
         edit_component.innerHTML = '<iframe class="edit-component" src="/create_component/' + trip_id + '"></iframe>';
     }
 }
+function closeEditedComponent() {
+    const edit_component = document.getElementById('edit-component');
+    if (edit_component) {
+        edit_component.innerHTML = '';
+    }
+}
 function changeEditedComponent(component_id) {
     const edit_component = document.getElementById('edit-component');
     if (edit_component) {
@@ -99,7 +242,7 @@ function activateComponent(component_id) {
     .then(response => response.json())  // Parse the response as JSON
     .then(data => {
         if (data.success) {
-            window.location.reload();
+            applyTripDelta(data.delta);
         } else {
             alert(data.message || "Failed to activate the component.");
         }
@@ -0,0 +1,89 @@
+"""Benchmark of the dashboard filtering: the previous pandas path against the columnar TripDataset.
+
+Usage:
+    python benchmarks/bench_filter.py [rows ...]
+
+The previous path built a DataFrame from the dictionary of lists and filtered it with one mask per condition 
+(concatenating the shared components back in), on every filter change. The columnar path builds the TripDataset 
+once per trip version (it's cached with the trip data) and filters with a single mask per change."""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.plotlydash.columnar import TripDataset, SHARED_PARTICIPANT
+
+CATEGORIES = ["Accommodation", "Food", "Transport", "Entertainment", "Shopping", "Other"]
+CHOSEN_CATEGORIES = ["Accommodation", "Food", "Transport", "Entertainment", "Other"]
+CHOSEN_PARTICIPANTS = [1, 2, 3, SHARED_PARTICIPANT]
+RATES = {"PLN": 1.0, "EUR": 4.27, "USD": 3.93} # Rates to PLN
+
+
+def synthetic_trip_data(rows: int, seed: int = 0) -> dict:
+    """Dictionary of lists shaped like the output of data_to_dict, with 8 participants and ~10% shared components."""
+    rng = np.random.default_rng(seed)
+    participants = rng.integers(1, 9, rows).astype(object)
+    participants[rng.random(rows) < 0.1] = None
+    base_cost = rng.gamma(2.0, 100.0, rows).round(2)
+    base_cost[rng.random(rows) < 0.05] = 0
+    currencies = rng.choice(list(RATES), rows)
+    start = pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D")
+    return {
+        "component_name": [f"Component {i}" for i in range(rows)],
+        "category_name": list(rng.choice(CATEGORIES, rows)),
+        "type_name": list(rng.choice(["Hotel", "Flight", "Restaurant", "Museum"], rows)),
+        "base_cost": base_cost.tolist(),
+        "participant_id": participants.tolist(),
+        "link": [None] * rows,
+        "description": [""] * rows,
+        "start_date": list(start.to_pydatetime()),
+        "end_date": list(start.to_pydatetime()),
+        "original_currency": list(currencies),
+        "exchange_rate": [RATES[currency] for currency in currencies],
+    }
+
+
+def legacy_filter_df(trip_data, chosen_categories, chosen_participants, include_free):
+    """filter_df before the columnar engine."""
+    df = pd.DataFrame(trip_data)
+    temp_df = pd.DataFrame()
+    if chosen_participants:
+        if -1 in chosen_participants:
+            temp_df = df[df["participant_id"].isna()]
+        df = df[df["participant_id"].isin(chosen_participants)]
+    df = pd.concat([df, temp_df])
+    if not include_free:
+        df = df[df["base_cost"] > 0]
+    if chosen_categories:
+        df = df[df["category_name"].isin(chosen_categories)]
+    return df
+
+
+def best_of(func, repeat: int) -> float:
+    """Best wall time of func in milliseconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main(sizes):
+    print(f"{'rows':>9} {'legacy ms':>10} {'build ms':>9} {'columnar ms':>12} {'speedup':>8}")
+    for rows in sizes:
+        trip_data = synthetic_trip_data(rows)
+        repeat = 5 if rows < 500_000 else 3
+        args = (CHOSEN_CATEGORIES, CHOSEN_PARTICIPANTS, False)
+
+        dataset = TripDataset.from_dict(trip_data)
+        legacy = legacy_filter_df(trip_data, *args)
+        columnar = dataset.to_frame(dataset.mask(*args))
+        assert sorted(legacy["component_name"]) == sorted(columnar["component_name"]), "Filter results differ"
+
+        legacy_ms = best_of(lambda: legacy_filter_df(trip_data, *args), repeat)
+        build_ms = best_of(lambda: TripDataset.from_dict(trip_data), repeat)
+        columnar_ms = best_of(lambda: dataset.to_frame(dataset.mask(*args)), repeat)
+        print(f"{rows:>9} {legacy_ms:>10.1f} {build_ms:>9.1f} {columnar_ms:>12.1f} {legacy_ms / columnar_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
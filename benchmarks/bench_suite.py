@@ -0,0 +1,278 @@
+"""Benchmark suite of the data paths, the Dash callbacks and the main routes on a synthetic database.
+
+Usage:
+    python benchmarks/bench_suite.py [--components N ...] [--repeat 5] [--only NAME ...]
+                                     [--output results.json] [--compare baseline.json] [--threshold 1.25]
+
+For every --components scale (10k by default, 1k to 1M are sensible) a fresh database is generated with
+benchmarks/synthetic.py and every benchmark is run once to warm up, then --repeat times. Routes and Dash
+callbacks go through the Flask test client, so they include the request handling, the login check and
+the JSON encoding. update_exchange_rates fetches from a local stub of the rates API.
+
+The database is a SQLite file in a temporary directory, BENCH_DATABASE_URL points the suite at another
+(empty) database instead. DATABASE_URL is never used, the generator would write into it.
+
+Results are written as JSON (environment, scale and per-benchmark timings in milliseconds). With --compare,
+the medians are compared to a previous results file and the script exits with 1 if any benchmark got slower
+than --threshold times its baseline."""
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="travel_planner_bench_")
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True) # Registered before the app's handlers, so it runs after them
+os.environ["DATABASE_URL"] = os.environ.get("BENCH_DATABASE_URL") or "sqlite:///" + os.path.join(WORK_DIR, "bench.db")
+os.environ["LOG_FILE"] = os.path.join(WORK_DIR, "bench.log")
+os.environ["METRICS_DIR"] = os.path.join(WORK_DIR, "metrics")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dash
+import sqlalchemy as sa
+
+from app import app, db
+from app.models import Trip, ExchangeRates, rate_cache, reference_catalog
+from app.plotlydash.cache import trip_data_cache, figure_cache
+from app.plotlydash.columnar import TripDataset, SHARED_PARTICIPANT
+from app.plotlydash.dashboard import filter_df
+from app.plotlydash.data import data_to_dict, fetch_trip_key
+from app.exchange_rates.rates import update_exchange_rates
+from synthetic import RATES, generate
+
+CHOSEN_CATEGORIES = ["Accommodation", "Food", "Transport", "Entertainment", "Other"]
+STUB_CURRENCIES = 160 # Currencies answered by the rates API stub, about as many as the real API
+
+
+class StubRatesHandler(BaseHTTPRequestHandler):
+    """Stub of the exchange rates API answering every base with the same STUB_CURRENCIES rates."""
+    body = json.dumps({"rates": {**RATES, **{f"{chr(65 + i // 26)}{chr(65 + i % 26)}X": 1.0 + i / 100 for i in range(STUB_CURRENCIES - len(RATES))}}}).encode()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """Time func once to warm up, then repeat times, calling setup (untimed) before every call.
+
+    Returns:
+        dict: min, median, mean, max and standard deviation of the timed calls in milliseconds"""
+    times = []
+    for run in range(repeat + 1):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        if run: # The first call warms up
+            times.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "max_ms": round(max(times), 3),
+        "stdev_ms": round(statistics.stdev(times), 3) if repeat > 1 else 0.0,
+    }
+
+
+def get(client, url: str):
+    """Request a page with the test client, reading the whole (possibly streamed) body."""
+    def request():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} answered {response.status_code}")
+        response.get_data()
+        response.close()
+    return request
+
+
+def callback(client, output: str, outputs, inputs: list[tuple[str, str, object]]):
+    """Call a Dash callback through the test client, like the browser does.
+
+    Args:
+        output (str): Callback id, as in the Dash app's callback_map
+        outputs (dict | list[dict]): Output ids and properties of the callback
+        inputs (list[tuple[str, str, object]]): (id, property, value) of every input"""
+    payload = {"output": output, "outputs": outputs,
+               "inputs": [{"id": id_, "property": prop, "value": value} for id_, prop, value in inputs],
+               "changedPropIds": [f"{inputs[0][0]}.{inputs[0][1]}"]}
+    def request():
+        response = client.post("/dash/_dash-update-component", json=payload)
+        if response.status_code not in (200, 204):
+            raise RuntimeError(f"Dash callback {output} answered {response.status_code}")
+        response.get_data()
+    return request
+
+
+def benchmarks(data: dict) -> dict:
+    """Benchmarks of the generated data, by name.
+
+    Returns:
+        dict: Name to (function, setup or None)"""
+    trip = db.session.get(Trip, data["trip_id"])
+    currency = trip.user.preferred_currency
+    components = trip.get_active_components()
+    trip_data = data_to_dict(components, trip.trip_name, currency)[0]
+    dataset = TripDataset.from_dict(trip_data)
+    participants = sorted(set(p for p in trip_data["participant_id"] if p is not None)) + [SHARED_PARTICIPANT]
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(data["user_id"])
+    key = fetch_trip_key(trip.id)
+    participant_options = [[f"Participant {i}", p] for i, p in enumerate(participants[:-1])]
+    callback_map = dash.get_app().callback_map
+    dashboard_inputs = [("data-store-trip", "data", key), ("dropdown-categories", "value", CHOSEN_CATEGORIES),
+                        ("dropdown-participants", "value", participants), ("radio-include-free", "value", False)]
+
+    def clear_dashboard_caches():
+        trip_data_cache.clear()
+        figure_cache.clear()
+
+    def expire_rates():
+        db.session.execute(sa.update(ExchangeRates).values(last_updated=datetime(2000, 1, 1)))
+        db.session.commit()
+
+    suite = {
+        "data_to_dict": (lambda: data_to_dict(components, trip.trip_name, currency), None),
+        "filter_df": (lambda: filter_df(dataset, CHOSEN_CATEGORIES, participants, False), None),
+        "trip.get_total_cost": (trip.get_total_cost, None),
+        "update_exchange_rates": (update_exchange_rates, expire_rates),
+        "dash.load_data": (callback(client, "data-store-trip.data", {"id": "data-store-trip", "property": "data"},
+                                    [("url", "pathname", f"/dash/{trip.id}")]), None),
+        "dash.load_participants": (callback(client, "data-store-participants.data", {"id": "data-store-participants", "property": "data"},
+                                            [("data-store-trip", "data", key)]), None),
+        "dash.update_dropdown_from_store": (callback(client, "..dropdown-participants.options...dropdown-participants.value..",
+                                                     [{"id": "dropdown-participants", "property": "options"}, {"id": "dropdown-participants", "property": "value"}],
+                                                     [("data-store-participants", "data", participant_options)]), None),
+    }
+    dashboard = "..trip-title.children...budget-bar-graph.figure...budget-pie-graph.figure.."
+    if dashboard in callback_map: # Server side filtering
+        update_dashboard = callback(client, dashboard, [{"id": "trip-title", "property": "children"}, {"id": "budget-bar-graph", "property": "figure"},
+                                                        {"id": "budget-pie-graph", "property": "figure"}], dashboard_inputs)
+        suite["dash.update_dashboard.cold"] = (update_dashboard, clear_dashboard_caches)
+        suite["dash.update_dashboard.filter_change"] = (update_dashboard, figure_cache.clear)
+        suite["dash.update_dashboard.cached"] = (update_dashboard, None)
+    if "data-store-columns.data" in callback_map: # Clientside filtering
+        load_columns = callback(client, "data-store-columns.data", {"id": "data-store-columns", "property": "data"}, [("data-store-trip", "data", key)])
+        suite["dash.load_columns.cold"] = (load_columns, trip_data_cache.clear)
+        suite["dash.load_columns.cached"] = (load_columns, None)
+    for name, url in (("welcome", "/"), ("user", f"/user/{data['username']}"), ("trip", f"/trip/{trip.id}"),
+                      ("type_choices", "/type/1"), ("dashboard", f"/dash/{trip.id}"),
+                      ("summary.csv", f"/summary/{trip.id}"), ("summary.jsonl", f"/summary/{trip.id}?format=jsonl"),
+                      ("summary.xlsx", f"/summary/{trip.id}?format=xlsx")):
+        suite[f"route.{name}"] = (get(client, url), None)
+    return suite
+
+
+def run_scale(components: int, args) -> dict:
+    """Generate a fresh database with the given number of components and run the benchmarks on it."""
+    with app.app_context():
+        db.drop_all()
+        rate_cache.invalidate()
+        reference_catalog.invalidate()
+        trip_data_cache.clear()
+        figure_cache.clear()
+        start = time.perf_counter()
+        data = generate(components, users=args.users, trips_per_user=args.trips, participants_per_trip=args.participants,
+                        other_components=args.other_components, seed=args.seed)
+        scale = {**data["counts"], "generate_seconds": round(time.perf_counter() - start, 2)}
+        print(f"\n{components} components: generated {scale} ")
+        print(f"{'benchmark':<40} {'median ms':>11} {'min ms':>11} {'max ms':>11}")
+        results = {}
+        for name, (func, setup) in benchmarks(data).items():
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            results[name] = measure(func, args.repeat, setup)
+            print(f"{name:<40} {results[name]['median_ms']:>11.2f} {results[name]['min_ms']:>11.2f} {results[name]['max_ms']:>11.2f}")
+            db.session.rollback() # Every benchmark starts from a clean session
+    return {"components": components, "scale": scale, "results": results}
+
+
+def environment() -> dict:
+    """Where the results were measured, to tell apart the runs of different machines and commits."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+            "cpus": os.cpu_count(), "database": db.engine.dialect.name, "commit": commit or None,
+            "dash_clientside_filtering": app.config["DASH_CLIENTSIDE_FILTERING"]}
+
+
+def compare(runs: list[dict], baseline_path: str, threshold: float) -> list[str]:
+    """Compare the medians of the runs with the runs of the same scale in a previous results file.
+
+    Returns:
+        list[str]: Benchmarks slower than threshold times their baseline, as "scale/name"""
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = {run["components"]: run["results"] for run in json.load(file)["runs"]}
+    regressions = []
+    print(f"\nCompared to {baseline_path}:")
+    print(f"{'benchmark':<50} {'baseline ms':>11} {'median ms':>11} {'ratio':>7}")
+    for run in runs:
+        for name, result in run["results"].items():
+            previous = baseline.get(run["components"], {}).get(name)
+            if not previous:
+                continue
+            ratio = result["median_ms"] / previous["median_ms"] if previous["median_ms"] else 1.0
+            label = f"{run['components']}/{name}"
+            flag = " REGRESSION" if ratio > threshold else ""
+            print(f"{label:<50} {previous['median_ms']:>11.2f} {result['median_ms']:>11.2f} {ratio:>6.2f}x{flag}")
+            if flag:
+                regressions.append(label)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--components", type=int, nargs="+", default=[10_000], help="Components of the benchmarked trip, one run per value")
+    parser.add_argument("--users", type=int, default=10, help="Synthetic users")
+    parser.add_argument("--trips", type=int, default=5, help="Trips of every user")
+    parser.add_argument("--participants", type=int, default=4, help="Participants of every trip")
+    parser.add_argument("--other-components", type=int, default=100, help="Components of every trip but the benchmarked one")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls of every benchmark, after one warm-up call")
+    parser.add_argument("--only", nargs="+", help="Only run the benchmarks whose name contains one of these")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Previous JSON results to compare the medians with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Median ratio to the baseline reported as a regression")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubRatesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.config["RATES_API_URL"] = f"http://127.0.0.1:{server.server_port}/latest"
+    try:
+        runs = [run_scale(components, args) for components in args.components]
+    finally:
+        server.shutdown()
+    with app.app_context():
+        results = {"created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "environment": environment(),
+                   "repeat": args.repeat, "runs": runs}
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare and compare(runs, args.compare, args.threshold):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Synthetic database for the benchmarks: users, trips, participants and components at any scale.
+
+Rows are inserted with bulk Core INSERT statements (one executemany per batch) instead of ORM objects, so a
+trip of 1M components is generated in about half a minute. The trip cost summary is rebuilt afterwards, the same
+way the rebuild_cost_summary command does.
+
+The app reads DATABASE_URL when it's imported, so set it before importing this module."""
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import sqlalchemy as sa
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.models import User, Trip, Participant, Component, ComponentType, ExchangeRates, TripCostSummary, populate_initial_data
+
+RATES = {"PLN": 1.0, "EUR": 0.2342, "USD": 0.2545, "GBP": 0.1953, "CZK": 5.87} # Rates from PLN
+PASSWORD = "benchmark" # Password of every synthetic user, hashed once
+BATCH_SIZE = 10_000 # Rows per INSERT statement
+
+
+def insert_rows(model, rows: list[dict], batch_size: int = BATCH_SIZE) -> None:
+    """Insert rows into the table of a model, batch_size rows per statement."""
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(sa.insert(model.__table__), rows[start:start + batch_size])
+
+
+def component_rows(trip_id: int, participant_ids: list[int], count: int, types: np.ndarray,
+                   rng: np.random.Generator, first: int = 0) -> list[dict]:
+    """Random components of a trip: ~10% shared (no participant), ~5% free and ~5% inactive.
+
+    Args:
+        types (np.ndarray): (type id, category id) pairs to draw from
+        first (int): Number of the first component, used in the names"""
+    picked = types[rng.integers(0, len(types), count)]
+    participants = rng.choice(np.array(participant_ids), count) if participant_ids else np.zeros(count, dtype=int)
+    participants[rng.random(count) < 0.1] = 0
+    base_cost = rng.gamma(2.0, 100.0, count).round(2)
+    base_cost[rng.random(count) < 0.05] = 0
+    currencies = rng.choice(list(RATES), count)
+    start = datetime(2025, 1, 1)
+    start_days = rng.integers(0, 365, count)
+    lengths = rng.integers(0, 8, count)
+    active = rng.random(count) >= 0.05
+    return [{
+        "trip_id": trip_id,
+        "category_id": int(picked[i, 1]),
+        "type_id": int(picked[i, 0]),
+        "participant_id": int(participants[i]) or None,
+        "component_name": f"Component {first + i}",
+        "base_cost": float(base_cost[i]),
+        "currency": str(currencies[i]),
+        "start_date": start + timedelta(days=int(start_days[i])),
+        "end_date": start + timedelta(days=int(start_days[i] + lengths[i])),
+        "is_active": bool(active[i]),
+    } for i in range(count)]
+
+
+def generate(components: int, users: int = 10, trips_per_user: int = 5, participants_per_trip: int = 4,
+             other_components: int = 100, seed: int = 0, batch_size: int = BATCH_SIZE) -> dict:
+    """Fill an empty database with synthetic data and commit it. The first trip of the first user is the one
+    the benchmarks use, it gets all the components; every other trip gets other_components of them.
+
+    Args:
+        components (int): Components of the benchmarked trip
+        users (int): Number of users
+        trips_per_user (int): Trips of every user
+        participants_per_trip (int): Participants of every trip
+        other_components (int): Components of every other trip
+        seed (int): Seed of the random generator, the same arguments always generate the same data
+        batch_size (int): Rows per INSERT statement
+
+    Returns:
+        dict: Ids of the benchmarked user and trip, and the number of rows of every table"""
+    rng = np.random.default_rng(seed)
+    db.create_all()
+    populate_initial_data()
+    now = datetime.now(timezone.utc)
+    insert_rows(ExchangeRates, [{"currency_to": currency, "rate": rate, "last_updated": now} for currency, rate in RATES.items()])
+    password_hash = generate_password_hash(PASSWORD)
+    insert_rows(User, [{"username": f"bench{i}", "email": f"bench{i}@example.com", "password_hash": password_hash,
+                        "preferred_currency": "PLN" if i % 2 == 0 else "EUR"} for i in range(users)], batch_size)
+    user_ids = db.session.scalars(sa.select(User.id).order_by(User.id)).all()
+    insert_rows(Trip, [{"user_id": user_id, "trip_name": f"Trip {t} of bench{u}"}
+                       for u, user_id in enumerate(user_ids) for t in range(trips_per_user)], batch_size)
+    trip_ids = db.session.scalars(sa.select(Trip.id).order_by(Trip.id)).all()
+    insert_rows(Participant, [{"trip_id": trip_id, "participant_name": f"Participant {p}"}
+                              for trip_id in trip_ids for p in range(participants_per_trip)], batch_size)
+    participants = {}
+    for trip_id, participant_id in db.session.execute(sa.select(Participant.trip_id, Participant.id).order_by(Participant.id)):
+        participants.setdefault(trip_id, []).append(participant_id)
+    types = np.array(db.session.execute(sa.select(ComponentType.id, ComponentType.category_id)).all())
+    for trip_id in trip_ids:
+        count = components if trip_id == trip_ids[0] else other_components
+        for start in range(0, count, batch_size): # Generated per batch, so 1M components are never all in memory
+            rows = component_rows(trip_id, participants.get(trip_id, []), min(batch_size, count - start), types, rng, start)
+            db.session.execute(sa.insert(Component.__table__), rows)
+    TripCostSummary.rebuild()
+    db.session.commit()
+    counts = {name: db.session.scalar(sa.select(sa.func.count()).select_from(model))
+              for name, model in (("users", User), ("trips", Trip), ("participants", Participant), ("components", Component))}
+    return {"user_id": user_ids[0], "username": "bench0", "trip_id": trip_ids[0], "counts": counts}
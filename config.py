@@ -6,6 +6,40 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'ultra-secret'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
+    RATES_API_URL = os.environ.get('RATES_API_URL') or 'https://api.fxratesapi.com/latest'
+    RATES_FALLBACK_URLS = [url.strip() for url in (os.environ.get('RATES_FALLBACK_URLS') or '').split(',') if url.strip()] # Comma separated providers answering like RATES_API_URL, asked concurrently with it
+    RATES_CONNECT_TIMEOUT = float(os.environ.get('RATES_CONNECT_TIMEOUT') or 3.05)
+    RATES_READ_TIMEOUT = float(os.environ.get('RATES_READ_TIMEOUT') or 10)
+    RATES_MAX_RETRIES = int(os.environ.get('RATES_MAX_RETRIES') or 3)
+    RATES_BACKOFF_FACTOR = float(os.environ.get('RATES_BACKOFF_FACTOR') or 0.5)
+    RATES_POOL_SIZE = int(os.environ.get('RATES_POOL_SIZE') or 4)
+    RATES_BREAKER_THRESHOLD = int(os.environ.get('RATES_BREAKER_THRESHOLD') or 5) # Consecutive failures before the API is left alone
+    RATES_BREAKER_RESET = float(os.environ.get('RATES_BREAKER_RESET') or 300) # Seconds before the API is tried again
+    DASH_CLIENTSIDE_FILTERING = os.environ.get('DASH_CLIENTSIDE_FILTERING', '').lower() in ('1', 'true', 'yes') # Filter the dashboard in the browser
+    TRIP_DATA_CACHE_SIZE = int(os.environ.get('TRIP_DATA_CACHE_SIZE') or 64) # Trip datasets kept in memory by each worker for the dashboard
+    FIGURE_CACHE_SIZE = int(os.environ.get('FIGURE_CACHE_SIZE') or 256) # Rendered dashboard figures kept in memory by each worker
+    RATE_CACHE_TTL = int(os.environ.get('RATE_CACHE_TTL') or 3600) # Seconds before the in-process rate snapshot is reloaded
+    CACHE_MISS_RELOAD_INTERVAL = float(os.environ.get('CACHE_MISS_RELOAD_INTERVAL') or 5) # Seconds a snapshot is kept before a missing key reloads it
+    REFERENCE_CACHE_TTL = int(os.environ.get('REFERENCE_CACHE_TTL') or 3600) # Seconds before the in-process categories, types and currencies are reloaded
+    TRIPS_PER_PAGE = int(os.environ.get('TRIPS_PER_PAGE') or 20) # Trips rendered on the user page and per "load more"
+    COMPONENTS_PER_PAGE = int(os.environ.get('COMPONENTS_PER_PAGE') or 50) # Components rendered on the trip page and per "load more"
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE') or 1000) # Components inserted per statement by bulk imports
+    IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS') or 100) # Row errors reported back by a bulk import
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 1000) # Components read and encoded at a time by trip exports
+    REPORTS_DIR = os.environ.get('REPORTS_DIR') or os.path.join(basedir, 'reports') # Where report workers write the built reports
+    REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS') or 2) # Processes of the report_worker command
+    REPORT_POLL_INTERVAL = float(os.environ.get('REPORT_POLL_INTERVAL') or 1.0) # Seconds between report queue polls of an idle worker
+    REPORT_JOB_TIMEOUT = int(os.environ.get('REPORT_JOB_TIMEOUT') or 600) # Seconds after which a running report job is requeued
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO' # Level of the app logger
+    LOG_LEVELS = os.environ.get('LOG_LEVELS') or '' # Levels of other loggers, e.g. "sqlalchemy.engine=INFO,werkzeug=WARNING", malformed entries are skipped
+    LOG_FILE = os.environ.get('LOG_FILE') or os.path.join('logs', 'travel_planner.log') # JSON lines log written outside of debug mode
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES') or 10 * 1024 * 1024) # Size at which the log file is rotated
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT') or 10) # Rotated log files kept
+    LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT') or 100) # Debug and info records let through per call site and window, 0 disables the limit
+    LOG_RATE_WINDOW = float(os.environ.get('LOG_RATE_WINDOW') or 60) # Seconds of the log rate limit window
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(basedir, 'metrics') # Where every worker process writes its metrics for /metrics, emptied before the server starts
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None # Bearer token of /metrics scrapes, the route is disabled without one
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL') or 1.0) # Seconds between metrics writes of a worker, the delay before its requests show up in /metrics
     INIT_CATEGORIES = [
         'Accommodation',
         'Food',
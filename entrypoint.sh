@@ -22,5 +22,8 @@ else
     echo "Exchange rates update failed or already up-to-date."
 fi
 
+echo "Clearing metrics of previous runs..."
+rm -rf "${METRICS_DIR:-metrics}"
+
 echo "Starting Flask application..."
 exec gunicorn -b :5000 -w 4 travel-planner:app
\ No newline at end of file
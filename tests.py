@@ -1,12 +1,41 @@
+import csv
+import io
 import os
-os.environ['DATABASE_URL'] = 'sqlite://'
+import tempfile
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or 'sqlite://' # e.g. a MySQL test database, for its query plans
+os.environ['METRICS_DIR'] = os.path.join(tempfile.gettempdir(), 'travel_planner_test_metrics')
 
 from datetime import datetime, timezone, timedelta
 import unittest
-from app import app, db
-from app.models import User, Trip, Component, Participant, ComponentCategory, ComponentType, ExchangeRates, get_exchange_rate
+import sqlalchemy as sa
+from unittest import mock
+from app import app, db, metrics_registry
+from app.models import User, Trip, Component, Participant, ComponentCategory, ComponentType, ExchangeRates, ExchangeRateHistory, TripCostSummary, ReportJob, get_exchange_rate, rate_cache, convert_many, reference_catalog, populate_initial_data
+from app.plotlydash.cache import LRUCache, trip_data_cache
+from app.plotlydash.data import fetch_trip_key, get_trip_data
+from app.plotlydash.columnar import TripDataset, SHARED_PARTICIPANT
+from app.plotlydash.dashboard import filter_df
+from app.exchange_rates.rates import update_exchange_rates, RateFetcher, CircuitOpenError
+from app.bulk_import.components import import_components
+from app.reports.worker import run_job
+from app.forms import ComponentForm, TripForm
+from wtforms.validators import ValidationError
+from app.logging_setup import LogPipeline, RateLimitFilter, parse_log_levels
+from app.loadtest.harness import LoadStats, format_report
+from app.routes import get_category_choices, get_type_choices, get_currency_choices
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import json
+import logging
+import re
+import threading
+import time
+import zipfile
+import requests
 from hashlib import md5
 from decimal import Decimal
+import numpy as np
+import pandas as pd
 
         
 class UserModelCase(unittest.TestCase):
@@ -14,6 +43,8 @@ class UserModelCase(unittest.TestCase):
         self.app_context = app.app_context()
         self.app_context.push()
         db.create_all()
+        rate_cache.invalidate()
+        reference_catalog.invalidate()
         
         # Populate exchange rates for PLN and USD
         db.session.add(ExchangeRates(currency_to="PLN", rate=1.0))
@@ -86,6 +117,172 @@ class UserModelCase(unittest.TestCase):
         # Trip with components should calculate total cost correctly
         self.assertEqual(t.get_total_cost(), 500.0) 
         
+    def test_cost_summary(self):
+        """Test SQL-side cost aggregation with subtotals by category, participant and activity."""
+        u = User(username="traveler", email="traveler@example.com", preferred_currency="USD")
+        db.session.add(u)
+        db.session.commit()
+        t = Trip(user_id=u.id, trip_name="Summary Trip")
+        db.session.add(t)
+        db.session.commit()
+        p = Participant(trip_id=t.id, participant_name="Anna")
+        db.session.add(p)
+        db.session.commit()
+        db.session.add_all([
+            Component(trip=t, category_id=1, type_id=1, component_name="Hotel", base_cost=400, currency="PLN", participant_id=p.id),
+            Component(trip=t, category_id=2, type_id=1, component_name="Dinner", base_cost=50, currency="USD"),
+            Component(trip=t, category_id=2, type_id=1, component_name="Snack", base_cost=0, currency="USD"),
+            Component(trip=t, category_id=2, type_id=1, component_name="Lunch", base_cost=20, currency="USD", is_active=False),
+        ])
+        db.session.commit()
+        summary = t.get_cost_summary()
+        self.assertEqual(summary["currency"], "USD")
+        self.assertEqual(summary["total"], 170.0)
+        self.assertEqual(summary["active_total"], 150.0)
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(summary["by_category"], {1: 100.0, 2: 70.0})
+        self.assertEqual(summary["by_participant"], {p.id: 100.0, None: 70.0})
+        self.assertEqual(summary["by_active"], {True: 150.0, False: 20.0})
+        self.assertEqual(sum(group["paid_count"] for group in summary["groups"]), 3)
+        self.assertEqual(t.get_total_cost(), 170.0)
+        
+    def test_incremental_cost_summary(self):
+        """Test that the stored cost summary follows component changes and matches the live aggregate."""
+        u = User(username="traveler", email="traveler@example.com", preferred_currency="USD")
+        db.session.add(u)
+        db.session.commit()
+        t = Trip(user_id=u.id, trip_name="Summary Trip")
+        db.session.add(t)
+        db.session.commit()
+        p = Participant(trip_id=t.id, participant_name="Anna")
+        db.session.add(p)
+        db.session.commit()
+        hotel = Component(trip_id=t.id, category_id=1, type_id=1, component_name="Hotel", base_cost=400, currency="PLN", participant_id=p.id)
+        dinner = Component(trip_id=t.id, category_id=2, type_id=1, component_name="Dinner", base_cost=50, currency="USD")
+        for component in (hotel, dinner):
+            db.session.add(component)
+            TripCostSummary.add_component(component)
+        db.session.commit()
+        # Edit, deactivate and remove the participant like the routes do
+        TripCostSummary.add_component(dinner, sign=-1)
+        dinner.base_cost = 60
+        TripCostSummary.add_component(dinner)
+        TripCostSummary.add_component(hotel, sign=-1)
+        hotel.is_active = False
+        TripCostSummary.add_component(hotel)
+        hotel.participant_id = None
+        TripCostSummary.remove_participant(t.id, p.id)
+        db.session.commit()
+        self.assertEqual(TripCostSummary.find_drift(), [])
+        self.assertEqual(t.get_cost_summary(stored=True), t.get_cost_summary())
+        self.assertEqual(u.get_trip_totals(), {t.id: 60.0})
+        # Drift is detected and fixed by a rebuild
+        db.session.execute(sa.update(TripCostSummary).values(total_cost=0))
+        self.assertEqual(len(TripCostSummary.find_drift()), 2)
+        TripCostSummary.rebuild()
+        db.session.commit()
+        self.assertEqual(TripCostSummary.find_drift(), [])
+        # Adds to a key whose row doesn't exist yet, as two concurrent first components would, share one row
+        key = {"trip_id": t.id, "category_id": 3, "participant_id": None, "currency": "PLN", "is_active": True}
+        TripCostSummary.add(key, 10, 1, 1)
+        TripCostSummary.add(key, 15, 1, 1)
+        db.session.commit()
+        rows = db.session.scalars(sa.select(TripCostSummary).where(TripCostSummary.category_id == 3)).all()
+        self.assertEqual([(row.participant_id, row.total_cost, row.component_count) for row in rows],
+                         [(TripCostSummary.SHARED_PARTICIPANT, 25, 2)])
+        
+    def test_trip_data_cache(self):
+        """Test that dashboard data is cached per trip data version."""
+        trip_data_cache.clear()
+        u = User(username="traveler", email="traveler@example.com")
+        db.session.add(u)
+        db.session.commit()
+        t = Trip(user_id=u.id, trip_name="Cached Trip")
+        db.session.add(t)
+        db.session.add(Component(trip=t, category_id=1, type_id=1, component_name="Hotel", base_cost=100, currency="PLN"))
+        db.session.commit()
+        key = fetch_trip_key(t.id)
+        self.assertEqual(key, {"trip_id": t.id, "version": 0, "currency": "PLN"})
+        self.assertEqual(get_trip_data(key)[0].component_name.tolist(), ["Hotel"])
+        self.assertEqual(len(trip_data_cache), 1)
+        # Keys of other versions or currencies than the current ones are neither fetched nor cached
+        for forged in ({**key, "version": 5}, {**key, "currency": "USD"}):
+            self.assertIsNone(get_trip_data(forged))
+        self.assertEqual(len(trip_data_cache), 1)
+        Trip.bump_data_version(t.id)
+        db.session.commit()
+        self.assertEqual(fetch_trip_key(t.id)["version"], 1)
+        trip_data_cache.evict_trip(t.id)
+        self.assertEqual(len(trip_data_cache), 0)
+
+    def test_filter_df(self):
+        """Test filtering trip data by category, participant and cost."""
+        data = {
+            "component_name": ["Hotel", "Dinner", "Museum", "Walk"],
+            "category_name": ["Accommodation", "Food", "Entertainment", "Other"],
+            "base_cost": [100.0, 20.0, 10.0, 0.0],
+            "participant_id": [1, 2, None, None],
+            "exchange_rate": [1.0, 1.0, 1.0, 1.0],
+        }
+        df = filter_df(data, [], [], True)
+        self.assertEqual(len(df), 4)
+        df = filter_df(data, ["Accommodation", "Entertainment", "Other"], [1, -1], False)
+        self.assertEqual(sorted(df["component_name"]), ["Hotel", "Museum"])
+        df = filter_df(data, [], [2], True)
+        self.assertEqual(list(df["component_name"]), ["Dinner"])
+
+    def test_trip_dataset(self):
+        """Test the columnar encoding and single mask filtering of trip data."""
+        dataset = TripDataset.from_dict({
+            "component_name": ["Hotel", "Dinner", "Lunch"],
+            "category_name": ["Accommodation", "Food", "Food"],
+            "base_cost": [Decimal("100.50"), Decimal("20"), Decimal("0")],
+            "participant_id": [1, None, 2],
+            "exchange_rate": [1.0, 1.0, 1.0],
+        })
+        self.assertEqual(dataset.base_cost.dtype, np.float64)
+        self.assertEqual(list(dataset.categories), ["Accommodation", "Food"])
+        self.assertEqual(dataset.category_codes.tolist(), [0, 1, 1])
+        self.assertEqual(dataset.participant_id.tolist(), [1, SHARED_PARTICIPANT, 2])
+        mask = dataset.mask(["Food"], [SHARED_PARTICIPANT, 2], True)
+        self.assertEqual(mask.tolist(), [False, True, True])
+        self.assertEqual(dataset.to_frame(dataset.mask([], [], False))["component_name"].tolist(), ["Hotel", "Dinner"])
+
+    def test_trip_dataset_payload(self):
+        """Test that the compact browser payload decodes back to the same trip data."""
+        dataset = TripDataset.from_dict({
+            "component_name": ["Hotel", "Dinner", "Lunch"],
+            "category_name": ["Accommodation", "Food", "Food"],
+            "type_name": ["Hotel", "Restaurant", "Restaurant"],
+            "base_cost": [100.5, 20.0, 0.0],
+            "participant_id": [1, None, 2],
+            "start_date": [datetime(2025, 5, 1), None, datetime(1969, 12, 31)],
+            "original_currency": ["PLN", "USD", "PLN"],
+            "exchange_rate": [1.0, 4.0, 1.0],
+        })
+        payload = json.loads(json.dumps(dataset.to_payload()))
+        self.assertEqual(payload["dictionaries"]["category_name"], ["Accommodation", "Food"])
+        self.assertEqual(payload["codes"]["category_name"]["dtype"], "i1")
+        self.assertEqual(payload["currency_rates"], [1.0, 4.0])
+        decoded = TripDataset.from_payload(payload)
+        pd.testing.assert_frame_equal(decoded.to_frame(), dataset.to_frame())
+        payload["format"] = 0
+        with self.assertRaises(ValueError):
+            TripDataset.from_payload(payload)
+
+    def test_lru_cache_eviction(self):
+        """Test that the LRU cache keeps only the most recently used entries."""
+        cache = LRUCache(maxsize=2)
+        cache.set((1, "a"), "a")
+        cache.set((1, "b"), "b")
+        cache.get((1, "a"))
+        cache.set((2, "c"), "c")
+        self.assertIsNone(cache.get((1, "b")))
+        self.assertEqual(cache.get((1, "a")), "a")
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        cache.evict_trip(1)
+        self.assertEqual(len(cache), 1)
+        
     def test_preferred_currency_default(self):
         """Test the default preferred currency for a new user."""
         u = User(username="traveler", email="traveler@example.com")
@@ -159,7 +356,662 @@ class UserModelCase(unittest.TestCase):
         """Test error raised for missing exchange rate."""
         with self.assertRaises(ValueError):
             get_exchange_rate("PLN", "XYZ")
-            
+        # Aggregated in SQL, costs without a rate raise instead of being left out of the totals
+        u = User(username="traveler", email="traveler@example.com")
+        t = Trip(user=u, trip_name="Rate Trip")
+        c = Component(trip=t, category_id=1, type_id=1, component_name="Hotel", base_cost=100, currency="XYZ")
+        db.session.add_all([u, t, c])
+        TripCostSummary.add_component(c)
+        db.session.commit()
+        for summarize in (t.get_cost_summary, lambda: t.get_cost_summary(stored=True), u.get_trip_totals):
+            with self.assertRaises(ValueError):
+                summarize()
+        c.currency = "PLN"
+        TripCostSummary.rebuild()
+        db.session.commit()
+        self.assertEqual(u.get_trip_totals(), {t.id: 100.0})
+        with self.assertRaises(ValueError):
+            u.get_trip_totals("XYZ")
+        with self.assertRaises(ValueError):
+            t.get_cost_summary("XYZ")
+
+    def test_exchange_rate_cache(self):
+        """Test that rate lookups are served from the cached snapshot until it is invalidated."""
+        self.assertEqual(get_exchange_rate("PLN", "USD"), Decimal("0.25"))
+        version = rate_cache.snapshot().version
+        # Changing the table directly is not seen until the cache is invalidated
+        db.session.get(ExchangeRates, "USD").rate = 0.5
+        db.session.commit()
+        self.assertEqual(get_exchange_rate("PLN", "USD"), Decimal("0.25"))
+        self.assertEqual(rate_cache.snapshot().version, version)
+        rate_cache.invalidate()
+        self.assertEqual(get_exchange_rate("PLN", "USD"), Decimal("0.5"))
+        self.assertGreater(rate_cache.snapshot().version, version)
+        # Unknown codes reload a fresh snapshot at most once per interval, and an unchanged table keeps the version
+        version = rate_cache.snapshot().version
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        sa.event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            for _ in range(5):
+                with self.assertRaises(ValueError):
+                    get_exchange_rate("PLN", "XYZ")
+            self.assertEqual(statements, [])
+            with mock.patch.object(rate_cache, "miss_reload_interval", 0):
+                with self.assertRaises(ValueError):
+                    get_exchange_rate("PLN", "XYZ")
+            self.assertEqual(len(statements), 1)
+        finally:
+            sa.event.remove(db.engine, "before_cursor_execute", count_statement)
+        self.assertEqual(rate_cache.snapshot().version, version)
+
+    def test_convert_many(self):
+        """Test vectorized conversion of mixed currency amounts."""
+        converted = convert_many([Decimal("100.00"), 25, 0], ["PLN", "USD", "USD"], "USD")
+        self.assertEqual(converted.tolist(), [25.0, 25.0, 0.0])
+        self.assertEqual(convert_many([], [], "PLN").tolist(), [])
+        with self.assertRaises(ValueError):
+            convert_many([1], ["XYZ"], "PLN")
+
+    def test_update_exchange_rates_upsert(self):
+        """Test that a rates refresh updates existing rows, adds new ones and stamps them all."""
+        stale = datetime.now(timezone.utc) - timedelta(days=2)
+        for exchange_rate in db.session.scalars(sa.select(ExchangeRates)):
+            exchange_rate.last_updated = stale
+        db.session.commit()
+        rates = {"PLN": 1.0, "USD": 0.26, "EUR": 0.23}
+        with mock.patch("app.exchange_rates.rates.fetch_rates", return_value={"rates": rates}):
+            self.assertEqual(update_exchange_rates(), 0)
+            # Second call within 24 hours is a no-op
+            self.assertEqual(update_exchange_rates(), -1)
+        stored = db.session.scalars(sa.select(ExchangeRates)).all()
+        self.assertEqual({r.currency_to: float(r.rate) for r in stored}, rates)
+        self.assertEqual(len({r.last_updated for r in stored}), 1)
+        self.assertEqual(get_exchange_rate("PLN", "EUR"), Decimal("0.23"))
+        self.assertEqual(len(db.session.scalars(sa.select(ExchangeRateHistory)).all()), 3)
+
+    def test_historical_cost(self):
+        """Test converting components at the rates in force on their start dates."""
+        u = User(username="traveler", email="traveler@example.com", preferred_currency="PLN")
+        db.session.add(u)
+        db.session.commit()
+        t = Trip(user_id=u.id, trip_name="History Test Trip")
+        db.session.add(t)
+        db.session.commit()
+        db.session.add_all([
+            ExchangeRateHistory(currency_to="PLN", rate_date=datetime(2024, 1, 1).date(), rate=1.0),
+            ExchangeRateHistory(currency_to="USD", rate_date=datetime(2024, 1, 1).date(), rate=0.2),
+            ExchangeRateHistory(currency_to="USD", rate_date=datetime(2024, 6, 1).date(), rate=0.5),
+        ])
+        db.session.add_all([
+            # Before the first snapshot, converted at the current rate of 0.25
+            Component(trip=t, category_id=1, type_id=1, component_name="Early", base_cost=10, currency="USD", start_date=datetime(2023, 12, 1)),
+            Component(trip=t, category_id=1, type_id=1, component_name="Winter", base_cost=10, currency="USD", start_date=datetime(2024, 3, 1)),
+            Component(trip=t, category_id=1, type_id=1, component_name="Summer", base_cost=10, currency="USD", start_date=datetime(2024, 7, 1)),
+            Component(trip=t, category_id=1, type_id=1, component_name="Undated", base_cost=10, currency="USD"),
+        ])
+        db.session.commit()
+        self.assertEqual(t.get_historical_cost(), 40.0 + 50.0 + 20.0 + 40.0)
+
+    def test_trip_page_query_count(self):
+        """Test that the trip page is rendered in a fixed number of queries, independent of the number of components."""
+        u = User(username="traveler", email="traveler@example.com")
+        db.session.add(u)
+        db.session.commit()
+        t = Trip(user_id=u.id, trip_name="Query Trip")
+        db.session.add(t)
+        db.session.add(Participant(trip=t, participant_name="Anna"))
+        db.session.commit()
+        trip_id, user_id = t.id, u.id
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        counts = []
+        for added in (1, 9): # 1, then 10 components
+            db.session.add_all(Component(trip_id=trip_id, category_id=1, type_id=1, component_name=f"C{i}", base_cost=10, currency="PLN")
+                               for i in range(added))
+            db.session.commit()
+            engine = db.engine
+            statements.clear()
+            # Request in its own app context and session, like outside of tests
+            self.app_context.pop()
+            sa.event.listen(engine, "before_cursor_execute", count_statement)
+            try:
+                response = client.get(f"/trip/{trip_id}")
+            finally:
+                sa.event.remove(engine, "before_cursor_execute", count_statement)
+                self.app_context.push()
+            self.assertEqual(response.status_code, 200)
+            page = response.get_data(as_text=True)
+            self.assertEqual((page.count("js/delete_scripts.js"), page.count("css/trip.css")), (1, 1))
+            counts.append(len(statements))
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[0], 5) # User, trip, components, participants and the cost summary
+
+
+    def test_reference_catalog(self):
+        """Test that component form choices and validation are served from the reference catalog without SQL."""
+        db.session.add(ComponentType(category_id=1, type_name="Hostel"))
+        db.session.commit()
+        reference_catalog.invalidate()
+        version = reference_catalog.snapshot().version
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        sa.event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            with app.test_request_context(method="POST", data={"component_name": "Hostel", "category_id": "1", "type_id": "2",
+                                                               "base_cost": "10", "currency": "USD"}):
+                form = ComponentForm(meta={"csrf": False})
+                form.category_id.choices = get_category_choices()
+                form.type_id.choices = get_type_choices(category_id=form.category_id.data)
+                form.currency.choices = get_currency_choices()
+                form.participant_name.choices = []
+                self.assertTrue(form.validate(), form.errors)
+        finally:
+            sa.event.remove(db.engine, "before_cursor_execute", count_statement)
+        self.assertEqual(statements, [])
+        self.assertEqual(form.category_id.choices, [(1, "Accommodation")])
+        self.assertEqual(form.type_id.choices, [(2, "Hostel")])
+        self.assertEqual(form.currency.choices, [("PLN", "PLN"), ("USD", "USD")])
+        # Invalid ids don't reload a fresh catalog, so posting them to the forms costs no SQL
+        sa.event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            for _ in range(5):
+                self.assertFalse(reference_catalog.has_category(999))
+                self.assertFalse(reference_catalog.has_type(999))
+                self.assertFalse(reference_catalog.has_currency("XYZ"))
+        finally:
+            sa.event.remove(db.engine, "before_cursor_execute", count_statement)
+        self.assertEqual(statements, [])
+        self.assertEqual(reference_catalog.snapshot().version, version)
+        # Once the interval has passed, rows added by another process are found by a reload on miss
+        db.session.add(ExchangeRates(currency_to="EUR", rate=0.23))
+        db.session.commit()
+        self.assertFalse(reference_catalog.has_currency("EUR"))
+        with mock.patch.object(reference_catalog, "miss_reload_interval", 0):
+            self.assertTrue(reference_catalog.has_currency("EUR"))
+        # Seeding invalidates the catalog
+        populate_initial_data()
+        self.assertIn("Food", reference_catalog.snapshot().categories.values())
+        self.assertGreater(reference_catalog.snapshot().version, version + 1)
+
+    def test_keyset_pagination(self):
+        """Test that trips and components are paged with keyset cursors, each row appearing exactly once."""
+        u = User(username="traveler", email="traveler@example.com")
+        db.session.add(u)
+        db.session.commit()
+        created_at = datetime(2025, 1, 1)
+        trips = [Trip(user_id=u.id, trip_name=f"Trip {i}", created_at=created_at + timedelta(days=i // 2)) for i in range(5)]
+        db.session.add_all(trips)
+        db.session.commit()
+        db.session.add_all(Component(trip=trips[0], category_id=1, type_id=1, component_name=f"C{i}", base_cost=1, currency="PLN")
+                           for i in range(5))
+        db.session.commit()
+        # Model level, trips with the same created_at are ordered by id
+        page = u.get_trips_page(limit=3)
+        self.assertEqual([t.trip_name for t in page], ["Trip 0", "Trip 1", "Trip 2"])
+        page = u.get_trips_page(after=(page[-1].created_at, page[-1].id), limit=3)
+        self.assertEqual([t.trip_name for t in page], ["Trip 3", "Trip 4"])
+        components = trips[0].get_components_with_details(after_id=trips[0].get_components_with_details(limit=2)[-1].id)
+        self.assertEqual([c.component_name for c in components], ["C2", "C3", "C4"])
+        # Following the "load more" links of the pages
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(u.id)
+        with mock.patch.dict(app.config, {"TRIPS_PER_PAGE": 2, "COMPONENTS_PER_PAGE": 2}):
+            for url, pattern in ((f"/user/{u.username}", r'(Trip \d), trip_id'), 
+                                 (f"/trip/{trips[0].id}", r'>(C\d),')):
+                names, pages = [], 0
+                while url:
+                    page = client.get(url).get_data(as_text=True)
+                    names += re.findall(pattern, page)
+                    next_url = re.search(r'data-url="([^"]+)"', page)
+                    url = next_url.group(1).replace("&amp;", "&") if next_url else None
+                    pages += 1
+                self.assertEqual(names, sorted(names))
+                self.assertEqual((len(names), len(set(names)), pages), (5, 5, 3))
+        self.assertEqual(client.get(f"/user/{u.username}/trips?after=broken").status_code, 400)
+
+    def test_component_toggle_delta(self):
+        """Test that toggling a component answers with the changed fragment and delta instead of a page reload."""
+        u = User(username="traveler", email="traveler@example.com")
+        db.session.add(u)
+        db.session.commit()
+        t = Trip(user_id=u.id, trip_name="Delta Trip")
+        c = Component(trip=t, category_id=1, type_id=1, component_name="Hotel", base_cost=100, currency="PLN")
+        db.session.add_all([t, c])
+        TripCostSummary.add_component(c)
+        db.session.commit()
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(u.id)
+        response = client.post(f"/activate_component/{c.id}")
+        self.assertEqual(response.status_code, 200)
+        delta = response.get_json()["delta"]
+        self.assertEqual(delta["component_id"], c.id)
+        self.assertIn("box-inactive.svg", delta["component_html"])
+        self.assertIn("Total cost: 0.00 PLN", delta["total_html"])
+        self.assertIn("(+100.00 PLN inactive)", delta["total_html"])
+        self.assertEqual(delta["data_key"], {"trip_id": t.id, "version": 1, "currency": "PLN"})
+
+    def test_bulk_import(self):
+        """Test that valid import rows are inserted in batches and summarized while invalid ones are reported."""
+        u = User(username="traveler", email="traveler@example.com")
+        t = Trip(user=u, trip_name="Import Trip")
+        category = ComponentCategory(category_name="Transport")
+        db.session.add_all([u, t, category])
+        db.session.commit()
+        db.session.add_all([ComponentType(category_id=category.id, type_name="Bus"), Participant(trip=t, participant_name="Anna")])
+        db.session.commit()
+        rows = ("component_name,category,type,base_cost,currency,participant,start_date,is_active\n"
+                "Bus 1,transport,bus,10.5,PLN,anna,2025-01-01,true\n"
+                "Bus 2,Transport,Bus,20,usd,,,no\n"
+                "Bus 3,Transport,Train,-5,GBP,Bob,01/01/2025,maybe\n"
+                "Bus 4,Transport,Bus,0,,,,\n")
+        result = import_components(t.id, io.BytesIO(rows.encode()), "csv", batch_size=2)
+        self.assertEqual((result["imported"], result["error_count"]), (3, 1))
+        self.assertEqual(result["errors"][0]["line"], 4)
+        self.assertEqual(len(result["errors"][0]["errors"]), 6)
+        self.assertEqual(sorted(db.session.scalars(sa.select(Component.component_name).where(Component.trip_id == t.id))), ["Bus 1", "Bus 2", "Bus 4"])
+        self.assertEqual(TripCostSummary.find_drift(), [])
+        self.assertEqual(db.session.get(Trip, t.id).data_version, 1)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(u.id)
+        lines = b'{"component_name": "Bus 5", "category": "Transport", "type": "Bus", "base_cost": 5}\n[1, 2]\n'
+        response = client.post(f"/import_components/{t.id}", data={"file": (io.BytesIO(lines), "rows.jsonl")})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["imported"], 1)
+        self.assertEqual(response.get_json()["errors"], [{"line": 2, "errors": ["Each line must be a JSON object."]}])
+        response = client.post(f"/import_components/{t.id}", data={"file": (io.BytesIO(lines), "rows.txt")})
+        self.assertEqual(response.status_code, 400)
+
+    def test_trip_export(self):
+        """Test that the summary route streams the trip components as CSV, JSON lines and XLSX in chunks."""
+        u = User(username="traveler", email="traveler@example.com", preferred_currency="USD")
+        t = Trip(user=u, trip_name="Export Trip")
+        category = ComponentCategory(category_name="Transport")
+        db.session.add_all([u, t, category])
+        db.session.commit()
+        bus = ComponentType(category_id=category.id, type_name="Bus")
+        p = Participant(trip=t, participant_name="Anna")
+        db.session.add_all([bus, p])
+        db.session.commit()
+        db.session.add_all([Component(trip=t, category_id=category.id, type_id=bus.id, component_name=f"Bus {i}", base_cost=10 * i,
+                                      currency="PLN", participant_id=p.id if i % 2 else None, start_date=datetime(2025, 1, i))
+                            for i in range(1, 6)])
+        db.session.commit()
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(u.id)
+        with mock.patch.dict(app.config, {"EXPORT_CHUNK_SIZE": 2}):
+            response = client.get(f"/summary/{t.id}")
+            self.assertTrue(response.is_streamed)
+            self.assertIn("Export_Trip.csv", response.headers["Content-Disposition"])
+            rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+            self.assertEqual([row["component_name"] for row in rows], [f"Bus {i}" for i in range(1, 6)])
+            self.assertEqual(rows[0], {**rows[0], "participant": "Anna", "converted_cost": "2.50", "converted_currency": "USD",
+                                       "is_active": "true", "start_date": "2025-01-01", "end_date": ""})
+            self.assertEqual(rows[1]["participant"], "")
+            lines = client.get(f"/summary/{t.id}?format=jsonl").get_data(as_text=True).splitlines()
+            self.assertEqual(json.loads(lines[4])["converted_cost"], 12.5)
+            response = client.get(f"/summary/{t.id}?format=xlsx")
+            with zipfile.ZipFile(io.BytesIO(response.get_data())) as workbook:
+                self.assertIsNone(workbook.testzip())
+                sheet = workbook.read("xl/worksheets/sheet1.xml").decode()
+            self.assertEqual(sheet.count("<row>"), 6)
+            self.assertIn('<t xml:space="preserve">Bus 5</t>', sheet)
+        self.assertEqual(client.get(f"/summary/{t.id}?format=pdf").status_code, 400)
+
+    def test_report_jobs(self):
+        """Test that report requests are queued, claimed by a single worker, built and downloaded when done."""
+        u = User(username="traveler", email="traveler@example.com")
+        t = Trip(user=u, trip_name="Report Trip")
+        db.session.add_all([u, t, Component(trip=t, category_id=1, type_id=1, component_name="Hotel", base_cost=100, currency="PLN")])
+        db.session.commit()
+        trip_id = t.id
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(u.id)
+        self.assertEqual(client.get(f"/summary/{trip_id}?format=html").status_code, 405)
+        response = client.post(f"/summary/{trip_id}?format=html")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(client.get(response.get_json()["status_url"]).get_json()["status"], "queued")
+        job = ReportJob.claim_next("test-worker")
+        self.assertEqual((job.id, job.status), (response.get_json()["id"], "running"))
+        self.assertIsNone(ReportJob.claim_next("other-worker"))
+        with tempfile.TemporaryDirectory() as reports_dir, mock.patch.dict(app.config, {"REPORTS_DIR": reports_dir}):
+            self.assertEqual(run_job(job.id), "done")
+            db.session.expire_all() # Finished in the worker's own session
+            status = client.get(f"/report_job/{job.id}").get_json()
+            self.assertEqual(status["status"], "done")
+            report = client.get(status["download_url"])
+            self.assertIn("Report_Trip_report.html", report.headers["Content-Disposition"])
+            self.assertIn("<h1>Report Trip</h1>", report.get_data(as_text=True))
+            self.assertIn("Cost breakdown by category", report.get_data(as_text=True))
+            report.close()
+        # Jobs of deleted trips fail instead of stopping the worker, deleted jobs are skipped
+        failed = ReportJob(user_id=u.id, trip_id=trip_id + 1, report_format="html")
+        stale = ReportJob(user_id=u.id, trip_id=trip_id, report_format="html", status="running", worker="slow-worker",
+                          started_at=datetime.now(timezone.utc) - timedelta(hours=1))
+        db.session.add_all([failed, stale])
+        db.session.commit()
+        self.assertEqual(ReportJob.claim_next("test-worker").id, failed.id)
+        self.assertEqual(run_job(failed.id), "failed")
+        self.assertIsNone(run_job(failed.id + 100))
+        # Stale running jobs are requeued, the slow run can't record its result over the new one
+        self.assertEqual(ReportJob.requeue_stale(60), 1)
+        self.assertEqual(ReportJob.claim_next("test-worker").id, stale.id)
+        self.assertFalse(ReportJob.finish(stale.id, "slow-worker", "failed", None, "Too slow"))
+        self.assertTrue(ReportJob.finish(stale.id, "test-worker", "done", "report.html", None))
+        db.session.expire_all()
+        self.assertEqual((stale.status, stale.worker, stale.error), ("done", "test-worker", None))
+
+    def test_metrics(self):
+        """Test that requests and Dash callbacks are measured with their SQL and merged across processes on /metrics."""
+        u = User(username="traveler", email="traveler@example.com")
+        t = Trip(user=u, trip_name="Metrics Trip")
+        db.session.add_all([u, t])
+        db.session.commit()
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(u.id)
+        with tempfile.TemporaryDirectory() as metrics_dir, mock.patch.object(metrics_registry, "directory", metrics_dir):
+            metrics_registry.reset()
+            self.assertEqual(client.get(f"/trip/{t.id}").status_code, 200)
+            payload = {"output": "data-store-trip.data", "outputs": {"id": "data-store-trip", "property": "data"},
+                       "inputs": [{"id": "url", "property": "pathname", "value": f"/dash/{t.id}"}],
+                       "changedPropIds": ["url.pathname"]}
+            self.assertEqual(client.post("/dash/_dash-update-component", json=payload).status_code, 200)
+            client.post("/dash/_dash-update-component", json=dict(payload, output="made-up.data"))
+            # Another worker's series are added to this one's
+            with open(os.path.join(metrics_dir, "metrics_1.json"), "w") as file:
+                json.dump([["travel_planner_request_sql_queries", ["trip", ""], [0] * 10 + [1, 0, 2000]]], file)
+            self.assertEqual(client.get("/metrics").status_code, 404) # Disabled without a token
+            with mock.patch.dict(app.config, METRICS_TOKEN="scrape-token"):
+                self.assertEqual(client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code, 401)
+                response = client.get("/metrics", headers={"Authorization": "Bearer scrape-token"})
+            metrics_registry.reset()
+        text = response.get_data(as_text=True)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        self.assertIn('travel_planner_request_duration_seconds_count{endpoint="trip",callback=""} 1', text)
+        self.assertIn('travel_planner_request_sql_queries_bucket{endpoint="trip",callback="",le="+Inf"} 2', text)
+        self.assertIn('travel_planner_request_sql_queries_bucket{endpoint="trip",callback="",le="1000.0"} 2', text)
+        queries = re.search(r'travel_planner_request_sql_queries_sum\{endpoint="trip",callback=""\} (\d+)', text)
+        self.assertGreater(int(queries.group(1)), 2000)
+        dash_endpoint = 'endpoint="/dash/_dash-update-component"'
+        self.assertIn(f'travel_planner_request_sql_queries_count{{{dash_endpoint},callback="data-store-trip.data"}} 1', text)
+        self.assertIn(f'travel_planner_response_size_bytes_count{{{dash_endpoint},callback="unknown"}} 1', text)
+
+class StubRatesHandler(BaseHTTPRequestHandler):
+    """Stub of the exchange rates API: /latest answers with fixed rates, /slow stalls and /error fails."""
+    calls = 0
+
+    def do_GET(self):
+        StubRatesHandler.calls += 1
+        url = urlparse(self.path)
+        if url.path == "/slow":
+            time.sleep(1)
+        if url.path == "/error":
+            self.send_response(503)
+            self.end_headers()
+            return
+        base = parse_qs(url.query).get("base", ["PLN"])[0]
+        body = json.dumps({"base": base, "rates": {base: 1.0, "USD": 0.25}}).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except BrokenPipeError:
+            pass # Client gave up waiting on /slow
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RateFetcherCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubRatesHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubRatesHandler.calls = 0
+
+    def make_fetcher(self, *paths, retries=0, threshold=5):
+        return RateFetcher(base_urls=[self.url + path for path in paths], connect_timeout=1, read_timeout=0.2, retries=retries,
+                           backoff_factor=0, pool_size=4, breaker_threshold=threshold, breaker_reset=60)
+
+    def test_fetch(self):
+        """Test fetching the PLN rates, the only base stored, over pooled connections."""
+        fetcher = self.make_fetcher("/latest")
+        for _ in range(2):
+            self.assertEqual(fetcher.fetch("PLN")["rates"], {"PLN": 1.0, "USD": 0.25})
+        self.assertEqual(StubRatesHandler.calls, 2)
+        fetcher.close()
+
+    def test_provider_fallback(self):
+        """Test that providers are asked concurrently and the first successful answer is used."""
+        fetcher = self.make_fetcher("/error", "/slow", "/latest")
+        started = time.monotonic()
+        self.assertEqual(fetcher.fetch("EUR")["rates"], {"EUR": 1.0, "USD": 0.25})
+        self.assertLess(time.monotonic() - started, 0.2) # Didn't wait for the stalled provider
+        fetcher.close()
+        fetcher = self.make_fetcher("/error", "/slow")
+        with self.assertRaises(requests.exceptions.HTTPError): # Error of the preferred provider
+            fetcher.fetch("PLN")
+        fetcher.close()
+
+    def test_read_timeout(self):
+        """Test that a stalled API raises instead of hanging."""
+        fetcher = self.make_fetcher("/slow")
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            fetcher.fetch("PLN")
+        fetcher.close()
+
+    def test_retries_and_circuit_breaker(self):
+        """Test bounded retries and that the breaker stops calls after repeated failures."""
+        fetcher = self.make_fetcher("/error", retries=2, threshold=2)
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                fetcher.fetch("PLN")
+        self.assertEqual(StubRatesHandler.calls, 6)
+        with self.assertRaises(CircuitOpenError):
+            fetcher.fetch("PLN")
+        self.assertEqual(StubRatesHandler.calls, 6)
+        fetcher.close()
+
+
+class LoggingCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("tests.pipeline")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.handlers.clear()
+
+    def test_rate_limit_filter(self):
+        """Test that hot-path records are limited per call site, with the dropped count on the next window's first record."""
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        handler.addFilter(RateLimitFilter(limit=2, window=60))
+        self.logger.addHandler(handler)
+        def hot_path(i):
+            self.logger.info("Hot path %s", i)
+            self.logger.warning("Warning %s", i)
+        with mock.patch("app.logging_setup.time.monotonic", return_value=0):
+            for i in range(5):
+                hot_path(i)
+        self.assertEqual([r.getMessage() for r in records if r.levelno == logging.INFO], ["Hot path 0", "Hot path 1"])
+        self.assertEqual(len([r for r in records if r.levelno == logging.WARNING]), 5)
+        with mock.patch("app.logging_setup.time.monotonic", return_value=61):
+            hot_path(5)
+        self.assertEqual((records[-2].getMessage(), records[-2].suppressed), ("Hot path 5", 3))
+
+    def test_parse_log_levels(self):
+        """Test that logger levels are parsed leniently, skipping entries without a name or a known level."""
+        levels, skipped = parse_log_levels(" sqlalchemy.engine = info,werkzeug,urllib3=LOUD,=DEBUG,dash=WARNING,")
+        self.assertEqual(levels, {"sqlalchemy.engine": "INFO", "dash": "WARNING"})
+        self.assertEqual(skipped, ["werkzeug", "urllib3=LOUD", "=DEBUG"])
+        self.assertEqual(parse_log_levels(""), ({}, []))
+
+    def test_log_pipeline(self):
+        """Test that records are formatted lazily and written as JSON lines by the listener thread."""
+        formatted = []
+        class Argument:
+            def __str__(self):
+                formatted.append(self)
+                return "argument"
+        with tempfile.TemporaryDirectory() as log_dir:
+            pipeline = LogPipeline(os.path.join(log_dir, "app.log"), max_bytes=1024 * 1024, backup_count=1, rate_limit=0, rate_window=60)
+            self.logger.addHandler(pipeline.handler)
+            self.logger.debug("Disabled %s", Argument())
+            self.assertEqual(formatted, [])
+            self.logger.info("Enabled %s", Argument())
+            try:
+                raise ValueError("boom")
+            except ValueError:
+                self.logger.exception("Failed")
+            pipeline.stop()
+            with open(os.path.join(log_dir, "app.log")) as file:
+                entries = [json.loads(line) for line in file]
+            pipeline.file_handler.close()
+        self.assertEqual(len(formatted), 1)
+        self.assertEqual([(e["level"], e["message"]) for e in entries], [("INFO", "Enabled argument"), ("ERROR", "Failed")])
+        self.assertEqual(entries[0]["logger"], "tests.pipeline")
+        self.assertIn("ValueError: boom", entries[1]["exception"])
+
+
+class QueryPlanCase(unittest.TestCase):
+    """Query plans of the hot access paths, on SQLite or on the database of TEST_DATABASE_URL (MySQL). A plan that
+    scans a whole table or sorts the rows itself means an index is missing."""
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        reference_catalog.invalidate()
+        db.session.add(ComponentCategory(category_name="Accommodation"))
+        db.session.add(ComponentType(category_id=1, type_name="Hotel"))
+        for u in range(3):
+            user = User(username=f"planner{u}", email=f"planner{u}@example.com")
+            for t in range(20):
+                trip = Trip(user=user, trip_name=f"Trip {t}")
+                participants = [Participant(trip=trip, participant_name=f"P{p}") for p in range(3)]
+                db.session.add_all(Component(trip=trip, participant=participants[c % 3], category_id=1, type_id=1,
+                                             component_name=f"C{c}", base_cost=10, currency="PLN", is_active=c % 4 != 0)
+                                   for c in range(10))
+            db.session.add(user)
+        db.session.commit()
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE TABLE user, trip, participant, component" if self.mysql else "ANALYZE")
+        self.user = db.session.scalar(sa.select(User).where(User.username == "planner1"))
+        self.trip = db.session.scalar(self.user.trips.select().order_by(Trip.id).limit(1))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @property
+    def mysql(self) -> bool:
+        return db.engine.dialect.name == "mysql"
+
+    def capture(self, call) -> list[tuple[str, tuple]]:
+        """Run call and return the (statement, parameters) it executed."""
+        statements = []
+        def capture_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+        sa.event.listen(db.engine, "before_cursor_execute", capture_statement)
+        try:
+            call()
+        finally:
+            sa.event.remove(db.engine, "before_cursor_execute", capture_statement)
+        return statements
+
+    def assert_plan_uses(self, statement: str, parameters: tuple, index: str) -> None:
+        """Assert that the plan of a statement walks index and never scans a table or sorts in a temporary structure."""
+        with db.engine.connect() as conn:
+            if self.mysql:
+                plan = [dict(row._mapping) for row in conn.exec_driver_sql("EXPLAIN " + statement, parameters)]
+                self.assertFalse([step for step in plan if step["type"] == "ALL" or "filesort" in (step["Extra"] or "")], plan)
+                self.assertIn(index, [step["key"] for step in plan], plan)
+            else:
+                plan = [row.detail for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+                self.assertFalse([step for step in plan if (step.startswith("SCAN ") and step != "SCAN CONSTANT ROW")
+                                  or "TEMP B-TREE" in step], plan)
+                self.assertTrue([step for step in plan if f"INDEX {index} " in step], plan)
+
+    def test_active_components_plan(self):
+        """Test that the active components of a trip are read from the (trip_id, is_active) index."""
+        [(statement, parameters)] = self.capture(self.trip.get_active_components)
+        self.assert_plan_uses(statement, parameters, "ix_component_trip_id_is_active")
+
+    def test_trip_name_check_plan(self):
+        """Test that the trip name check of TripForm is answered from the (user_id, trip_name) index."""
+        def validate():
+            with app.test_request_context():
+                form = TripForm(user_id=self.user.id, meta={"csrf": False})
+                form.trip_name.data = "Trip 7"
+                with self.assertRaises(ValidationError):
+                    form.validate_trip_name(form.trip_name)
+        [(statement, parameters)] = self.capture(validate)
+        self.assert_plan_uses(statement, parameters, "ix_trip_user_id_trip_name")
+
+    def test_trips_page_plan(self):
+        """Test that pages of a user's trips walk the (user_id, created_at) index in order, with and without a cursor."""
+        trips = self.user.get_trips_page(limit=5)
+        for after in (None, (trips[-1].created_at, trips[-1].id)):
+            [(statement, parameters)] = self.capture(lambda: self.user.get_trips_page(after, limit=5))
+            self.assert_plan_uses(statement, parameters, "ix_trip_user_id_created_at")
+
+    def test_delete_participant_plan(self):
+        """Test that unassigning the components of a deleted participant searches them by participant_id."""
+        participant_id = db.session.scalar(self.trip.participants.select().limit(1)).id
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(self.user.id)
+        statements = self.capture(lambda: self.assertEqual(client.post(f"/delete_participant/{participant_id}").status_code, 200))
+        [(statement, parameters)] = [s for s in statements if s[0].startswith("UPDATE component")]
+        self.assert_plan_uses(statement, parameters, "ix_component_participant_id")
+
+
+class LoadTestCase(unittest.TestCase):
+    def test_load_stats(self):
+        """Test that the latencies of the virtual users are merged into per-endpoint percentiles and error rates."""
+        users = [LoadStats(), LoadStats()]
+        for i in range(100):
+            users[i % 2].record("GET /trip/<id>", (i + 1) / 1000)
+        users[0].record("POST /login", 0.5)
+        users[1].record("POST /login", 30.0, "ReadTimeout: timed out")
+        stats = LoadStats()
+        for user in users:
+            stats.merge(user)
+        summary = stats.summary(duration=10)
+        self.assertEqual((summary["GET /trip/<id>"]["requests"], summary["GET /trip/<id>"]["rps"]), (100, 10.0))
+        self.assertEqual((summary["GET /trip/<id>"]["p50_ms"], summary["GET /trip/<id>"]["p99_ms"]), (50.5, 99.0))
+        self.assertEqual((summary["POST /login"]["errors"], summary["POST /login"]["error_rate"]), (1, 0.5))
+        self.assertEqual((summary["total"]["requests"], summary["total"]["errors"]), (102, 1))
+        report = format_report({"server_url": "http://127.0.0.1:5000", "workers": 4, "users": 2, "duration": 10,
+                                "endpoints": summary, "last_errors": stats.last_errors, "setup_errors": {}})
+        self.assertIn("Last error of POST /login: ReadTimeout: timed out", report)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)